@@ -0,0 +1,374 @@
+"""
+功能：盤中價格區間警示。
+
+- 由 eps_report 的估值（沿用 valuation_cache.json，沒有快取時從 stock_data.db 計算）取出每檔股票的
+  便宜價 / 昂貴價與近兩月營收年增率，依代號排序存成平行陣列，報價以 np.searchsorted 對應到列。
+- 每次輪詢只處理價格有變動的股票，以 eps_report.classify_color 重新分類（與報表相同的紅/橘/綠規則），
+  顏色改變即為跨越區間；起始顏色取自 last_color.json，因此只會通知報表之後的新變化。
+- 警示先進入去抖動佇列：新顏色需維持 --debounce 秒才送出（期間回到原顏色則取消），
+  同一批合併成一則 Telegram 訊息，兩則訊息至少間隔 --min-interval 秒，由背景執行緒傳送。
+- 報價來源為證交所 MIS 即時報價；stub 子指令提供本機假報價伺服器，搭配 --base-url 測試。
+
+使用方法：
+    python alert_engine.py watch
+    python alert_engine.py watch --portfolio-cfg portfolio.cfg --interval 10 --until 13:35
+
+本機測試：
+    python alert_engine.py stub --port 8766 &
+    python alert_engine.py watch --base-url http://127.0.0.1:8766 --interval 1 --debounce 2 --ticks 30
+"""
+
+import os
+import json
+import math
+import time
+import queue
+import sqlite3
+import argparse
+import threading
+import zlib
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+import requests
+
+import eps_report
+import fast_decode
+import runlog
+import universe
+
+log = runlog.get_logger("alert_engine")
+
+DB_NAME = "stock_data.db"
+MIS_HOST = "https://mis.twse.com.tw"
+MIS_HOME_PATH = "/stock/index.jsp"
+MIS_QUOTE_PATH = "/stock/api/getStockInfo.jsp"
+BATCH_SIZE = 50
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Referer": MIS_HOST + MIS_HOME_PATH,
+}
+
+# 與 eps_report 相同的股票清單：portfolio 或 twse.cfg + otc.cfg，排除已下市代號
+def load_all_stocks(portfolio_cfg=None):
+    if portfolio_cfg and os.path.exists(portfolio_cfg):
+        all_stocks = eps_report.load_stock_codes_and_names(portfolio_cfg)
+    else:
+        all_stocks = {**eps_report.load_stock_codes_and_names("twse.cfg"),
+                      **eps_report.load_stock_codes_and_names("otc.cfg")}
+    return universe.filter_listed(all_stocks)
+
+# 上櫃代號集合（登錄表與 otc.cfg），其餘視為上市
+def load_otc_codes():
+    return set(universe.load_registry()["otc"]) | {code for code, _ in universe.read_cfg("otc.cfg")}
+
+# 取得估值：優先沿用 eps_report 的估值快取，資料庫有變動時才重新計算並寫回快取
+def load_valuations(db_name, report_year, all_stocks):
+    cache_key = eps_report.valuation_cache_key(db_name, report_year, all_stocks)
+    valuations = eps_report.load_valuation_cache(eps_report.VALUATION_CACHE_JSON, cache_key)
+    if valuations is not None:
+        log.info("沿用 eps_report 估值快取")
+        return valuations
+    conn = sqlite3.connect(db_name)
+    try:
+        valuations = eps_report.compute_valuations(conn, all_stocks, report_year)
+    finally:
+        conn.close()
+    eps_report.save_valuation_cache(eps_report.VALUATION_CACHE_JSON, cache_key, valuations)
+    return valuations
+
+# 門檻表：依代號排序的平行陣列
+def build_thresholds(valuations):
+    records = sorted(valuations, key=lambda v: v["stock_no"])
+    yoy_2m = np.array([v["last_2m"] for v in records], dtype=float).reshape(len(records), 2)
+    return {
+        "code": np.array([v["stock_no"] for v in records], dtype=str),
+        "name": np.array([v["name"] for v in records], dtype=object),
+        "cheap": np.array([v["cheap"] for v in records], dtype=float),
+        "expensive": np.array([v["expensive"] for v in records], dtype=float),
+        "yoy_1m": yoy_2m[:, 0],
+        "yoy_2m": yoy_2m[:, 1],
+    }
+
+# 以二分搜尋把報價代號對應到門檻表的列，回傳 (列索引, 是否在門檻表中)
+def locate(table_codes, codes):
+    if len(table_codes) == 0 or len(codes) == 0:
+        return np.array([], dtype=np.intp), np.zeros(len(codes), dtype=bool)
+    idx = np.minimum(np.searchsorted(table_codes, codes), len(table_codes) - 1)
+    found = table_codes[idx] == codes
+    return idx[found], found
+
+class BandWatcher:
+    """保存每檔股票的最新價格與顏色，每次報價只重新分類價格有變動的股票。"""
+
+    def __init__(self, thresholds, initial_colors=None):
+        self.t = thresholds
+        initial_colors = initial_colors or {}
+        self.price = np.full(len(thresholds["code"]), np.nan)
+        # 空字串表示尚未分類，第一次收到報價時只記錄顏色不發警示
+        self.color = np.array([initial_colors.get(code, "") for code in thresholds["code"]], dtype=object)
+        self.last_changed = 0
+
+    # 套用一批報價，回傳跨越區間的股票
+    def update(self, codes, prices):
+        rows, found = locate(self.t["code"], codes)
+        prices = prices[found]
+        moved = prices != self.price[rows]
+        rows, prices = rows[moved], prices[moved]
+        self.last_changed = len(rows)
+        if not len(rows):
+            return []
+
+        self.price[rows] = prices
+        new = eps_report.classify_color(prices, self.t["cheap"][rows], self.t["expensive"][rows],
+                                        self.t["yoy_1m"][rows], self.t["yoy_2m"][rows])
+        old = self.color[rows]
+        self.color[rows] = new
+        crossed = np.flatnonzero((old != new) & (old != ""))
+        return [{
+            "code": self.t["code"][rows[i]],
+            "name": self.t["name"][rows[i]],
+            "from": old[i],
+            "to": new[i],
+            "price": float(prices[i]),
+            "cheap": float(self.t["cheap"][rows[i]]),
+            "expensive": float(self.t["expensive"][rows[i]]),
+        } for i in crossed]
+
+class AlertQueue:
+    """去抖動警示佇列：新顏色維持 debounce 秒才送出，批次合併並限制傳送間隔。"""
+
+    def __init__(self, send, debounce=60, min_interval=30):
+        self.send = send
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.pending = {}
+        self.last_sent = 0
+        self.outbox = queue.Queue()
+        self.sender = threading.Thread(target=self._send_loop, daemon=True)
+        self.sender.start()
+
+    def _send_loop(self):
+        while True:
+            text = self.outbox.get()
+            if text is None:
+                break
+            try:
+                self.send(text)
+            except Exception as e:
+                runlog.incr("alerts_failed")
+                log.error("傳送警示失敗", error=e)
+
+    # 加入一筆跨越；尚未送出前又回到原顏色則取消，否則以最新的顏色與價格為準
+    def push(self, now, alert):
+        item = self.pending.get(alert["code"])
+        if item is None:
+            self.pending[alert["code"]] = dict(alert, since=now)
+        elif item["from"] == alert["to"]:
+            del self.pending[alert["code"]]
+        else:
+            item.update(to=alert["to"], price=alert["price"], since=now)
+
+    # 把已維持 debounce 秒的警示合併成一則訊息送出，回傳送出的筆數；force 只略過傳送間隔限制
+    def flush(self, now, force=False):
+        if not force and now - self.last_sent < self.min_interval:
+            return 0
+        due = sorted(code for code, item in self.pending.items() if now - item["since"] >= self.debounce)
+        if not due:
+            return 0
+        lines = [format_alert(self.pending.pop(code)) for code in due]
+        self.outbox.put("*盤中價格區間警示*\n\n" + "\n".join(lines))
+        self.last_sent = now
+        return len(lines)
+
+    # 送出已到期的警示後停止傳送執行緒；尚未維持 debounce 秒的變動視為雜訊捨棄
+    def close(self):
+        self.flush(time.time(), force=True)
+        self.outbox.put(None)
+        self.sender.join()
+
+def format_alert(item):
+    arrow = eps_report.COLOR_EMOJI_MAP.get(item["from"], "⚪") + "→" + eps_report.COLOR_EMOJI_MAP.get(item["to"], "⚪")
+    return (f"{arrow} `{item['code']}` {item['name']} {item['price']:.2f}"
+            f"（便宜 {item['cheap']:.2f} / 昂貴 {item['expensive']:.2f}）")
+
+# 有設定 BOT_TOKEN / CHAT_ID 時以 Telegram 傳送，否則只寫入紀錄
+def telegram_sender(text):
+    if eps_report.BOT_TOKEN and eps_report.CHAT_ID:
+        eps_report.send_telegram_text(eps_report.BOT_TOKEN, eps_report.CHAT_ID, text)
+    else:
+        log.info("警示（未設定 Telegram）", text=text)
+
+class MisQuoteSource:
+    """證交所 MIS 即時報價，每次請求最多 BATCH_SIZE 檔。"""
+
+    def __init__(self, codes, otc_codes, base_url=None):
+        self.host = (base_url or MIS_HOST).rstrip("/")
+        self.channels = [f"{'otc' if code in otc_codes else 'tse'}_{code}.tw" for code in codes]
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.warmed = False
+
+    # 回傳 (代號陣列, 成交價陣列)，本次尚無成交（"-"）的股票不列入
+    def fetch(self):
+        if not self.warmed:
+            # MIS 需要先取得首頁的 session cookie
+            self.session.get(self.host + MIS_HOME_PATH, timeout=10)
+            self.warmed = True
+        codes, prices = [], []
+        for i in range(0, len(self.channels), BATCH_SIZE):
+            url = (f"{self.host}{MIS_QUOTE_PATH}?ex_ch={'|'.join(self.channels[i:i + BATCH_SIZE])}"
+                   f"&json=1&delay=0&_={int(time.time() * 1000)}")
+            resp = self.session.get(url, timeout=10)
+            resp.raise_for_status()
+            items = (fast_decode.loads(resp.content) or {}).get("msgArray") or []
+            columns = fast_decode.record_columns(items, ["c", "z"])
+            codes.append(fast_decode.to_codes(columns["c"]))
+            prices.append(fast_decode.to_numbers(columns["z"]))
+        if not codes:
+            return np.array([], dtype=str), np.array([], dtype=float)
+        codes, prices = np.concatenate(codes), np.concatenate(prices)
+        valid = (codes != "") & ~np.isnan(prices)
+        return codes[valid], prices[valid]
+
+def _parse_until(text):
+    hour, minute = text.split(":")
+    return datetime.now().replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+
+def watch(args):
+    if not os.path.exists(DB_NAME):
+        log.error("找不到資料庫", db=DB_NAME)
+        return
+    report_year = args.report_year if args.report_year else datetime.now().year
+    all_stocks = load_all_stocks(args.portfolio_cfg)
+    thresholds = build_thresholds(load_valuations(DB_NAME, report_year, all_stocks))
+    if len(thresholds["code"]) == 0:
+        log.warning("沒有可監看的股票")
+        return
+
+    watcher = BandWatcher(thresholds, eps_report.load_last_colors(eps_report.LAST_COLOR_JSON))
+    source = MisQuoteSource(thresholds["code"].tolist(), load_otc_codes(), args.base_url)
+    alerts = AlertQueue(telegram_sender, args.debounce, args.min_interval)
+    until = _parse_until(args.until) if args.until else None
+    log.info("開始監看", stocks=len(thresholds["code"]), interval=args.interval)
+
+    tick = 0
+    try:
+        while True:
+            try:
+                codes, prices = source.fetch()
+            except Exception as e:
+                runlog.incr("quote_failures")
+                log.warning("抓取即時報價失敗", error=e)
+            else:
+                crossings = watcher.update(codes, prices)
+                now = time.time()
+                for alert in crossings:
+                    alerts.push(now, alert)
+                if crossings:
+                    runlog.incr("crossings", len(crossings))
+                    log.info("跨越區間", quotes=len(codes), changed=watcher.last_changed, crossings=len(crossings))
+            runlog.incr("alerts_sent", alerts.flush(time.time()))
+            tick += 1
+            if args.ticks and tick >= args.ticks:
+                break
+            if until and datetime.now() >= until:
+                log.info("已到收盤時間")
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        log.info("中止監看")
+    finally:
+        alerts.close()
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+# 本機假報價伺服器：價格在便宜價與昂貴價之間來回擺盪，約一成的報價為尚無成交 "-"
+class StubQuoteHandler(BaseHTTPRequestHandler):
+    bands = {}
+    period = 60.0
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _quote(self, code, now):
+        seed = zlib.crc32(code.encode("utf-8"))
+        if (seed + int(now)) % 10 == 0:
+            return "-"
+        cheap, expensive = self.bands.get(code, (None, None))
+        if cheap is None:
+            cheap = 10 + seed % 500
+            expensive = cheap * 1.5
+        mid, amp = (cheap + expensive) / 2, (expensive - cheap) * 0.7
+        phase = (seed % 1000) / 1000 * 2 * math.pi
+        return f"{mid + amp * math.sin(2 * math.pi * now / self.period + phase):.2f}"
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path != MIS_QUOTE_PATH:
+            return self._send(200, "ok", "text/html")
+        now = time.time()
+        channels = parse_qs(parts.query).get("ex_ch", [""])[0].split("|")
+        items = []
+        for channel in channels:
+            if "_" not in channel:
+                continue
+            ex, code = channel.split("_", 1)
+            code = code.replace(".tw", "")
+            items.append({"c": code, "ex": ex, "z": self._quote(code, now)})
+        self._send(200, json.dumps({"msgArray": items, "rtcode": "0000"}), "application/json")
+
+# 有估值快取時依各股的便宜價 / 昂貴價擺盪，否則以代號產生固定區間
+def serve_stub(port, period):
+    try:
+        with open(eps_report.VALUATION_CACHE_JSON, "rb") as f:
+            valuations = fast_decode.loads(f.read()).get("valuations") or []
+    except Exception:
+        valuations = []
+    StubQuoteHandler.bands = {v["stock_no"]: (v["cheap"], v["expensive"]) for v in valuations}
+    StubQuoteHandler.period = period
+    server = _ThreadingServer(("127.0.0.1", port), StubQuoteHandler)
+    log.info("假報價伺服器", url=f"http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+
+    wch = sub.add_parser("watch")
+    wch.add_argument("--report-year", type=int)
+    wch.add_argument("--portfolio-cfg", type=str)
+    wch.add_argument("--interval", type=float, default=5, help="輪詢間隔秒數")
+    wch.add_argument("--debounce", type=float, default=60, help="新顏色需維持的秒數")
+    wch.add_argument("--min-interval", type=float, default=30, help="兩則警示訊息的最短間隔秒數")
+    wch.add_argument("--until", type=str, default="13:35", help="監看到此時間 HH:MM，空字串表示不限")
+    wch.add_argument("--ticks", type=int, help="輪詢指定次數後結束")
+    wch.add_argument("--base-url", type=str, help="以此取代 MIS 主機（例如本機假報價伺服器）")
+
+    stub = sub.add_parser("stub")
+    stub.add_argument("--port", type=int, default=8766)
+    stub.add_argument("--period", type=float, default=60, help="假報價擺盪週期秒數")
+    args = parser.parse_args()
+
+    if args.command == "watch":
+        runlog.setup("alert_engine")
+        watch(args)
+    elif args.command == "stub":
+        serve_stub(args.port, args.period)
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+功能：比較交易所 JSON 回應的原解析方式與 fast_decode 的耗時。
+
+- 各端點的測試資料放在 fixtures/decode/ 下並納入版本控制，預設直接使用：
+  依交易所實際回應格式整理的小型樣本（上市 300 檔、上櫃 200 檔、年度資料 34 年）。
+  --record 會從交易所下載目前的回應覆寫樣本；--synthetic 只為缺少的端點產生全市場筆數的替代資料。
+- 對每個端點重複解析多次，列出位元組數、筆數，以及原方式與 fast_decode 的中位數耗時。
+
+使用方法：
+    python bench_decode.py                 # 以 fixtures/decode/ 的樣本比較
+    python bench_decode.py --record        # 下載並保存各端點回應
+    python bench_decode.py --repeat 50
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import statistics
+from datetime import date, timedelta
+
+import requests
+
+import bulk_yearly
+import fast_decode
+import getOTC
+import getTWSE
+import price_snapshot
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "decode")
+
+# --- 原本的解析方式 ---------------------------------------------------------
+
+def legacy_prices(raw, source):
+    data = json.loads(raw)
+    prices = {}
+    for item in data:
+        try:
+            code = item[source["code_field"]].strip()
+            prices[code] = float(item[source["price_field"]])
+        except Exception:
+            continue
+    return prices
+
+def legacy_yearly(raw, layout):
+    data = json.loads(raw)
+    rows = None
+    for table in data["tables"]:
+        if "fields" in table and "年度" in table["fields"]:
+            rows = table["data"]
+            break
+    result = {}
+    for row in rows:
+        result[int(row[0]) + 1911] = [float(row[layout[name]].replace(',', ''))
+                                      for name in ("highest_price", "lowest_price", "average_close_price")]
+    return result
+
+def legacy_daily(raw, fields):
+    data = json.loads(raw)
+    for table in data.get("tables") or []:
+        names = [str(f).strip() for f in table.get("fields") or []]
+        if all(fields[k] in names for k in fields):
+            index = {k: names.index(fields[k]) for k in fields}
+            quotes = {}
+            for row in table.get("data") or []:
+                try:
+                    quotes[row[index["code"]].strip()] = tuple(
+                        float(row[index[k]].replace(",", "")) for k in ("high", "low", "close"))
+                except ValueError:
+                    continue
+            return quotes
+    return {}
+
+# --- fast_decode ------------------------------------------------------------
+
+def fast_prices(raw, source):
+    _, codes, prices = price_snapshot.parse_price_payload(raw, source)
+    return codes, prices
+
+def fast_yearly(raw, module):
+    rows = fast_decode.annual_rows(fast_decode.loads(raw))
+    return fast_decode.yearly_columns(rows, module.YEARLY_LAYOUT, module.PRICE_FIELDS)
+
+def fast_daily(raw, fields):
+    index, rows = bulk_yearly.find_quote_table(fast_decode.loads(raw), fields)
+    columns = {k: [row[i] for row in rows] for k, i in index.items()}
+    return fast_decode.to_codes(columns["code"]), [fast_decode.to_numbers(columns[k]) for k in ("high", "low", "close")]
+
+# 各端點：(下載方式, 原解析, fast_decode 解析, 計算筆數)
+ENDPOINTS = {
+    "twse_prices": {
+        "fetch": lambda: requests.get(price_snapshot.MARKET_SOURCES["twse"]["url"], timeout=60),
+        "legacy": lambda raw: legacy_prices(raw, price_snapshot.MARKET_SOURCES["twse"]),
+        "fast": lambda raw: fast_prices(raw, price_snapshot.MARKET_SOURCES["twse"]),
+        "count": lambda raw: len(json.loads(raw)),
+    },
+    "otc_prices": {
+        "fetch": lambda: requests.get(price_snapshot.MARKET_SOURCES["otc"]["url"], timeout=60),
+        "legacy": lambda raw: legacy_prices(raw, price_snapshot.MARKET_SOURCES["otc"]),
+        "fast": lambda raw: fast_prices(raw, price_snapshot.MARKET_SOURCES["otc"]),
+        "count": lambda raw: len(json.loads(raw)),
+    },
+    "twse_yearly": {
+        "fetch": lambda: requests.get(getTWSE.FMNPTK_URL.format("2330"), headers=getTWSE.HEADERS, timeout=60),
+        "legacy": lambda raw: legacy_yearly(raw, getTWSE.YEARLY_LAYOUT),
+        "fast": lambda raw: fast_yearly(raw, getTWSE),
+        "count": lambda raw: len(fast_decode.annual_rows(json.loads(raw))),
+    },
+    "otc_yearly": {
+        "fetch": lambda: requests.post(getOTC.YEARLY_STOCK_URL, headers=getOTC.HEADERS,
+                                       data={"code": "6488", "id": "", "response": "json"}, timeout=60),
+        "legacy": lambda raw: legacy_yearly(raw, getOTC.YEARLY_LAYOUT),
+        "fast": lambda raw: fast_yearly(raw, getOTC),
+        "count": lambda raw: len(fast_decode.annual_rows(json.loads(raw))),
+    },
+    "twse_daily": {
+        "fetch": lambda: requests.get(bulk_yearly.daily_url("twse", _last_weekday()), headers=bulk_yearly.HEADERS, timeout=60),
+        "legacy": lambda raw: legacy_daily(raw, bulk_yearly.MARKETS["twse"]["fields"]),
+        "fast": lambda raw: fast_daily(raw, bulk_yearly.MARKETS["twse"]["fields"]),
+        "count": lambda raw: len(bulk_yearly.find_quote_table(json.loads(raw), bulk_yearly.MARKETS["twse"]["fields"])[1]),
+    },
+    "otc_daily": {
+        "fetch": lambda: requests.get(bulk_yearly.daily_url("otc", _last_weekday()), headers=bulk_yearly.HEADERS, timeout=60),
+        "legacy": lambda raw: legacy_daily(raw, bulk_yearly.MARKETS["otc"]["fields"]),
+        "fast": lambda raw: fast_daily(raw, bulk_yearly.MARKETS["otc"]["fields"]),
+        "count": lambda raw: len(bulk_yearly.find_quote_table(json.loads(raw), bulk_yearly.MARKETS["otc"]["fields"])[1]),
+    },
+}
+
+def _last_weekday():
+    day = date.today() - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+def fixture_path(name):
+    return os.path.join(FIXTURE_DIR, f"{name}.json")
+
+def record():
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    for name, spec in ENDPOINTS.items():
+        try:
+            response = spec["fetch"]()
+            response.raise_for_status()
+        except Exception as e:
+            print(f"{name}: 下載失敗 {e}")
+            continue
+        with open(fixture_path(name), "wb") as f:
+            f.write(response.content)
+        print(f"{name}: 已保存 {len(response.content)} bytes")
+        time.sleep(3)
+
+# 依各端點實際格式產生替代資料（筆數與全市場相近）
+def synthetic():
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    rnd = random.Random(0)
+    codes = [str(1101 + i) for i in range(1300)]
+
+    def price():
+        return f"{rnd.uniform(5, 2000):,.2f}"
+
+    payloads = {
+        "twse_prices": [{"Date": "1141017", "Code": c, "Name": "名稱", "ClosingPrice": price().replace(",", ""),
+                         "MonthlyAveragePrice": price().replace(",", "")} for c in codes],
+        "otc_prices": [{"Date": "1141017", "SecuritiesCompanyCode": c, "CompanyName": "名稱",
+                        "Close": rnd.choice([price().replace(",", ""), "----"]), "Change": "+0.5",
+                        "Open": "1", "High": "1", "Low": "1", "TradingShares": "1,000"} for c in codes[:900]],
+    }
+    yearly = []
+    for year in range(80, 114):
+        roc = str(year)
+        yearly.append([roc, "1,000,000", "2,000,000", "3,000", price(), "3/01", price(), "9/01", price()])
+    payloads["twse_yearly"] = {"stat": "OK", "tables": [{"title": "年度統計", "fields": ["年度", "成交股數", "成交金額",
+                               "成交筆數", "最高價", "日期", "最低價", "日期", "收盤平均價"], "data": yearly}]}
+    payloads["otc_yearly"] = {"stat": "ok", "tables": [{"title": "年度統計", "fields": ["年度", "成交張數", "成交仟元",
+                              "成交筆數", "周轉率", "盤中最高價", "日期", "盤中最低價", "日期", "收盤平均價"],
+                              "data": [row[:4] + ["1.5", row[4], "03/01", row[6], "09/01", row[8]]
+                                       for row in yearly]}]}
+    twse_fields = ["證券代號", "證券名稱", "成交股數", "成交筆數", "成交金額", "開盤價", "最高價", "最低價", "收盤價"]
+    payloads["twse_daily"] = {"stat": "OK", "tables": [{"title": "大盤統計", "fields": ["指數", "收盤指數"], "data": []},
+                              {"title": "每日收盤行情", "fields": twse_fields,
+                               "data": [[c, "名稱", "1,000", "10", "1,000,000", price(), price(), price(),
+                                         rnd.choice([price(), "--"])] for c in codes]}]}
+    otc_fields = ["代號", "名稱", "收盤", "漲跌", "開盤", "最高", "最低", "均價", "成交股數"]
+    payloads["otc_daily"] = {"stat": "ok", "tables": [{"title": "上櫃股票行情", "fields": otc_fields,
+                             "data": [[c, "名稱", price(), "+0.1", price(), price(), price(), price(), "1,000"]
+                                      for c in codes[:900]]}]}
+    for name, payload in payloads.items():
+        if os.path.exists(fixture_path(name)):
+            continue
+        with open(fixture_path(name), "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        print(f"{name}: 已產生替代資料")
+
+def _median_ms(func, raw, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(raw)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def bench(repeat):
+    print(f"JSON 解析器: {'orjson' if fast_decode.orjson is not None else 'json'}")
+    print(f"{'端點':12s} {'bytes':>10s} {'筆數':>6s} {'原方式 ms':>10s} {'fast ms':>9s} {'倍數':>6s}")
+    for name, spec in ENDPOINTS.items():
+        path = fixture_path(name)
+        if not os.path.exists(path):
+            print(f"{name:12s} 沒有測試資料（執行 --record 或 --synthetic 補上）")
+            continue
+        with open(path, "rb") as f:
+            raw = f.read()
+        legacy = _median_ms(spec["legacy"], raw, repeat)
+        fast = _median_ms(spec["fast"], raw, repeat)
+        print(f"{name:12s} {len(raw):10d} {spec['count'](raw):6d} {legacy:10.2f} {fast:9.2f} {legacy / fast:6.1f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", action="store_true", help="從交易所下載並保存各端點回應")
+    parser.add_argument("--synthetic", action="store_true", help="為沒有錄製的端點產生替代資料")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    if args.record:
+        record()
+    if args.synthetic:
+        synthetic()
+    bench(args.repeat)
+
+if __name__ == "__main__":
+    main()
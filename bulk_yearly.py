@@ -0,0 +1,342 @@
+"""
+功能：以全市場每日收盤行情批次產生年度統計（最高價/日期、最低價/日期、平均收盤價），
+      取代 getTWSE.py / getOTC.py 每檔股票一次的 FMNPTK / yearlyStock 請求。
+
+- 上市：MI_INDEX (type=ALLBUT0999)，上櫃：dailyQuotes，每個交易日一個請求涵蓋全部代號。
+  最高/最低價的日期只有每日資料才有，交易所沒有附日期的全市場月/年彙總檔。
+- 開市日由加權指數每月成交資訊 (FMTQIK) 取得，每月一個請求，只下載實際開市日（約 245 天），
+  國定假日、颱風假等休市日不發請求；上市與上櫃兩個市場同時下載。
+- 每日資料只留下代號、最高、最低、收盤，快取於 bulk_cache/<market>/YYYYMMDD.json，中斷後可續跑；
+  當年度重算只需下載新的交易日。
+- 全年資料合併後以 groupby 一次算出所有股票的年度統計，以 executemany 寫入 YearlyData / OTCYearlyData。
+- 過去年度只缺少少數代號（少於尚未快取的交易日數）時，直接以單檔請求補齊比較省；
+  清單內但全市場資料中找不到的代號，也改用原本的單檔請求補齊。
+
+使用方法：
+    python bulk_yearly.py --market all --start-year 2020 --end-year 2024
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+import calendar
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import requests
+
+import fast_decode
+import getOTC
+import getTWSE
+import runlog
+import universe
+
+log = runlog.get_logger("bulk_yearly")
+
+DB_NAME = "stock_data.db"
+CACHE_DIR = "bulk_cache"
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Connection": "keep-alive",
+}
+
+# 各市場的全市場每日行情來源、欄位名稱、資料表與單檔補齊模組
+MARKETS = {
+    "twse": {
+        "table": "YearlyData",
+        "cfg": "twse.cfg",
+        "fields": {"code": "證券代號", "high": "最高價", "low": "最低價", "close": "收盤價"},
+        "module": getTWSE,
+        "date_style": "md",
+    },
+    "otc": {
+        "table": "OTCYearlyData",
+        "cfg": "otc.cfg",
+        "fields": {"code": "代號", "high": "最高", "low": "最低", "close": "收盤"},
+        "module": getOTC,
+        "date_style": "mmdd",
+    },
+}
+
+# getTWSE / getOTC 直接保存交易所回傳的日期字串（年度另存於 year 欄），這裡產生相同的寫法
+DATE_STYLES = {
+    "md": lambda d: f"{d.month}/{d.day:02d}",                          # 7/05
+    "mmdd": lambda d: f"{d.month:02d}/{d.day:02d}",                    # 07/05
+    "roc": lambda d: f"{d.year - 1911}/{d.month:02d}/{d.day:02d}",     # 113/07/05
+}
+
+def daily_url(market, day):
+    if market == "twse":
+        return (f"https://www.twse.com.tw/rwd/zh/afterTrading/MI_INDEX"
+                f"?date={day:%Y%m%d}&type=ALLBUT0999&response=json")
+    return (f"https://www.tpex.org.tw/www/zh-tw/afterTrading/dailyQuotes"
+            f"?date={day:%Y/%m/%d}&id=&response=json")
+
+# 在回應的 tables 中找出含所需欄位的個股行情表，回傳 {欄位: 欄位索引} 與資料列
+def find_quote_table(payload, fields):
+    index, rows = fast_decode.find_table(payload, list(fields.values()))
+    if index is None:
+        return None, []
+    return {k: index[name] for k, name in fields.items()}, rows
+
+# 將每日行情轉成代號、最高、最低、收盤四個欄位（字串），非交易日回傳空清單
+def fetch_daily_quotes(market, day, session):
+    response = session.get(daily_url(market, day), headers=HEADERS, timeout=30)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+    payload = fast_decode.loads(response.content)
+    index, rows = find_quote_table(payload or {}, MARKETS[market]["fields"])
+    if index is None:
+        return {"code": [], "high": [], "low": [], "close": []}
+    return {k: [row[i] for row in rows] for k, i in index.items()}
+
+def cache_path(market, day):
+    return os.path.join(CACHE_DIR, market, f"{day:%Y%m%d}.json")
+
+# 取得單日行情：有快取就讀快取，否則下載後寫入快取
+def load_daily_quotes(market, day, session, sleep_seconds):
+    path = cache_path(market, day)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f), False
+    quotes = fetch_daily_quotes(market, day, session)
+    # 近幾日的空回應可能只是尚未公布，不寫入快取
+    if quotes["code"] or day < date.today() - timedelta(days=3):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(quotes, f, ensure_ascii=False)
+    time.sleep(sleep_seconds)
+    return quotes, True
+
+def last_day(year):
+    return min(date(year, 12, 31), date.today() - timedelta(days=1))
+
+def weekdays(year, month):
+    day = date(year, month, 1)
+    while day.month == month and day <= last_day(year):
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+def calendar_url(year, month):
+    return f"https://www.twse.com.tw/rwd/zh/afterTrading/FMTQIK?date={year}{month:02d}01&response=json"
+
+# 由加權指數每月成交資訊取得該月實際開市日（民國日期 113/01/02）
+def fetch_trading_days(year, month, session):
+    response = session.get(calendar_url(year, month), headers=HEADERS, timeout=30)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+    payload = fast_decode.loads(response.content) or {}
+    # 舊版回應直接把 fields / data 放在最上層
+    index, rows = fast_decode.find_table({"tables": payload.get("tables") or [payload]}, ["日期"])
+    if index is None:
+        return []
+    days = []
+    for row in rows:
+        roc_year, month_, day = (int(p) for p in str(row[index["日期"]]).strip().split("/"))
+        days.append(date(roc_year + 1911, month_, day))
+    return days
+
+class TradingCalendar:
+    """各年度的開市日，每月查詢一次並快取於 bulk_cache/calendar/，兩個市場的下載執行緒共用。"""
+
+    def __init__(self, sleep_seconds):
+        self.sleep_seconds = sleep_seconds
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.years = {}
+
+    def _month(self, year, month):
+        path = os.path.join(CACHE_DIR, "calendar", f"{year}{month:02d}.json")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return [date.fromisoformat(d) for d in json.load(f)]
+        try:
+            days = fetch_trading_days(year, month, self.session)
+        except Exception as e:
+            log.warning("開市日查詢失敗，改為逐一下載平日", year=year, month=month, error=e)
+            return list(weekdays(year, month))
+        # 當月尚未結束（或剛結束、資料可能未齊）時不寫入快取
+        if date(year, month, calendar.monthrange(year, month)[1]) < date.today() - timedelta(days=3):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump([d.isoformat() for d in days], f)
+        runlog.incr("calendar_months_fetched")
+        time.sleep(self.sleep_seconds)
+        return days
+
+    def days(self, year):
+        with self.lock:
+            if year not in self.years:
+                last = last_day(year)
+                months = range(1, last.month + 1) if last.year == year else []
+                self.years[year] = [d for m in months for d in self._month(year, m) if d <= last]
+            return self.years[year]
+
+# 合併指定交易日的每日行情成一張長表
+def build_year_frame(market, days, session, sleep_seconds):
+    frames = []
+    for day in days:
+        quotes, downloaded = load_daily_quotes(market, day, session, sleep_seconds)
+        if not quotes["code"]:
+            continue
+        if downloaded:
+            runlog.incr("days_fetched", market=market)
+            log.debug("每日行情下載完成", market=market, day=f"{day:%Y-%m-%d}", rows=len(quotes["code"]))
+        frames.append(pd.DataFrame({
+            "stock_no": pd.Series(quotes["code"], dtype=str).str.strip(),
+            "day": day,
+            "high": fast_decode.to_numbers(quotes["high"]),
+            "low": fast_decode.to_numbers(quotes["low"]),
+            "close": fast_decode.to_numbers(quotes["close"]),
+        }))
+    if not frames:
+        return pd.DataFrame(columns=["stock_no", "day", "high", "low", "close"])
+    return pd.concat(frames, ignore_index=True)
+
+def format_dates(days, style):
+    return [DATE_STYLES[style](d) for d in pd.to_datetime(pd.Series(days))]
+
+# 依資料表中單檔請求寫入的日期判斷寫法；資料表還沒有資料時用該市場的預設寫法
+def detect_date_style(conn, table, default):
+    row = conn.execute(f"""
+        SELECT highest_date FROM {table} WHERE highest_date LIKE '%/%'
+        ORDER BY length(highest_date), highest_date LIMIT 1
+    """).fetchone()
+    if row is None:
+        return default
+    parts = row[0].split("/")
+    if len(parts) == 3:
+        return "roc"
+    if len(parts[0]) == 1:
+        return "md"
+    # 最短的月份仍是兩位數：以 0 開頭表示補零，10~12 月則無法判斷
+    return "mmdd" if parts[0].startswith("0") else default
+
+# 向量化計算所有股票的年度最高/最低價（含日期）與平均收盤價
+def aggregate_year(df, date_style):
+    df = df.dropna(subset=["high", "low", "close"])
+    df = df[(df["high"] > 0) & (df["low"] > 0)]
+    if df.empty:
+        return pd.DataFrame(columns=["stock_no", "highest_price", "highest_date",
+                                     "lowest_price", "lowest_date", "average_close_price"])
+    grouped = df.groupby("stock_no")
+    high_rows = df.loc[grouped["high"].idxmax()]
+    low_rows = df.loc[grouped["low"].idxmin()]
+    result = pd.DataFrame({
+        "stock_no": high_rows["stock_no"].to_numpy(),
+        "highest_price": high_rows["high"].to_numpy(),
+        "highest_date": format_dates(high_rows["day"].to_numpy(), date_style),
+    }).merge(pd.DataFrame({
+        "stock_no": low_rows["stock_no"].to_numpy(),
+        "lowest_price": low_rows["low"].to_numpy(),
+        "lowest_date": format_dates(low_rows["day"].to_numpy(), date_style),
+    }), on="stock_no")
+    avg_close = grouped["close"].mean().round(2)
+    result["average_close_price"] = result["stock_no"].map(avg_close).to_numpy()
+    return result
+
+def existing_codes(conn, table, year):
+    rows = conn.execute(f"SELECT stock_no FROM {table} WHERE year = ?", (year,)).fetchall()
+    return {r[0] for r in rows}
+
+def save_year_stats(conn, table, year, stats):
+    records = [
+        (row.stock_no, year, float(row.highest_price), row.highest_date,
+         float(row.lowest_price), row.lowest_date, float(row.average_close_price))
+        for row in stats.itertuples(index=False)
+    ]
+    conn.executemany(f'''
+        INSERT OR REPLACE INTO {table} (
+            stock_no, year, highest_price, highest_date, lowest_price, lowest_date, average_close_price
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', records)
+    conn.commit()
+    return len(records)
+
+# 全市場資料中缺少的代號，改用原本的單檔請求補齊
+def fill_gaps(market, codes, sleep_seconds):
+    module = MARKETS[market]["module"]
+    for stock_no in codes:
+        try:
+            raw_data = module.fetch_stock_data(stock_no)
+            module.process_and_save_data(stock_no, raw_data)
+            runlog.incr("stocks_fetched", market=market)
+            log.info("已以單檔請求補齊", market=market, stock_no=stock_no)
+        except Exception as e:
+            runlog.incr("stocks_failed", market=market)
+            log.warning("單檔補齊失敗", market=market, stock_no=stock_no, error=e)
+        time.sleep(sleep_seconds)
+
+# 下載一個市場各年度的行情並寫入年度統計；trading_calendar 為兩個市場共用的 TradingCalendar
+def run_market(market, years, sleep_seconds, gap_fill=True, trading_calendar=None):
+    trading_calendar = trading_calendar or TradingCalendar(sleep_seconds)
+    spec = MARKETS[market]
+    spec["module"].init_db()
+    listed = {code for code, _ in spec["module"].read_stock_list(spec["cfg"])} - universe.delisted_codes()
+    current_year = datetime.now().year
+    session = requests.Session()
+    conn = sqlite3.connect(DB_NAME, timeout=60)
+    gaps = set()
+    date_style = detect_date_style(conn, spec["table"], spec["date_style"])
+
+    for year in years:
+        missing = listed - existing_codes(conn, spec["table"], year)
+        # 過去年度已完整就不必重抓；當年度資料每天變動，一律重算
+        if not missing and year != current_year:
+            log.info("年度資料已完整，略過", market=market, year=year)
+            continue
+
+        days = trading_calendar.days(year)
+        uncached = sum(not os.path.exists(cache_path(market, d)) for d in days)
+        # 單檔請求一次涵蓋所有年度，缺的代號比要下載的交易日少時直接單檔補齊
+        if gap_fill and year != current_year and len(missing) < uncached:
+            log.info("缺漏代號少於待下載交易日，改以單檔請求補齊", market=market, year=year,
+                     stocks=len(missing), days=uncached)
+            gaps |= missing
+            continue
+
+        stats = aggregate_year(build_year_frame(market, days, session, sleep_seconds), date_style)
+        stats = stats[stats["stock_no"].isin(listed)]
+        if year != current_year:
+            stats = stats[stats["stock_no"].isin(missing)]
+        saved = save_year_stats(conn, spec["table"], year, stats)
+        runlog.incr("rows_upserted", saved, table=spec["table"])
+        log.info("年度統計寫入完成", market=market, year=year, rows=saved)
+        gaps |= missing - set(stats["stock_no"])
+
+    conn.close()
+    if gap_fill and gaps:
+        log.info("需以單檔請求補齊", market=market, stocks=len(gaps))
+        fill_gaps(market, sorted(gaps), sleep_seconds)
+
+def main():
+    current_year = datetime.now().year
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--market", choices=["twse", "otc", "all"], default="all")
+    parser.add_argument("--start-year", type=int, default=current_year - 5)
+    parser.add_argument("--end-year", type=int, default=current_year)
+    parser.add_argument("--sleep", type=float, default=3, help="每次下載後暫停秒數")
+    parser.add_argument("--no-gap-fill", action="store_true", help="不以單檔請求補齊缺漏")
+    args = parser.parse_args()
+
+    runlog.setup("bulk_yearly")
+    years = range(args.start_year, args.end_year + 1)
+    markets = ["twse", "otc"] if args.market == "all" else [args.market]
+    trading_calendar = TradingCalendar(args.sleep)
+    # 上市與上櫃是不同主機，各自依 --sleep 限速，同時下載
+    with ThreadPoolExecutor(max_workers=len(markets)) as executor:
+        futures = [executor.submit(run_market, market, years, args.sleep, not args.no_gap_fill, trading_calendar)
+                   for market in markets]
+        for future in futures:
+            future.result()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+功能：eps_report 單次執行內的資料存取層。
+
+每檔股票的 stock_quarterly、monthly_revenue、YearlyPER 各只查詢一次，
+保存在有上限的 LRU 快取中，所有估值輔助函式都從這些切片取資料，
+並以命中/未命中次數呈現省下的查詢往返。
+也可傳入預先依 stock_no 分組的 DataFrame（例如由 Parquet 一次讀入），此時完全不查詢資料庫。
+"""
+
+from collections import OrderedDict
+
+import pandas as pd
+
+# 各資料切片的查詢語句，排序方式與原本各輔助函式相同
+SLICE_QUERIES = {
+    "quarterly": """
+        SELECT quarter, eps, net_income_after_tax, quarter_revenue, capital
+        FROM stock_quarterly
+        WHERE stock_no = ?
+        ORDER BY quarter DESC
+    """,
+    "revenue": """
+        SELECT revenue_month, yoy_growth
+        FROM monthly_revenue
+        WHERE stock_no = ?
+        ORDER BY revenue_month DESC
+    """,
+    "per": """
+        SELECT year, highest_per, average_per, lowest_per
+        FROM YearlyPER
+        WHERE stock_no = ?
+        ORDER BY year
+    """,
+}
+
+# 各切片的來源資料表、欄位與排序（與 SLICE_QUERIES 相同），供預先分組的資料使用
+SLICE_LAYOUT = {
+    "quarterly": ("stock_quarterly", ["quarter", "eps", "net_income_after_tax", "quarter_revenue", "capital"],
+                  "quarter", False),
+    "revenue": ("monthly_revenue", ["revenue_month", "yoy_growth"], "revenue_month", False),
+    "per": ("YearlyPER", ["year", "highest_per", "average_per", "lowest_per"], "year", True),
+}
+
+# 將整張資料表依 stock_no 分成各股票的切片，回傳 {切片種類: {代號: DataFrame}}
+def group_slices(tables):
+    frames = {}
+    for kind, (table, columns, order_col, ascending) in SLICE_LAYOUT.items():
+        df = tables.get(table)
+        if df is None:
+            frames[kind] = {}
+            continue
+        df = df.assign(stock_no=df["stock_no"].astype(str)).sort_values(order_col, ascending=ascending)
+        frames[kind] = {code: part[columns].reset_index(drop=True)
+                        for code, part in df.groupby("stock_no", sort=False)}
+    return frames
+
+class StockDataCache:
+    def __init__(self, conn=None, maxsize=512, frames=None):
+        self.conn = conn
+        self.maxsize = maxsize
+        self.frames = frames
+        self.hits = 0
+        self.misses = 0
+        self.frame_lookups = 0
+        self._slices = OrderedDict()
+
+    def _get(self, kind, stock_no):
+        # 預先分組的資料全部在記憶體中，另計查詢次數而不算快取命中；
+        # 沒有該股票時計為未命中，回傳與查詢結果相同欄位的空表
+        if self.frames is not None:
+            self.frame_lookups += 1
+            df = self.frames[kind].get(stock_no)
+            if df is None:
+                self.misses += 1
+                return pd.DataFrame(columns=SLICE_LAYOUT[kind][1])
+            return df
+        key = (kind, stock_no)
+        if key in self._slices:
+            self.hits += 1
+            self._slices.move_to_end(key)
+            return self._slices[key]
+        self.misses += 1
+        df = pd.read_sql(SLICE_QUERIES[kind], self.conn, params=(stock_no,))
+        self._slices[key] = df
+        if len(self._slices) > self.maxsize:
+            self._slices.popitem(last=False)
+        return df
+
+    # 依季別由新到舊
+    def quarterly(self, stock_no):
+        return self._get("quarterly", stock_no)
+
+    # 依月份由新到舊
+    def revenue(self, stock_no):
+        return self._get("revenue", stock_no)
+
+    # 依年度由舊到新
+    def per(self, stock_no):
+        return self._get("per", stock_no)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "frame_lookups": self.frame_lookups,
+            "cached_slices": len(self._slices),
+        }
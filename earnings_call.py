@@ -20,6 +20,11 @@ from bs4 import BeautifulSoup
 from datetime import datetime
 from dotenv import load_dotenv
 
+import runlog
+import universe
+
+log = runlog.get_logger("earnings_call")
+
 # 讀取環境變數（優先 .env，找不到才用 export）
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -31,33 +36,29 @@ def send_telegram_message(message):
     try:
         r = requests.post(url, data=payload)
         r.raise_for_status()
-        print("Telegram 訊息發送成功")
+        log.info("Telegram 訊息發送成功")
     except Exception as e:
-        print(f"Telegram 訊息發送失敗: {e}")
+        log.error("Telegram 訊息發送失敗", error=e)
 
 def load_portfolio(file_path):
     portfolio_codes = set()
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                parts = line.split()
-                if parts:
-                    portfolio_codes.add(parts[0])
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        portfolio_codes = {code for code, _ in universe.read_cfg(file_path)}
     except Exception as e:
-        print(f"讀取 portfolio 檔案錯誤: {e}")
+        log.error("讀取 portfolio 檔案錯誤", path=file_path, error=e)
     return portfolio_codes
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python script.py portfolio.cfg")
+        log.error("用法: python earnings_call.py portfolio.cfg")
         sys.exit(1)
+    runlog.setup("earnings_call")
 
     portfolio_file = sys.argv[1]
     portfolio_codes = load_portfolio(portfolio_file)
-    print("Portfolio 股票代號：", portfolio_codes)
+    log.info("Portfolio 股票代號", codes=",".join(sorted(portfolio_codes)))
 
     url = "https://tw.stock.yahoo.com/calendar/earnings-call"
 
@@ -65,28 +66,28 @@ def main():
         response = requests.get(url)
         response.raise_for_status()
     except Exception as e:
-        print(f"無法取得網頁資料: {e}")
+        log.error("無法取得網頁資料", url=url, error=e)
         return
 
     soup = BeautifulSoup(response.text, "html.parser")
     # 取得第一個 class 包含 "calendarDetail" 的 <section>
     section = soup.find("section", class_=lambda x: x and "calendarDetail" in x)
     if not section:
-        print("找不到指定的 section (class 包含 calendarDetail)")
+        log.warning("找不到指定的 section (class 包含 calendarDetail)")
         return
 
     # 取得今日日期，格式需與網頁日期格式一致
     today_str = datetime.now().strftime("%Y/%m/%d")
-    print(f"今日日期：{today_str}\n")
+    log.info("今日日期", date=today_str)
 
     ul = section.find("ul")
     if not ul:
-        print("找不到活動清單 (<ul> 元素)")
+        log.warning("找不到活動清單 (<ul> 元素)")
         return
 
     events = ul.find_all("li")
     if not events:
-        print("活動清單中未發現任何資料")
+        log.info("活動清單中未發現任何資料")
         return
 
     matching_codes = []
@@ -125,10 +126,10 @@ def main():
     if matching_codes:
         matching_codes = sorted(set(matching_codes))
         message = "今天有開法說會的股票：\n" + "\n".join(matching_codes)
-        print("Telegram 訊息內容：\n", message)
+        log.info("今日有 portfolio 中的法說會", stocks=",".join(matching_codes))
         send_telegram_message(message)
     else:
-        print("今日無您 portfolio 中的法說會活動。")
+        log.info("今日無 portfolio 中的法說會活動")
 
 if __name__ == '__main__':
     main()
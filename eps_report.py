@@ -1,6 +1,7 @@
 import os
 import requests
 import sqlite3
+import numpy as np
 import pandas as pd
 import argparse
 import json
@@ -13,160 +14,75 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
+from data_access import StockDataCache
+import parquet_store
+import point_in_time
+import price_snapshot
+import runlog
+import universe
+
 LAST_COLOR_JSON = "last_color.json"
+VALUATION_CACHE_JSON = "valuation_cache.json"
+
+COLOR_PRIORITY = {"red": 0, "orange": 1, "green": 2, "none": 3}
+COLOR_EMOJI_MAP = {
+    "red": "🔴",
+    "orange": "🟠",
+    "green": "🟢",
+    "none": "⚪"
+}
 
 # 讀取環境變數（優先 .env，找不到才用 export）
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHAT_ID = os.getenv("CHAT_ID")
 
+log = runlog.get_logger("eps_report")
+
 def load_stock_codes_and_names(cfg_path):
-    result = {}
-    if not os.path.exists(cfg_path):
-        return result
-    with open(cfg_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            parts = line.split()
-            if len(parts) >= 2:
-                stock_no = parts[0]
-                stock_name = "".join(parts[1:])
-                result[stock_no] = stock_name
-    return result
+    return dict(universe.read_cfg(cfg_path))
 
 def fetch_twse_latest_price():
-    url = "https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_AVG_ALL"
-    result = {}
-    try:
-        resp = requests.get(url, headers={
-            "If-Modified-Since": "Mon, 26 Jul 1997 05:00:00 GMT",
-            "Cache-Control": "no-cache",
-            "Pragma": "no-cache"
-        })
-        resp.raise_for_status()
-        data = resp.json()
-    except:
-        print(f"抓取 TWSE 最新股價時發生錯誤: {e}")
-        return result
-    for item in data:
-        code = item.get("Code")
-        cp_str = item.get("ClosingPrice")
-        if code and cp_str:
-            try:
-                cp = float(cp_str)
-                result[code] = cp
-            except:
-                pass
-    return result
+    prices, _ = price_snapshot.get_latest_prices("twse")
+    return prices
 
 def fetch_otc_latest_price():
-    url = "https://www.tpex.org.tw/openapi/v1/tpex_mainboard_quotes"
-    result = {}
-    try:
-        resp = requests.get(url, headers={
-            "If-Modified-Since": "Mon, 26 Jul 1997 05:00:00 GMT",
-            "Cache-Control": "no-cache",
-            "Pragma": "no-cache"
-        })
-        resp.raise_for_status()
-        data = resp.json()
-    except:
-        print(f"抓取 OTC 最新股價時發生錯誤: {e}")
-        return result
-    for item in data:
-        code = item.get("SecuritiesCompanyCode")
-        cp_str = item.get("Close")
-        if code and cp_str:
-            try:
-                cp = float(cp_str)
-                result[code] = cp
-            except:
-                pass
-    return result
-
-def has_4_years_data(conn, stock_no):
-    query = """
-    SELECT COUNT(DISTINCT SUBSTR(quarter, 1, 4)) AS year_count
-    FROM stock_quarterly
-    WHERE stock_no = ?
-    """
-    df = pd.read_sql(query, conn, params=(stock_no,))
-    return (df["year_count"].iloc[0] or 0) >= 4
-
-def is_profitable_in_5_years(conn, stock_no, report_year):
+    prices, _ = price_snapshot.get_latest_prices("otc")
+    return prices
+
+def has_4_years_data(data, stock_no):
+    df = data.quarterly(stock_no)
+    return df["quarter"].astype(str).str[:4].nunique() >= 4
+
+def is_profitable_in_5_years(data, stock_no, report_year):
     start_year = report_year - 4
-    q = f"""
-    SELECT SUBSTR(quarter,1,4) AS y,
-           SUM(eps) AS yearly_eps
-    FROM stock_quarterly
-    WHERE stock_no = '{stock_no}'
-      AND CAST(SUBSTR(quarter,1,4) AS INT) BETWEEN {start_year} AND {report_year}
-    GROUP BY y
-    """
-    df = pd.read_sql(q, conn)
-    if df.empty:
+    df = data.quarterly(stock_no)
+    # 季別缺值或格式不符時年度為 NaN，不落在任何年度區間
+    years = pd.to_numeric(df["quarter"].astype(str).str[:4], errors="coerce")
+    in_window = (years >= start_year) & (years <= report_year)
+    if not in_window.any():
         return False
-    for row in df.itertuples():
-        if (row.yearly_eps is None) or (row.yearly_eps <= 0):
-            return False
-    return True
-
-def calculate_estimated_eps(conn, stock_no, report_year):
-    pm_q = f"""
-    SELECT SUM(net_income_after_tax) AS total_net_income,
-           SUM(quarter_revenue) AS total_revenue
-    FROM (
-        SELECT net_income_after_tax, quarter_revenue
-        FROM stock_quarterly
-        WHERE stock_no = '{stock_no}'
-        ORDER BY quarter DESC
-        LIMIT 4
-    ) AS limited_data;
-    """
-    df_pm = pd.read_sql(pm_q, conn)
-    total_net_income = df_pm["total_net_income"].iloc[0] or 0
-    total_revenue = df_pm["total_revenue"].iloc[0] or 0
+    yearly_eps = df.loc[in_window, "eps"].groupby(years[in_window]).sum(min_count=1)
+    return bool((yearly_eps > 0).all())
+
+def calculate_estimated_eps(data, stock_no, report_year):
+    df_q = data.quarterly(stock_no)
+    last4 = df_q.head(4)
+    total_net_income = last4["net_income_after_tax"].sum()
+    total_revenue = last4["quarter_revenue"].sum()
     profit_margin = (total_net_income / total_revenue) if total_revenue else 0
 
-    growth_q = f"""
-    WITH cte AS (
-        SELECT stock_no, yoy_growth,
-               ROW_NUMBER() OVER (PARTITION BY stock_no ORDER BY revenue_month DESC) AS rn
-        FROM monthly_revenue
-        WHERE stock_no = '{stock_no}'
-    )
-    SELECT
-       AVG(CASE WHEN rn <= 6 THEN yoy_growth END) AS avg_growth_6_months,
-       MAX(CASE WHEN rn = 1 THEN yoy_growth END) AS last_month_growth
-    FROM cte;
-    """
-
-
-    df_g = pd.read_sql(growth_q, conn)
-    avg_growth = df_g["avg_growth_6_months"].iloc[0] or 0
-    last_month_growth = df_g["last_month_growth"].iloc[0] or 0
+    yoy = data.revenue(stock_no)["yoy_growth"]
+    avg_growth = yoy.head(6).mean() if yoy.head(6).notna().any() else 0
+    last_month_growth = yoy.iloc[0] if len(yoy) and pd.notna(yoy.iloc[0]) else 0
     revenue_growth_rate = min(avg_growth, last_month_growth)
 
-    ly_q = f"""
-    SELECT SUM(quarter_revenue) AS last_year_revenue
-    FROM stock_quarterly
-    WHERE stock_no = '{stock_no}'
-      AND quarter LIKE '{report_year - 1}%';
-    """
-    df_ly = pd.read_sql(ly_q, conn)
-    last_year_revenue = df_ly["last_year_revenue"].iloc[0] or 0
-
-    cap_q = f"""
-    SELECT capital
-    FROM stock_quarterly
-    WHERE stock_no = '{stock_no}'
-    ORDER BY quarter DESC
-    LIMIT 1;
-    """
-    df_cap = pd.read_sql(cap_q, conn)
-    latest_equity = df_cap["capital"].iloc[0] if not df_cap.empty else 0
+    last_year = df_q["quarter"].astype(str).str.startswith(str(report_year - 1))
+    last_year_revenue = df_q.loc[last_year, "quarter_revenue"].sum()
+
+    latest_equity = df_q["capital"].iloc[0] if not df_q.empty else 0
+    if pd.isna(latest_equity):
+        latest_equity = 0
 
     if latest_equity > 0:
         estimated_eps = last_year_revenue * (1 + revenue_growth_rate / 100) * profit_margin / (latest_equity / 10)
@@ -187,17 +103,10 @@ def remove_iqr_outliers(df, col_list):
         outlier_condition = outlier_condition|is_outlier
     return df[~outlier_condition].copy()
 
-def calculate_price_ranges(conn, stock_no, estimated_eps, report_year, lookback_years=5):
-    import pandas as pd
+def calculate_price_ranges(data, stock_no, estimated_eps, report_year, lookback_years=5):
     start_year = report_year - lookback_years + 1
-    q = f"""
-        SELECT year, highest_per, average_per, lowest_per
-        FROM YearlyPER
-        WHERE stock_no = '{stock_no}'
-          AND year BETWEEN {start_year} AND {report_year}
-        ORDER BY year
-    """
-    df = pd.read_sql(q, conn)
+    df = data.per(stock_no)
+    df = df[(df["year"] >= start_year) & (df["year"] <= report_year)].copy()
     if df.empty:
         return (None, None, None)
 
@@ -218,32 +127,19 @@ def calculate_price_ranges(conn, stock_no, estimated_eps, report_year, lookback_
     exp   = estimated_eps * avg_high
     return (cheap, fair, exp)
 
-def get_two_months_growths(conn, stock_no):
-    q = f"""
-    SELECT yoy_growth
-    FROM monthly_revenue
-    WHERE stock_no = '{stock_no}'
-    ORDER BY revenue_month DESC
-    LIMIT 2
-    """
-    df = pd.read_sql(q, conn)
+def get_two_months_growths(data, stock_no):
+    df = data.revenue(stock_no).head(2)
     yoy = [0,0]
     for i in range(len(df)):
-        yoy[i] = df["yoy_growth"].iloc[i] or 0
+        value = df["yoy_growth"].iloc[i]
+        yoy[i] = 0 if pd.isna(value) else value
     return yoy
 
-def get_last_month_growth(conn, stock_no):
-    q = f"""
-    SELECT yoy_growth
-    FROM monthly_revenue
-    WHERE stock_no = '{stock_no}'
-    ORDER BY revenue_month DESC
-    LIMIT 1
-    """
-    df = pd.read_sql(q, conn)
-    if df.empty:
+def get_last_month_growth(data, stock_no):
+    df = data.revenue(stock_no)
+    if df.empty or pd.isna(df["yoy_growth"].iloc[0]):
         return 0
-    return df["yoy_growth"].iloc[0] or 0
+    return df["yoy_growth"].iloc[0]
 
 def generate_pdf_report(df_result, pdf_filename="eps_report.pdf",
                         font_name="NotoSansTC", font_path="NotoSansTC-Regular.otf"):
@@ -285,9 +181,9 @@ def send_telegram_text(bot_token, chat_id, text):
     data = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown"}
     r = requests.post(url, data=data)
     if r.status_code == 200:
-        print("已透過 Telegram 傳送文字訊息")
+        log.info("已透過 Telegram 傳送文字訊息")
     else:
-        print(f"Telegram 傳送失敗 code={r.status_code}, resp={r.text}")
+        log.error("Telegram 傳送失敗", code=r.status_code, resp=r.text)
 
 def send_telegram_document(bot_token, chat_id, file_path, caption="EPS 報表檔案"):
     url = f"https://api.telegram.org/bot{bot_token}/sendDocument"
@@ -296,9 +192,9 @@ def send_telegram_document(bot_token, chat_id, file_path, caption="EPS 報表檔
         data = {"chat_id": chat_id, "caption": caption}
         resp = requests.post(url, data=data, files=files)
     if resp.status_code == 200:
-        print("已透過 Telegram 傳送檔案")
+        log.info("已透過 Telegram 傳送檔案", file=file_path)
     else:
-        print(f"寄送檔案失敗 code={resp.status_code}, resp={resp.text}")
+        log.error("寄送檔案失敗", code=resp.status_code, resp=resp.text)
 
 def load_last_colors(json_path):
     if not os.path.exists(json_path):
@@ -319,19 +215,198 @@ def save_new_colors(json_path, color_dict):
     except:
         pass
 
+# 計算每檔股票的估值（不含股價），供快取後重複分類使用
+def compute_valuations(conn, all_stocks, report_year, frames=None):
+    data = StockDataCache(conn, frames=frames)
+    valuations = []
+    for stock_no, stock_name in all_stocks.items():
+        if not has_4_years_data(data, stock_no):
+            continue
+        if not is_profitable_in_5_years(data, stock_no, report_year):
+            continue
+        est_eps = calculate_estimated_eps(data, stock_no, report_year)
+        if est_eps <= 0:
+            continue
+        cheap, fair, expensive = calculate_price_ranges(data, stock_no, est_eps, report_year, 5)
+        if cheap is None:
+            continue
+
+        valuations.append({
+            "stock_no": stock_no,
+            "name": stock_name,
+            "est_eps": float(est_eps),
+            "last_month_yoy": float(get_last_month_growth(data, stock_no)),
+            "last_2m": [float(x) for x in get_two_months_growths(data, stock_no)],
+            "cheap": float(cheap),
+            "fair": float(fair),
+            "expensive": float(expensive),
+        })
+    stats = data.stats()
+    runlog.incr("cache_hits", stats["hits"], cache="stock_data")
+    runlog.incr("cache_misses", stats["misses"], cache="stock_data")
+    runlog.incr("frame_lookups", stats["frame_lookups"], cache="stock_data")
+    log.info("資料快取統計", hits=stats["hits"], misses=stats["misses"], hit_rate=f"{stats['hit_rate']:.0%}",
+             frame_lookups=stats["frame_lookups"])
+    return valuations
+
+# 估值快取檔：時間點報表另存 valuation_cache_asof_<時間點>.json，不覆寫一般報表的快取
+def valuation_cache_path(as_of=None):
+    if not as_of:
+        return VALUATION_CACHE_JSON
+    stamp = "".join(ch for ch in as_of if ch.isdigit())
+    return VALUATION_CACHE_JSON.replace(".json", f"_asof_{stamp}.json")
+
+# 估值快取鍵：資料庫修改時間、報表年度、股票清單與資料時間點
+def valuation_cache_key(db_name, report_year, all_stocks, as_of=None):
+    return {
+        "db_mtime": os.path.getmtime(db_name),
+        "report_year": report_year,
+        "stocks": sorted(all_stocks.keys()),
+        "as_of": as_of,
+    }
+
+def load_valuation_cache(json_path, cache_key):
+    if not os.path.exists(json_path):
+        return None
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and data.get("key") == cache_key:
+            return data.get("valuations")
+        return None
+    except:
+        return None
+
+# 讀取估值快取中可沿用的部分（報表年度與時間點需相同），回傳 (已估值的股票清單, 估值)；不可沿用時回傳 None
+def load_reusable_valuations(json_path, report_year, as_of=None):
+    if not os.path.exists(json_path):
+        return None
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        key = data.get("key") or {}
+        if key.get("report_year") != report_year or key.get("as_of") != as_of:
+            return None
+        return set(key.get("stocks") or []), data.get("valuations") or []
+    except:
+        return None
+
+# 只重新估值 recompute 中的股票與快取中沒有的股票，其餘沿用快取；沒有可沿用的快取時回傳 None
+def refresh_valuations(conn, all_stocks, report_year, recompute, as_of=None, frames=None):
+    reusable = load_reusable_valuations(valuation_cache_path(as_of), report_year, as_of)
+    if reusable is None:
+        return None
+    cached_stocks, cached = reusable
+    wanted = set(recompute) | (set(all_stocks) - cached_stocks)
+    kept = [v for v in cached if v["stock_no"] in all_stocks and v["stock_no"] not in wanted]
+    fresh = compute_valuations(conn, {c: n for c, n in all_stocks.items() if c in wanted}, report_year, frames)
+    order = {code: i for i, code in enumerate(all_stocks)}
+    log.info("部分重新估值", recomputed=len(wanted), reused=len(kept))
+    return sorted(kept + fresh, key=lambda v: order[v["stock_no"]])
+
+def save_valuation_cache(json_path, cache_key, valuations):
+    try:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({"key": cache_key, "valuations": valuations}, f, ensure_ascii=False)
+    except:
+        pass
+
+# 以平行陣列表示股票池：代號、名稱、收盤價、估測 EPS、近兩月年增率與價格區間
+def build_universe(valuations, twse_prices, otc_prices):
+    df = pd.DataFrame.from_records(valuations, columns=[
+        "stock_no", "name", "est_eps", "last_month_yoy", "last_2m", "cheap", "fair", "expensive"
+    ])
+    codes = df["stock_no"].astype(str)
+    price = codes.map(twse_prices).fillna(codes.map(otc_prices)).to_numpy(dtype=float)
+    keep = ~np.isnan(price)
+
+    yoy_2m = np.zeros((len(df), 2))
+    if len(df):
+        yoy_2m = np.array(df["last_2m"].tolist(), dtype=float).reshape(len(df), 2)
+
+    return {
+        "code": codes.to_numpy()[keep],
+        "name": df["name"].astype(str).to_numpy()[keep],
+        "price": np.round(price[keep], 2),
+        "eps": np.round(df["est_eps"].to_numpy(dtype=float)[keep], 2),
+        "last_month_yoy": np.round(df["last_month_yoy"].to_numpy(dtype=float)[keep], 2),
+        "yoy_1m": yoy_2m[keep, 0],
+        "yoy_2m": yoy_2m[keep, 1],
+        "cheap": np.round(df["cheap"].to_numpy(dtype=float)[keep], 2),
+        "fair": np.round(df["fair"].to_numpy(dtype=float)[keep], 2),
+        "expensive": np.round(df["expensive"].to_numpy(dtype=float)[keep], 2),
+    }
+
+# 向量化分類：紅 = 低於便宜價且近兩月年增率皆 > 5%，橘 = 低於便宜價，綠 = 高於昂貴價
+def classify_color(price, cheap, expensive, yoy_1m, yoy_2m, yoy_threshold=5):
+    below_cheap = price < cheap
+    strong_growth = (yoy_1m > yoy_threshold) & (yoy_2m > yoy_threshold)
+    return np.select(
+        [below_cheap & strong_growth, below_cheap, price > expensive],
+        ["red", "orange", "green"],
+        default="none",
+    )
+
+# 依顏色優先順序穩定排序所有平行陣列
+def sort_universe(stock_pool):
+    priority = pd.Series(stock_pool["color"]).map(COLOR_PRIORITY).to_numpy()
+    order = np.argsort(priority, kind="stable")
+    return {key: arr[order] for key, arr in stock_pool.items()}
+
+def universe_to_frame(stock_pool):
+    return pd.DataFrame({
+        "股票代號": stock_pool["code"],
+        "名稱": stock_pool["name"],
+        "最新收盤價": stock_pool["price"],
+        "估測EPS": stock_pool["eps"],
+        "近月營收年增率": stock_pool["last_month_yoy"],
+        "便宜價": stock_pool["cheap"],
+        "合理價": stock_pool["fair"],
+        "昂貴價": stock_pool["expensive"],
+        "color_class": stock_pool["color"],
+    })
+
+# 組出 Telegram 摘要（顏色有變動者加上 🔺）與新的顏色紀錄
+def build_summary(stock_pool, old_colors):
+    codes = pd.Series(stock_pool["code"])
+    colors_s = pd.Series(stock_pool["color"])
+    old = codes.map(old_colors)
+    changed = old.notna() & (old != colors_s)
+    lines = (colors_s.map(COLOR_EMOJI_MAP)
+             + np.where(changed, "🔺", "")
+             + " `" + codes + "` "
+             + pd.Series(stock_pool["name"]))
+    return lines.tolist(), dict(zip(stock_pool["code"].tolist(), stock_pool["color"].tolist()))
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--report-year", type=int)
     parser.add_argument("--portfolio-cfg", type=str)
+    parser.add_argument("--as-of", type=str, help="以指定時間點 (YYYY-MM-DD) 當下的資料庫內容產生報表")
+    parser.add_argument("--parquet-dir", type=str, help="改由 parquet_store.py 匯出的 Parquet 目錄讀取資料")
+    parser.add_argument("--stocks", type=str,
+                        help="只重新估值指定代號（逗號分隔，可為空），其餘沿用估值快取；報表仍包含全部股票")
     args = parser.parse_args()
+    runlog.setup("eps_report")
+    if args.as_of and args.parquet_dir:
+        parser.error("--as-of 與 --parquet-dir 不可同時使用（可用 parquet_store.py export --as-of 匯出時間點資料）")
 
     report_year = args.report_year if args.report_year else datetime.now().year
 
     db_name = "stock_data.db"
+    if args.parquet_dir:
+        db_name = parquet_store.manifest_path(args.parquet_dir)
     if not os.path.exists(db_name):
         return
 
-    conn = sqlite3.connect(db_name)
+    conn = frames = None
+    if args.parquet_dir:
+        frames = parquet_store.load_stock_frames(args.parquet_dir)
+    else:
+        conn = sqlite3.connect(db_name)
+    as_of_upper = None
+    if args.as_of:
+        as_of_upper = point_in_time.attach_as_of(conn, args.as_of)
     if args.portfolio_cfg and os.path.exists(args.portfolio_cfg):
         portfolio_dict = load_stock_codes_and_names(args.portfolio_cfg)
         all_stocks = portfolio_dict
@@ -339,74 +414,55 @@ def main():
         twse_dict = load_stock_codes_and_names("twse.cfg")
         otc_dict  = load_stock_codes_and_names("otc.cfg")
         all_stocks = {**twse_dict, **otc_dict}
-
-    twse_prices = fetch_twse_latest_price()
-    otc_prices  = fetch_otc_latest_price()
-
-    rows = []
-    for stock_no, stock_name in all_stocks.items():
-        if not has_4_years_data(conn, stock_no):
-            continue
-        if not is_profitable_in_5_years(conn, stock_no, report_year):
-            continue
-        est_eps = calculate_estimated_eps(conn, stock_no, report_year)
-        if est_eps <= 0:
-            continue
-        cheap, fair, expensive = calculate_price_ranges(conn, stock_no, est_eps, report_year, 5)
-        if cheap is None:
-            continue
-
-        if stock_no in twse_prices:
-            latest_close = twse_prices[stock_no]
-        elif stock_no in otc_prices:
-            latest_close = otc_prices[stock_no]
-        else:
-            continue
-
-        last_month_yoy = get_last_month_growth(conn, stock_no)
-        rows.append({
-            "股票代號": stock_no,
-            "名稱": stock_name,
-            "最新收盤價": round(latest_close, 2),
-            "估測EPS": round(est_eps, 2),
-            "近月營收年增率": round(last_month_yoy, 2),
-            "便宜價": round(cheap, 2),
-            "合理價": round(fair, 2),
-            "昂貴價": round(expensive, 2),
-        })
-
-    if not rows:
+    all_stocks = universe.filter_listed(all_stocks)
+
+    if as_of_upper:
+        # 使用當時已取得的收盤價快照，重現當時送出的報表
+        twse_prices, twse_date = price_snapshot.get_prices_as_of("twse", as_of_upper)
+        otc_prices, otc_date = price_snapshot.get_prices_as_of("otc", as_of_upper)
+        if not twse_prices and not otc_prices:
+            log.error("沒有該時間點以前的股價快照，無法重現當時的報表", as_of=args.as_of,
+                      history_dir=price_snapshot.HISTORY_DIR)
+            if conn is not None:
+                conn.close()
+            return
+        log.info("使用時間點當下的股價快照", as_of=args.as_of, twse=twse_date, otc=otc_date)
+    else:
+        twse_prices, otc_prices, prices_changed = price_snapshot.get_all_latest_prices()
+        if not prices_changed:
+            log.info("最新股價與快照相同")
+
+    # 估值結果只跟資料庫內容有關，資料庫未變動時直接沿用，只重新分類
+    cache_key = valuation_cache_key(db_name, report_year, all_stocks, args.as_of)
+    cache_path = valuation_cache_path(args.as_of)
+    valuations = load_valuation_cache(cache_path, cache_key)
+    if valuations is not None:
+        log.info("資料庫未變動，沿用估值快取，僅重新分類")
+    else:
+        if args.stocks is not None:
+            recompute = {code.strip() for code in args.stocks.split(",") if code.strip()}
+            valuations = refresh_valuations(conn, all_stocks, report_year, recompute, args.as_of, frames)
+        if valuations is None:
+            valuations = compute_valuations(conn, all_stocks, report_year, frames)
+        save_valuation_cache(cache_path, cache_key, valuations)
+
+    if conn is not None:
         conn.close()
+
+    stock_pool = build_universe(valuations, twse_prices, otc_prices)
+    if len(stock_pool["code"]) == 0:
         return
 
-    df_result = pd.DataFrame(rows)
-    yoy_2m_list = []
-    for idx, row in df_result.iterrows():
-        yoy2 = get_two_months_growths(conn, row["股票代號"])
-        yoy_2m_list.append(yoy2)
-    df_result["last_2m_list"] = yoy_2m_list
-    conn.close()
-
-    def classify_color(r):
-        yoy2 = r["last_2m_list"]
-        if r["最新收盤價"] < r["便宜價"]:
-            if yoy2[0]>5 and yoy2[1]>5:
-                return "red"
-            else:
-                return "orange"
-        if r["最新收盤價"] > r["昂貴價"]:
-            return "green"
-        return "none"
-
-    df_result["color_class"] = df_result.apply(classify_color, axis=1)
-    color_priority = {"red":0, "orange":1, "green":2, "none":3}
-    df_result["sort_key"] = df_result["color_class"].map(color_priority)
-    df_result.sort_values("sort_key", inplace=True, ignore_index=True)
-    df_result.drop(columns=["sort_key","last_2m_list"], inplace=True)
+    stock_pool["color"] = classify_color(stock_pool["price"], stock_pool["cheap"], stock_pool["expensive"],
+                                         stock_pool["yoy_1m"], stock_pool["yoy_2m"])
+    stock_pool = sort_universe(stock_pool)
+    df_result = universe_to_frame(stock_pool)
 
     old_colors = load_last_colors(LAST_COLOR_JSON)
 
     today_str = datetime.now().strftime("%Y%m%d")
+    if args.as_of:
+        today_str = "asof" + args.as_of[:10].replace("-", "")
     if args.portfolio_cfg:
         base_filename = os.path.basename(args.portfolio_cfg)
         pf_name, _ = os.path.splitext(base_filename)
@@ -416,26 +472,12 @@ def main():
 
     generate_pdf_report(df_result, pdf_filename)
 
-    new_colors = {}
-    color_emoji_map = {
-        "red": "🔴",
-        "orange": "🟠",
-        "green": "🟢",
-        "none": "⚪"
-    }
+    summary_lines, new_colors = build_summary(stock_pool, old_colors)
 
-    summary_lines = []
-    for _, row in df_result.iterrows():
-        s_no   = row["股票代號"]
-        s_name = row["名稱"]
-        cclass = row["color_class"]
-        old_c  = old_colors.get(s_no, None)
-        changed_flag = ""
-        if old_c and old_c != cclass:
-            changed_flag = "🔺"
-        color_emoji = color_emoji_map[cclass]
-        summary_lines.append(f"{color_emoji}{changed_flag} `{s_no}` {s_name}")
-        new_colors[s_no] = cclass
+    # 歷史時間點報表僅供重現與比對，不更新顏色紀錄也不推播
+    if args.as_of:
+        log.info("已產生時間點報表", as_of=args.as_of, file=pdf_filename)
+        return
 
     save_new_colors(LAST_COLOR_JSON, new_colors)
 
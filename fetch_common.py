@@ -0,0 +1,117 @@
+"""
+功能：夜間流程、月營收回補與工作佇列共用的抓取元件。
+
+- HOSTS：各主機的同時請求數、請求間隔與 HTTP 標頭。
+- HostClient：單一主機的共用連線池與節流（安裝 aiohttp 時使用 ClientSession，
+  否則以 requests.Session 在執行緒中發送）。
+- INSERT_SQL：各資料表的 INSERT OR REPLACE 語句，所有寫入者共用同一份。
+- with_base：以 --base-url 取代網址的主機，供本機假資料伺服器測試。
+"""
+
+import asyncio
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import getOTC
+import getTWSE
+import runlog
+
+# 各主機的同時請求數與兩次請求的最小間隔（秒）
+HOSTS = {
+    "twse": {"limit": 1, "interval": 3.0, "headers": getTWSE.HEADERS},
+    "tpex": {"limit": 1, "interval": 3.0, "headers": getOTC.HEADERS},
+    "mops": {"limit": 2, "interval": 1.0, "headers": {}},
+}
+
+# 各資料表的寫入語句
+INSERT_SQL = {
+    "YearlyData": '''
+        INSERT OR REPLACE INTO YearlyData (
+            stock_no, year, highest_price, highest_date, lowest_price, lowest_date, average_close_price
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''',
+    "OTCYearlyData": '''
+        INSERT OR REPLACE INTO OTCYearlyData (
+            stock_no, year, highest_price, highest_date, lowest_price, lowest_date, average_close_price
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''',
+    "monthly_revenue": '''
+        INSERT OR REPLACE INTO monthly_revenue (stock_no, monthly_revenue, yoy_growth, revenue_month)
+        VALUES (?, ?, ?, ?)
+    ''',
+}
+
+# 單一主機的共用連線池與節流；limit / interval 未指定時取 HOSTS 的設定
+class HostClient:
+    def __init__(self, name, loop, executor, limit=None, interval=None):
+        spec = dict(HOSTS[name])
+        if limit is not None:
+            spec["limit"] = limit
+        if interval is not None:
+            spec["interval"] = interval
+        self.name = name
+        self.loop = loop
+        self.executor = executor
+        self.interval = spec["interval"]
+        self.semaphore = asyncio.Semaphore(spec["limit"])
+        self.lock = asyncio.Lock()
+        self.next_at = 0.0
+        self.requests = 0
+        if aiohttp is not None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=spec["limit"]),
+                headers=spec["headers"],
+                timeout=aiohttp.ClientTimeout(total=60),
+            )
+        else:
+            self.session = requests.Session()
+            self.session.headers.update(spec["headers"])
+
+    # 依最小間隔排隊取得發送時間
+    async def _wait_turn(self):
+        async with self.lock:
+            delay = self.next_at - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_at = self.loop.time() + self.interval
+
+    def _blocking_request(self, method, url, data, encoding):
+        response = self.session.request(method, url, data=data, timeout=60)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+        if encoding:
+            response.encoding = encoding
+        return response.text
+
+    async def request(self, method, url, data=None, encoding=None):
+        async with self.semaphore:
+            await self._wait_turn()
+            self.requests += 1
+            runlog.incr("http_requests", host=self.name)
+            if aiohttp is None:
+                return await self.loop.run_in_executor(
+                    self.executor, self._blocking_request, method, url, data, encoding)
+            async with self.session.request(method, url, data=data) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to fetch data: HTTP {response.status}")
+                return await response.text(encoding=encoding)
+
+    async def close(self):
+        if aiohttp is None:
+            self.session.close()
+        else:
+            await self.session.close()
+
+# 以 --base-url 取代網址的通訊協定與主機（本機測試或代理）
+def with_base(url, base_url):
+    if not base_url:
+        return url
+    base = urlsplit(base_url)
+    parts = urlsplit(url)
+    return urlunsplit((base.scheme, base.netloc, base.path.rstrip("/") + parts.path, parts.query, parts.fragment))
@@ -1,8 +1,38 @@
+import numpy as np
 import requests
 import sqlite3
 import time
 from datetime import datetime
 
+import fast_decode
+import runlog
+import universe
+
+log = runlog.get_logger("getOTC")
+
+# 個股年度統計
+YEARLY_STOCK_URL = "https://www.tpex.org.tw/www/zh-tw/statistics/yearlyStock"
+
+# 年度資料表各欄位的位置：盤中最高價、盤中最高價日期、盤中最低價、盤中最低價日期、收盤平均價
+YEARLY_LAYOUT = {
+    "highest_price": 5,
+    "highest_date": 6,
+    "lowest_price": 7,
+    "lowest_date": 8,
+    "average_close_price": 9,
+}
+PRICE_FIELDS = ("highest_price", "lowest_price", "average_close_price")
+
+# 自訂 HTTP 標頭
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+    "Origin": "https://www.tpex.org.tw",
+    "Referer": "https://www.tpex.org.tw/www/zh-tw/statistics/yearlyStock",
+}
+
 # 初始化資料庫
 def init_db():
     conn = sqlite3.connect("stock_data.db")
@@ -24,15 +54,7 @@ def init_db():
 
 # 讀取股票清單
 def read_stock_list(filename):
-    stock_list = []
-    with open(filename, "r", encoding="utf-8") as file:
-        for line in file:
-            if line.strip().startswith("#"):
-                continue  # 跳過註解行
-            parts = line.strip().split()
-            if len(parts) >= 2:
-                stock_list.append((parts[0], parts[1]))  # (股票代號, 股票名稱)
-    return stock_list
+    return universe.read_cfg(filename)  # [(股票代號, 股票名稱)]
 
 # 獲取資料庫中上一年度最大股票代號
 def get_last_processed_stock(current_year):
@@ -45,18 +67,9 @@ def get_last_processed_stock(current_year):
 
 # 抓取櫃買資料的函數
 def fetch_stock_data(stock_no):
-    url = "https://www.tpex.org.tw/www/zh-tw/statistics/yearlyStock"
-
-    # 設置自訂 HTTP 標頭和 POST 資料
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Accept": "application/json, text/javascript, */*; q=0.01",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-        "Origin": "https://www.tpex.org.tw",
-        "Referer": "https://www.tpex.org.tw/www/zh-tw/statistics/yearlyStock",
-    }
+    url = YEARLY_STOCK_URL
 
+    # 設置 POST 資料
     data = {
         "code": stock_no,
         "id": "",
@@ -64,19 +77,20 @@ def fetch_stock_data(stock_no):
     }
 
     # 發送 POST 請求並處理回應
-    response = requests.post(url, headers=headers, data=data)
+    response = requests.post(url, headers=HEADERS, data=data)
     if response.status_code != 200:
         raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
 
-    data = response.json()
+    return extract_annual_table(fast_decode.loads(response.content), stock_no)
+
+# 從回應 JSON 中提取年度數據部分
+def extract_annual_table(data, stock_no):
     if not data or "tables" not in data or len(data["tables"]) == 0:
         raise Exception(f"No valid data for stock {stock_no}")
 
-    # 提取年度數據部分
-    tables = data["tables"]
-    for table in tables:
-        if "fields" in table and "年度" in table["fields"]:
-            return table["data"]
+    rows = fast_decode.annual_rows(data)
+    if rows is not None:
+        return rows
 
     raise Exception(f"No annual trading data found for stock {stock_no}")
 
@@ -89,39 +103,42 @@ def data_exists(stock_no, year):
     conn.close()
     return result is not None
 
-# 分析資料並儲存
-def process_and_save_data(stock_no, data):
+# 分析資料，回傳 {年度: 統計}；exists 用來判斷資料是否已存在，first_year 可指定回補的起始年度
+def parse_yearly_rows(stock_no, data, exists=None, first_year=None):
+    exists = exists or data_exists
     current_year = datetime.now().year
-    five_years_ago = current_year - 11
+    five_years_ago = first_year or (current_year - 11)
 
     # 過濾出最近 5 年的資料
-    filtered_data = [
-        row for row in data if five_years_ago <= (int(row[0]) + 1911) <= current_year
-    ]
+    columns = fast_decode.yearly_columns(data, YEARLY_LAYOUT, PRICE_FIELDS)
+    years = columns["year"]
+    in_window = np.flatnonzero((years >= five_years_ago) & (years <= current_year))
 
-    if not filtered_data:
+    if len(in_window) == 0:
         raise Exception(f"No data available for stock {stock_no} in the last 5 years.")
 
+    prices = np.column_stack([columns[name][in_window] for name in PRICE_FIELDS])
+    if np.isnan(prices).any():
+        raise ValueError(f"Invalid price data for stock {stock_no}")
+
     result = {}
-    for row in filtered_data:
-        year = int(row[0]) + 1911
-        if data_exists(stock_no, year):
-            print(f"Data for stock {stock_no} in year {year} already exists. Skipping.")
+    skipped = []
+    for i in in_window:
+        year = int(years[i])
+        if exists(stock_no, year):
+            skipped.append(year)
             continue
 
-        high_price = float(row[5].replace(',', ''))  # 盤中最高價
-        high_date = row[6]          # 盤中最高價日期
-        low_price = float(row[7].replace(',', ''))   # 盤中最低價
-        low_date = row[8]           # 盤中最低價日期
-        avg_close_price = float(row[9].replace(',', ''))  # 收盤平均價
+        result[year] = {name: (float(columns[name][i]) if name in PRICE_FIELDS else columns[name][i])
+                        for name in YEARLY_LAYOUT}
+    if skipped:
+        runlog.incr("rows_skipped", len(skipped), table="OTCYearlyData")
+        log.debug("資料已存在，略過", stock_no=stock_no, years=skipped)
+    return result
 
-        result[year] = {
-            "highest_price": high_price,
-            "highest_date": high_date,
-            "lowest_price": low_price,
-            "lowest_date": low_date,
-            "average_close_price": avg_close_price
-        }
+# 分析資料並儲存
+def process_and_save_data(stock_no, data):
+    result = parse_yearly_rows(stock_no, data)
 
     # 儲存到資料庫
     conn = sqlite3.connect("stock_data.db")
@@ -139,25 +156,35 @@ def process_and_save_data(stock_no, data):
 
     conn.commit()
     conn.close()
+    runlog.incr("rows_upserted", len(result), table="OTCYearlyData")
 
 # 主程式
 if __name__ == "__main__":
+    runlog.setup("getOTC")
     init_db()
     stock_list = read_stock_list("otc.cfg")
     current_year = datetime.now().year
     last_processed_stock = get_last_processed_stock(current_year)
+    delisted = universe.delisted_codes()
 
     for stock_no, stock_name in stock_list:
+        if stock_no in delisted:
+            log.debug("已下市，略過", stock_no=stock_no, name=stock_name)
+            runlog.incr("stocks_skipped", market="otc", reason="delisted")
+            continue
         if last_processed_stock and stock_no <= last_processed_stock:
-            print(f"Skipping {stock_no} {stock_name}, already processed.")
+            log.debug("已處理過，略過", stock_no=stock_no, name=stock_name)
+            runlog.incr("stocks_skipped", market="otc", reason="processed")
             continue
 
-        print(f"Fetching data for {stock_no} {stock_name}...")
+        log.debug("抓取年度資料", stock_no=stock_no, name=stock_name)
         try:
             raw_data = fetch_stock_data(stock_no)
             process_and_save_data(stock_no, raw_data)
-            print(f"Data for {stock_no} {stock_name} has been successfully saved.")
+            runlog.incr("stocks_fetched", market="otc")
+            log.debug("已儲存年度資料", stock_no=stock_no, name=stock_name)
         except Exception as e:
-            print(f"Error fetching data for {stock_no} {stock_name}: {e}")
+            runlog.incr("stocks_failed", market="otc")
+            log.error("抓取年度資料失敗，停止", stock_no=stock_no, name=stock_name, error=e)
             break
         time.sleep(3)
@@ -5,21 +5,39 @@ import sqlite3
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
+import runlog
+import universe
+
+log = runlog.get_logger("get_monthly_revenue")
+
+# 公開資訊觀測站檔案下載
+MOPS_URL = 'https://mopsov.twse.com.tw/server-java/FileDownLoad'
+
 # 定義下載 CSV 的函數
 def fetch_csv_data(url, data):
     try:
         response = requests.post(url, data=data)
         response.encoding = 'utf-8'  # 確保編碼正確
         if response.status_code == 200:
-            print("CSV 文件下載成功！")
+            runlog.incr("files_fetched", source="mops")
+            log.debug("CSV 文件下載成功", file=data.get("fileName"), bytes=len(response.content))
             return response.text
         else:
-            print(f"下載失敗，狀態碼: {response.status_code}")
+            runlog.incr("files_failed", source="mops")
+            log.warning("下載失敗", file=data.get("fileName"), status=response.status_code)
             return None
     except Exception as e:
-        print(f"下載過程中發生錯誤: {e}")
+        runlog.incr("files_failed", source="mops")
+        log.error("下載過程中發生錯誤", file=data.get("fileName"), error=e)
         return None
 
+# pandas 1.3 起以 on_bad_lines 取代 error_bad_lines / warn_bad_lines（2.0 已移除舊參數）
+def _bad_line_options():
+    major, minor = (int(p) for p in pd.__version__.split(".")[:2])
+    if (major, minor) >= (1, 3):
+        return {"on_bad_lines": "warn"}
+    return {"error_bad_lines": False, "warn_bad_lines": True}
+
 # 定義解析 CSV 的函數
 def parse_csv(csv_text):
     try:
@@ -28,13 +46,12 @@ def parse_csv(csv_text):
             StringIO(csv_text),
             engine="python",
             sep=None,
-            error_bad_lines=False,
-            warn_bad_lines=True
+            **_bad_line_options()
         )
-        print(f"CSV 文件成功解析！欄位名稱: {df.columns.tolist()}")
+        log.debug("CSV 文件成功解析", rows=len(df), columns=df.columns.tolist())
         return df
     except Exception as e:
-        print(f"解析過程中發生錯誤: {e}")
+        log.error("解析過程中發生錯誤", error=e)
         return None
 
 def process_data(df, stock_codes, report_month):
@@ -50,22 +67,22 @@ def process_data(df, stock_codes, report_month):
         # 檢查是否包含所有必要欄位
         if not all(col in df.columns for col in required_columns):
             missing_columns = [col for col in required_columns if col not in df.columns]
-            print(f"缺少以下必要欄位: {missing_columns}")
+            log.error("缺少必要欄位", month=report_month, missing=missing_columns)
             return None
 
         # 重新命名欄位
         df = df.rename(columns=column_mapping)
 
         # 確保股票代碼與 CSV 的公司代號格式一致
-        stock_codes = [code.strip() for code in stock_codes]
+        stock_codes = frozenset(code.strip() for code in stock_codes)
         df['stock_no'] = df['stock_no'].astype(str).str.strip()
         filtered_df = df[df['stock_no'].isin(stock_codes)].copy()
         filtered_df['revenue_month'] = report_month
 
-        print(f"成功提取與指定股票代碼相關的資料，數量: {len(filtered_df)}")
+        log.debug("已提取指定股票代碼的資料", month=report_month, rows=len(filtered_df))
         return filtered_df
     except Exception as e:
-        print(f"處理過程中發生錯誤: {e}")
+        log.error("處理過程中發生錯誤", month=report_month, error=e)
         return None
 
 # 初始化 SQLite 資料表
@@ -84,15 +101,15 @@ def init_db(db_name, table_name):
         """)
         conn.commit()
         conn.close()
-        print(f"資料表 {table_name} 已初始化（若不存在則建立）。")
+        log.debug("資料表已初始化", table=table_name)
     except Exception as e:
-        print(f"初始化資料表過程中發生錯誤: {e}")
+        log.error("初始化資料表過程中發生錯誤", table=table_name, error=e)
 
 # 儲存資料至 SQLite 的函數
 def save_to_sqlite(db_name, table_name, df):
     try:
         if df.empty:
-            print("警告: 嘗試保存的資料為空，略過保存步驟。")
+            log.warning("嘗試保存的資料為空，略過保存步驟", table=table_name)
             return
 
         conn = sqlite3.connect(db_name)
@@ -112,49 +129,56 @@ def save_to_sqlite(db_name, table_name, df):
 
         conn.commit()
         conn.close()
-        print(f"資料成功儲存至資料庫 {db_name} 的資料表 {table_name}，儲存筆數: {len(df)}")
+        runlog.incr("rows_upserted", len(df), table=table_name)
+        log.info("資料已儲存", table=table_name, month=df['revenue_month'].iloc[0], rows=len(df))
     except Exception as e:
-        print(f"儲存過程中發生錯誤: {e}")
+        log.error("儲存過程中發生錯誤", table=table_name, error=e)
 
-# 讀取股票代碼清單
+# 讀取股票代碼清單（略過註解行與已下市代號）
 def read_stock_codes(config_file):
     try:
-        with open(config_file, 'r') as file:
-            stock_codes = [line.strip().split()[0] for line in file if line.strip()]
-        print(f"成功讀取股票代碼: {stock_codes}")
+        stock_codes = [code for code, _ in universe.filter_listed(universe.read_cfg(config_file))]
+        log.info("已讀取股票代碼", cfg=config_file, count=len(stock_codes))
+        log.debug("股票代碼清單", cfg=config_file, codes=stock_codes)
         return stock_codes
     except Exception as e:
-        print(f"讀取股票代碼過程中發生錯誤: {e}")
+        log.error("讀取股票代碼過程中發生錯誤", cfg=config_file, error=e)
         return []
 
+# 組出指定月份營收 CSV 的下載參數，回傳 (檔名, POST 資料, 營收月份)
+def build_request(filepath, report_date):
+    year = report_date.year - 1911
+    month = report_date.month
+    file_name = f"t21sc03_{year}_{month}.csv"
+    data = {
+        'step': '9',
+        'functionName': 'show_file2',
+        'filePath': filepath,
+        'fileName': file_name
+    }
+    return file_name, data, f"{report_date.year}-{report_date.month:02d}"
+
 # 處理市場資料的函數
 def handle_market_data(url, filepath, stock_codes, db_name, table_name, start_date):
     for i in range(6):
         report_date = start_date - relativedelta(months=i)
-        year = report_date.year - 1911
-        month = report_date.month
-        file_name = f"t21sc03_{year}_{month}.csv"
-        data = {
-            'step': '9',
-            'functionName': 'show_file2',
-            'filePath': filepath,
-            'fileName': file_name
-        }
+        file_name, data, report_month = build_request(filepath, report_date)
 
-        print(f"正在處理檔案: {file_name}")
+        log.info("正在處理檔案", file=file_name)
         csv_text = fetch_csv_data(url, data)
         if csv_text:
             df = parse_csv(csv_text)
             if df is not None:
-                filtered_data = process_data(df, stock_codes, f"{report_date.year}-{report_date.month:02d}")
+                filtered_data = process_data(df, stock_codes, report_month)
                 if filtered_data is not None:
                     save_to_sqlite(db_name, table_name, filtered_data)
 
 # 主程式
 def main():
-    url = 'https://mopsov.twse.com.tw/server-java/FileDownLoad'
+    url = MOPS_URL
     db_name = 'stock_data.db'
     table_name = 'monthly_revenue'
+    runlog.setup("get_monthly_revenue")
 
     # 初始化資料表
     init_db(db_name, table_name)
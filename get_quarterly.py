@@ -0,0 +1,355 @@
+"""
+功能：下載公開資訊觀測站各市場每季「綜合損益表」與「資產負債表」彙總檔，
+      寫入 eps_report 使用的 stock_quarterly，並由年度股價與 EPS 在本機推導 YearlyPER。
+
+- 每個 市場 x 季 x 報表 只下載一個檔案，內容雜湊與上次相同就不再解析。
+- 有變動的檔案以多行程平行解析 (pd.read_html)。
+- 損益表為年初至今累計數，先存入 quarterly_ytd，再相減得到單季數值；
+  只重算有變動的季別與其下一季。
+- 以 executemany 批次寫入。
+
+使用方法：
+    python get_quarterly.py --start-year 2019 --end-year 2024
+"""
+
+import hashlib
+import sqlite3
+import argparse
+import time
+from io import StringIO
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import requests
+
+import runlog
+
+log = runlog.get_logger("get_quarterly")
+
+DB_NAME = "stock_data.db"
+MOPS_URL = "https://mopsov.twse.com.tw/mops/web/"
+MARKETS = {"twse": "sii", "otc": "otc"}
+REPORTS = {"income": "ajax_t163sb04", "balance": "ajax_t163sb05"}
+
+# 各產業格式欄位名稱不同，依序取第一個存在的欄位
+COLUMN_CANDIDATES = {
+    "revenue": ["營業收入", "收益", "淨收益", "收入", "營業收入淨額"],
+    "net_income": ["本期淨利（淨損）", "本期稅後淨利（淨損）", "本期綜合損益總額"],
+    "eps": ["基本每股盈餘（元）", "基本每股盈餘"],
+    "capital": ["股本"],
+}
+
+# 初始化資料表
+def init_db(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_quarterly (
+            stock_no TEXT,
+            quarter TEXT,
+            eps REAL,
+            net_income_after_tax REAL,
+            quarter_revenue REAL,
+            capital REAL,
+            PRIMARY KEY (stock_no, quarter)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS YearlyPER (
+            stock_no TEXT,
+            year INTEGER,
+            highest_per REAL,
+            average_per REAL,
+            lowest_per REAL,
+            PRIMARY KEY (stock_no, year)
+        )
+    ''')
+    # 損益表原始累計數與股本
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quarterly_ytd (
+            stock_no TEXT,
+            quarter TEXT,
+            eps_ytd REAL,
+            net_income_ytd REAL,
+            revenue_ytd REAL,
+            capital REAL,
+            PRIMARY KEY (stock_no, quarter)
+        )
+    ''')
+    # 已處理檔案的內容雜湊，內容未變就不重新解析
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quarterly_ingest_log (
+            market TEXT,
+            quarter TEXT,
+            report TEXT,
+            content_hash TEXT,
+            fetched_at TEXT,
+            PRIMARY KEY (market, quarter, report)
+        )
+    ''')
+    conn.commit()
+
+def quarter_label(year, season):
+    return f"{year}Q{season}"
+
+# 下載單一 市場 x 季 x 報表 的 HTML
+def fetch_report_html(session, market, year, season, report):
+    data = {
+        "encodeURIComponent": 1,
+        "step": 1,
+        "firstin": 1,
+        "off": 1,
+        "isQuery": "Y",
+        "TYPEK": MARKETS[market],
+        "year": year - 1911,
+        "season": f"{season:02d}",
+    }
+    response = session.post(MOPS_URL + REPORTS[report], data=data, timeout=60)
+    response.encoding = "utf-8"
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+    return response.text
+
+def _pick_column(columns, key):
+    for name in COLUMN_CANDIDATES[key]:
+        if name in columns:
+            return name
+    return None
+
+def _to_number(series):
+    s = series.astype(str).str.replace(",", "", regex=False).str.strip()
+    return pd.to_numeric(s, errors="coerce")
+
+# 解析 HTML 中各產業的表格，回傳 stock_no 與所需欄位（在子行程中執行）
+def parse_report_html(html, report):
+    try:
+        tables = pd.read_html(StringIO(html))
+    except ValueError:
+        return pd.DataFrame(columns=["stock_no"])
+
+    keys = ["revenue", "net_income", "eps"] if report == "income" else ["capital"]
+    frames = []
+    for table in tables:
+        if isinstance(table.columns, pd.MultiIndex):
+            table.columns = [c[-1] for c in table.columns]
+        table.columns = [str(c).strip() for c in table.columns]
+        if "公司代號" not in table.columns:
+            continue
+        part = pd.DataFrame({"stock_no": table["公司代號"].astype(str).str.strip()})
+        for key in keys:
+            col = _pick_column(table.columns, key)
+            part[key] = _to_number(table[col]) if col else float("nan")
+        frames.append(part[part["stock_no"].str.match(r"^\w{4,6}$")])
+    if not frames:
+        return pd.DataFrame(columns=["stock_no"] + keys)
+    return pd.concat(frames, ignore_index=True).drop_duplicates("stock_no", keep="first")
+
+def _parse_job(job):
+    market, quarter, report, html = job
+    return market, quarter, report, parse_report_html(html, report)
+
+# 下載所有檔案，回傳內容有變動者
+def download_changed(conn, periods, sleep_seconds):
+    session = requests.Session()
+    known = {
+        (m, q, r): h for m, q, r, h in
+        conn.execute("SELECT market, quarter, report, content_hash FROM quarterly_ingest_log")
+    }
+    changed = []
+    for market in MARKETS:
+        for year, season in periods:
+            quarter = quarter_label(year, season)
+            for report in REPORTS:
+                try:
+                    html = fetch_report_html(session, market, year, season, report)
+                except Exception as e:
+                    runlog.incr("reports_failed", market=market)
+                    log.warning("下載季報失敗", market=market, quarter=quarter, report=report, error=e)
+                    continue
+                finally:
+                    time.sleep(sleep_seconds)
+                content_hash = hashlib.sha1(html.encode("utf-8")).hexdigest()
+                if known.get((market, quarter, report)) == content_hash:
+                    runlog.incr("reports_skipped", market=market)
+                    log.debug("內容未變動，略過", market=market, quarter=quarter, report=report)
+                    continue
+                changed.append((market, quarter, report, html, content_hash))
+    return changed
+
+# 將解析結果依季別合併（新解析的欄位覆蓋舊值）後寫入 quarterly_ytd
+def save_ytd(conn, parsed):
+    parts_by_quarter = {}
+    for market, quarter, report, df in parsed:
+        parts_by_quarter.setdefault(quarter, []).append(df.set_index("stock_no"))
+
+    merged = {}
+    for quarter, parts in parts_by_quarter.items():
+        combined = pd.read_sql(
+            "SELECT stock_no, eps_ytd AS eps, net_income_ytd AS net_income, "
+            "revenue_ytd AS revenue, capital FROM quarterly_ytd WHERE quarter = ?",
+            conn, params=(quarter,)).set_index("stock_no")
+        for part in parts:
+            combined = part.combine_first(combined)
+        merged[quarter] = combined.rename_axis("stock_no").reset_index()
+
+    rows = 0
+    for quarter, df in merged.items():
+        df = df.reindex(columns=["stock_no", "eps", "net_income", "revenue", "capital"])
+        records = [
+            (r.stock_no, quarter,
+             None if pd.isna(r.eps) else float(r.eps),
+             None if pd.isna(r.net_income) else float(r.net_income),
+             None if pd.isna(r.revenue) else float(r.revenue),
+             None if pd.isna(r.capital) else float(r.capital))
+            for r in df.itertuples(index=False)
+        ]
+        conn.executemany('''
+            INSERT OR REPLACE INTO quarterly_ytd
+            (stock_no, quarter, eps_ytd, net_income_ytd, revenue_ytd, capital)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', records)
+        rows += len(records)
+    return rows
+
+# 由累計數相減得到單季數值，只處理受影響的季別
+def derive_quarterly(conn, quarters):
+    affected = set()
+    for quarter in quarters:
+        year, season = int(quarter[:4]), int(quarter[-1])
+        affected.add(quarter)
+        if season < 4:
+            affected.add(quarter_label(year, season + 1))
+    years = sorted({q[:4] for q in affected})
+    placeholders = ",".join("?" * len(years))
+    ytd = pd.read_sql(
+        f"SELECT * FROM quarterly_ytd WHERE SUBSTR(quarter, 1, 4) IN ({placeholders})",
+        conn, params=years)
+    if ytd.empty:
+        return 0
+
+    ytd = ytd.sort_values(["stock_no", "quarter"])
+    ytd["year"] = ytd["quarter"].str[:4]
+    ytd["season"] = ytd["quarter"].str[-1].astype(int)
+    prev = ytd.groupby(["stock_no", "year"])[["eps_ytd", "net_income_ytd", "revenue_ytd", "season"]].shift(1)
+    # 上一季缺資料時無法相減，只有第一季可直接使用累計數
+    has_prev = (prev["season"] == ytd["season"] - 1)
+    first = ytd["season"] == 1
+
+    out = pd.DataFrame({"stock_no": ytd["stock_no"], "quarter": ytd["quarter"], "capital": ytd["capital"]})
+    for src, dst in (("eps_ytd", "eps"), ("net_income_ytd", "net_income_after_tax"),
+                     ("revenue_ytd", "quarter_revenue")):
+        out[dst] = ytd[src].where(first, (ytd[src] - prev[src]).where(has_prev))
+    out = out[out["quarter"].isin(affected) & (first | has_prev)]
+
+    records = [
+        (r.stock_no, r.quarter,
+         None if pd.isna(r.eps) else round(float(r.eps), 2),
+         None if pd.isna(r.net_income_after_tax) else float(r.net_income_after_tax),
+         None if pd.isna(r.quarter_revenue) else float(r.quarter_revenue),
+         None if pd.isna(r.capital) else float(r.capital))
+        for r in out.itertuples(index=False)
+    ]
+    conn.executemany('''
+        INSERT OR REPLACE INTO stock_quarterly
+        (stock_no, quarter, eps, net_income_after_tax, quarter_revenue, capital)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', records)
+    return len(records)
+
+def _existing_tables(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+
+# 由年度股價與全年 EPS 推導 YearlyPER（受影響年度，以及尚無 PER 的年度）
+def derive_yearly_per(conn, years=None):
+    tables = _existing_tables(conn)
+    sources = [t for t in ("YearlyData", "OTCYearlyData") if t in tables]
+    if not sources:
+        return 0
+    prices = pd.concat([
+        pd.read_sql(f"SELECT stock_no, year, highest_price, lowest_price, average_close_price FROM {t}", conn)
+        for t in sources
+    ], ignore_index=True).drop_duplicates(["stock_no", "year"])
+
+    eps = pd.read_sql('''
+        SELECT stock_no, CAST(SUBSTR(quarter, 1, 4) AS INTEGER) AS year,
+               SUM(eps) AS yearly_eps, COUNT(*) AS n
+        FROM stock_quarterly
+        GROUP BY stock_no, year
+    ''', conn)
+    eps = eps[(eps["n"] == 4) & (eps["yearly_eps"] > 0)]
+
+    df = prices.merge(eps, on=["stock_no", "year"])
+    existing = pd.read_sql("SELECT stock_no, year FROM YearlyPER", conn)
+    existing_keys = set(zip(existing["stock_no"], existing["year"]))
+    missing = [(s, y) not in existing_keys for s, y in zip(df["stock_no"], df["year"])]
+    selected = pd.Series(missing, index=df.index)
+    if years:
+        selected |= df["year"].isin(years)
+    df = df[selected]
+
+    records = [
+        (r.stock_no, int(r.year),
+         round(r.highest_price / r.yearly_eps, 2),
+         round(r.average_close_price / r.yearly_eps, 2),
+         round(r.lowest_price / r.yearly_eps, 2))
+        for r in df.itertuples(index=False)
+    ]
+    conn.executemany('''
+        INSERT OR REPLACE INTO YearlyPER (stock_no, year, highest_per, average_per, lowest_per)
+        VALUES (?, ?, ?, ?, ?)
+    ''', records)
+    return len(records)
+
+def run(periods, sleep_seconds=3, workers=None):
+    conn = sqlite3.connect(DB_NAME)
+    init_db(conn)
+
+    changed = download_changed(conn, periods, sleep_seconds)
+    if changed:
+        jobs = [(m, q, r, html) for m, q, r, html, _ in changed]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(_parse_job, jobs))
+
+        with conn:
+            ytd_rows = save_ytd(conn, parsed)
+            quarters = sorted({q for _, q, _, _ in parsed})
+            q_rows = derive_quarterly(conn, quarters)
+            now = datetime.now().isoformat(timespec="seconds")
+            conn.executemany('''
+                INSERT OR REPLACE INTO quarterly_ingest_log (market, quarter, report, content_hash, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(m, q, r, h, now) for m, q, r, _, h in changed])
+        runlog.incr("rows_upserted", ytd_rows, table="quarterly_ytd")
+        runlog.incr("rows_upserted", q_rows, table="stock_quarterly")
+        log.info("季報寫入完成", reports=len(changed), ytd_rows=ytd_rows, quarterly_rows=q_rows)
+        years = sorted({int(q[:4]) for q in quarters})
+    else:
+        log.info("所有季報內容皆未變動")
+        years = []
+
+    with conn:
+        per_rows = derive_yearly_per(conn, years)
+    runlog.incr("rows_upserted", per_rows, table="YearlyPER")
+    log.info("YearlyPER 寫入完成", rows=per_rows)
+    conn.close()
+
+def main():
+    current_year = datetime.now().year
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start-year", type=int, default=current_year - 5)
+    parser.add_argument("--end-year", type=int, default=current_year)
+    parser.add_argument("--sleep", type=float, default=3, help="每次下載後暫停秒數")
+    parser.add_argument("--workers", type=int, help="解析用的行程數")
+    args = parser.parse_args()
+
+    runlog.setup("get_quarterly")
+    now = datetime.now()
+    periods = [
+        (year, season)
+        for year in range(args.start_year, args.end_year + 1)
+        for season in range(1, 5)
+        if (year, season) < (now.year, (now.month - 1) // 3 + 1)
+    ]
+    run(periods, args.sleep, args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+功能：以 asyncio 執行整個夜間流程的單一入口。
+
+- 證交所、櫃買中心、公開資訊觀測站是不同主機，三個抓取階段同時進行；
+  每個主機共用一個連線池（aiohttp 的 ClientSession，未安裝 aiohttp 時改用
+  requests.Session 於執行緒中發送），並各自限制同時請求數與請求間隔。
+- 抓到的資料經由有上限的佇列交給唯一的資料庫寫入者批次寫入，
+  佇列滿時抓取端會等待，寫入較慢時不會無限制佔用記憶體。
+- 年度價格提交後立即更新季報與 YearlyPER；營收與季報都提交後先做資料驗證，
+  接著啟動估值報表。法說會通知（Yahoo）與抓取同時執行。
+- 進度以 runlog 結構化紀錄輸出，計數器（抓取/失敗檔數、寫入筆數、請求次數）於結束時寫出。
+
+使用方法：
+    python nightly.py
+    python nightly.py --skip earnings_call,eps_report --queue-size 64
+    python nightly.py --log-level WARNING --metrics-dir /var/lib/node_exporter/textfile
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from dateutil.relativedelta import relativedelta
+
+import fast_decode
+import getTWSE
+import getOTC
+import get_monthly_revenue
+import runlog
+import universe
+import validation
+from fetch_common import HOSTS, INSERT_SQL, HostClient
+
+log = runlog.get_logger("nightly")
+
+DB_NAME = "stock_data.db"
+PYTHON = sys.executable
+REVENUE_MONTHS = 6
+MAX_CONSECUTIVE_ERRORS = 3  # 同一主機連續失敗次數達上限即停止該階段（比照原腳本遇錯中斷）
+WRITE_BATCH = 256           # 寫入者每次最多合併的佇列項目數
+
+# 唯一的資料庫寫入者：所有寫入都在同一條執行緒、同一個連線上進行
+class DbWriter:
+    def __init__(self, loop, db_name):
+        self.loop = loop
+        self.db_name = db_name
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.conn = None
+        self.rows = {}
+        self.error = None
+
+    def call(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.db_name, timeout=60)
+
+    # 一次寫入多個佇列項目並提交，回傳本批完成的階段
+    def _write_batch(self, batch):
+        finished = []
+        with self.conn:
+            for kind, stage, payload in batch:
+                if kind == "done":
+                    finished.append(stage)
+                    continue
+                table, records = payload
+                self.conn.executemany(INSERT_SQL[table], records)
+                self.rows[table] = self.rows.get(table, 0) + len(records)
+                runlog.incr("rows_upserted", len(records), table=table)
+        return finished
+
+    def _close(self):
+        self.conn.close()
+
+    async def run(self, queue, events):
+        await self.call(self._open)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                while len(batch) < WRITE_BATCH and not queue.empty():
+                    extra = queue.get_nowait()
+                    if extra is None:
+                        queue.put_nowait(None)
+                        break
+                    batch.append(extra)
+                for stage in await self.call(self._write_batch, batch):
+                    events[stage].set()
+        except Exception as e:
+            # 先記錄錯誤再放行下游，下游據此略過後續階段；呼叫端會取消仍在等待佇列的抓取端
+            self.error = e
+            raise
+        finally:
+            # 寫入失敗時也要放行下游，避免互相等待
+            for event in events.values():
+                event.set()
+            await self.call(self._close)
+            self.executor.shutdown()
+
+# 讀取資料表中既有的 (股票代號, 年度)
+def load_existing(db_name, table):
+    conn = sqlite3.connect(db_name)
+    rows = conn.execute(f"SELECT stock_no, year FROM {table}").fetchall()
+    conn.close()
+    return {(stock_no, int(year)) for stock_no, year in rows}
+
+async def fetch_twse(client, stock_no):
+    text = await client.request("GET", getTWSE.FMNPTK_URL.format(stock_no))
+    return getTWSE.extract_annual_table(fast_decode.loads(text), stock_no)
+
+async def fetch_otc(client, stock_no):
+    data = {"code": stock_no, "id": "", "response": "json"}
+    text = await client.request("POST", getOTC.YEARLY_STOCK_URL, data=data)
+    return getOTC.extract_annual_table(fast_decode.loads(text), stock_no)
+
+# 年度價格階段的設定
+YEARLY_STAGES = {
+    "yearly_twse": {"module": getTWSE, "table": "YearlyData", "cfg": "twse.cfg", "host": "twse", "fetch": fetch_twse},
+    "yearly_otc": {"module": getOTC, "table": "OTCYearlyData", "cfg": "otc.cfg", "host": "tpex", "fetch": fetch_otc},
+}
+
+# 年度價格：略過已下市與上一年度已有資料的股票，逐檔抓取後交給寫入者
+async def yearly_stage(stage, client, queue, db_name):
+    spec = YEARLY_STAGES[stage]
+    existing = load_existing(db_name, spec["table"])
+    current_year = datetime.now().year
+    stocks = [(code, name) for code, name in universe.filter_listed(universe.read_cfg(spec["cfg"]), db_name)
+              if (code, current_year - 1) not in existing]
+    log.info("需要抓取", stage=stage, stocks=len(stocks))
+    state = {"errors": 0, "stopped": False}
+
+    async def one(stock_no, stock_name):
+        if state["stopped"]:
+            return
+        try:
+            data = await spec["fetch"](client, stock_no)
+            result = spec["module"].parse_yearly_rows(stock_no, data, exists=lambda s, y: (s, y) in existing)
+        except Exception as e:
+            runlog.incr("stocks_failed", stage=stage)
+            log.warning("抓取年度資料失敗", stage=stage, stock_no=stock_no, name=stock_name, error=e)
+            state["errors"] += 1
+            if state["errors"] >= MAX_CONSECUTIVE_ERRORS and not state["stopped"]:
+                state["stopped"] = True
+                log.error("連續失敗達上限，停止抓取", stage=stage, errors=state["errors"])
+            return
+        state["errors"] = 0
+        runlog.incr("stocks_fetched", stage=stage)
+        records = [
+            (stock_no, year, s["highest_price"], s["highest_date"],
+             s["lowest_price"], s["lowest_date"], s["average_close_price"])
+            for year, s in result.items()
+        ]
+        if records:
+            await queue.put(("rows", stage, (spec["table"], records)))
+
+    await asyncio.gather(*(one(code, name) for code, name in stocks))
+    return not state["stopped"]
+
+# 月營收：上市、上櫃各最近數個月的 CSV，解析放到執行緒中進行
+async def revenue_stage(client, queue, loop, executor, db_name):
+    start_date = datetime.now().replace(day=1) - timedelta(days=1)
+    markets = [("twse.cfg", "/t21/sii/"), ("otc.cfg", "/t21/otc/")]
+    jobs = []
+    for cfg, filepath in markets:
+        codes = [code for code, _ in universe.filter_listed(universe.read_cfg(cfg), db_name)]
+        if codes:
+            jobs.extend((codes, filepath, start_date - relativedelta(months=i)) for i in range(REVENUE_MONTHS))
+
+    async def one(codes, filepath, report_date):
+        file_name, data, report_month = get_monthly_revenue.build_request(filepath, report_date)
+        try:
+            csv_text = await client.request("POST", get_monthly_revenue.MOPS_URL, data=data, encoding="utf-8")
+        except Exception as e:
+            runlog.incr("files_failed", source="mops")
+            log.warning("營收檔案下載失敗", stage="monthly_revenue", file=file_name, error=e)
+            return False
+        runlog.incr("files_fetched", source="mops")
+        df = await loop.run_in_executor(executor, get_monthly_revenue.parse_csv, csv_text)
+        if df is None:
+            return False
+        filtered = get_monthly_revenue.process_data(df, codes, report_month)
+        if filtered is None or filtered.empty:
+            return filtered is not None
+        columns = ["stock_no", "monthly_revenue", "yoy_growth", "revenue_month"]
+        records = list(filtered[columns].itertuples(index=False, name=None))
+        await queue.put(("rows", "monthly_revenue", ("monthly_revenue", records)))
+        return True
+
+    results = await asyncio.gather(*(one(*job) for job in jobs))
+    return all(results)
+
+# 執行抓取階段，結束後（不論成敗）送出完成標記，由寫入者提交後通知下游
+# 被取消時（寫入者已失敗）不再送出完成標記，佇列已沒有人取出
+async def run_producer(stage, coro, queue, status):
+    try:
+        status[stage] = "ok" if await coro else "partial"
+    except asyncio.CancelledError:
+        status[stage] = "cancelled"
+        raise
+    except Exception as e:
+        log.error("階段發生錯誤", stage=stage, error=e)
+        status[stage] = "failed"
+    await queue.put(("done", stage, None))
+
+async def run_subprocess(stage, args, status):
+    log.info("開始", stage=stage, command=" ".join(args))
+    proc = await asyncio.create_subprocess_exec(PYTHON, *args)
+    code = await proc.wait()
+    log.info("結束", stage=stage, code=code)
+    status[stage] = "ok" if code == 0 else "failed"
+    return code == 0
+
+def run_validation(db_name):
+    conn = sqlite3.connect(db_name, timeout=60)
+    try:
+        return validation.run(conn)
+    finally:
+        conn.close()
+
+# 下游：年度價格提交後更新季報與 YearlyPER，營收也提交後驗證並產生報表
+async def downstream(events, status, writer, loop, executor, skip, db_name):
+    await events["yearly_twse"].wait()
+    await events["yearly_otc"].wait()
+    upstream_ok = (writer.error is None and status.get("yearly_twse") != "failed"
+                   and status.get("yearly_otc") != "failed")
+    if "quarterly" not in skip and upstream_ok:
+        upstream_ok = await run_subprocess("quarterly", ["get_quarterly.py"], status)
+
+    await events["monthly_revenue"].wait()
+    upstream_ok = upstream_ok and writer.error is None and status.get("monthly_revenue") != "failed"
+    if not upstream_ok:
+        log.warning("上游階段失敗，略過驗證與估值報表")
+        return
+    if "validate" not in skip:
+        try:
+            await loop.run_in_executor(executor, run_validation, db_name)
+            status["validate"] = "ok"
+        except Exception as e:
+            log.error("階段發生錯誤", stage="validate", error=e)
+            status["validate"] = "failed"
+            return
+    if "eps_report" not in skip:
+        await run_subprocess("eps_report", ["eps_report.py"], status)
+
+async def nightly(skip=(), queue_size=32, db_name=DB_NAME):
+    loop = asyncio.get_running_loop()
+    getTWSE.init_db()
+    getOTC.init_db()
+    get_monthly_revenue.init_db(db_name, "monthly_revenue")
+
+    executor = ThreadPoolExecutor(max_workers=4)
+    clients = {name: HostClient(name, loop, executor) for name in HOSTS}
+    queue = asyncio.Queue(maxsize=queue_size)
+    producers = ["yearly_twse", "yearly_otc", "monthly_revenue"]
+    events = {stage: asyncio.Event() for stage in producers}
+    status = {}
+
+    writer = DbWriter(loop, db_name)
+    writer_task = asyncio.ensure_future(writer.run(queue, events))
+    others = [asyncio.ensure_future(downstream(events, status, writer, loop, executor, skip, db_name))]
+    if "earnings_call" not in skip:
+        others.append(asyncio.ensure_future(
+            run_subprocess("earnings_call", ["earnings_call.py", "portfolio.cfg"], status)))
+
+    tasks = []
+    for stage in producers:
+        if stage in skip:
+            await queue.put(("done", stage, None))
+            continue
+        if stage == "monthly_revenue":
+            coro = revenue_stage(clients["mops"], queue, loop, executor, db_name)
+        else:
+            coro = yearly_stage(stage, clients[YEARLY_STAGES[stage]["host"]], queue, db_name)
+        tasks.append(asyncio.ensure_future(run_producer(stage, coro, queue, status)))
+
+    try:
+        # 抓取端與寫入者一起等待：寫入者先結束代表寫入失敗，取消抓取端，避免卡在已滿的佇列
+        producers_done = asyncio.ensure_future(asyncio.gather(*tasks))
+        await asyncio.wait([producers_done, writer_task], return_when=asyncio.FIRST_COMPLETED)
+        if writer_task.done():
+            producers_done.cancel()
+            try:
+                await producers_done
+            except asyncio.CancelledError:
+                pass
+        else:
+            await queue.put(None)
+        try:
+            await writer_task
+        except Exception as e:
+            log.error("資料庫寫入失敗", error=e)
+            status["db_writer"] = "failed"
+        await asyncio.gather(*others)
+    finally:
+        for client in clients.values():
+            await client.close()
+        executor.shutdown()
+
+    log.info("寫入筆數", **{t: n for t, n in sorted(writer.rows.items())})
+    log.info("請求次數", **{name: c.requests for name, c in clients.items()})
+    log.info("階段結果", **status)
+    return all(result not in ("failed", "cancelled") for result in status.values())
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--skip", type=str, default="",
+                        help="略過的階段（逗號分隔）：yearly_twse, yearly_otc, monthly_revenue, "
+                             "quarterly, validate, eps_report, earnings_call")
+    parser.add_argument("--queue-size", type=int, default=32, help="抓取端與寫入者之間的佇列上限")
+    parser.add_argument("--log-level", type=str, help="紀錄層級（DEBUG、INFO、WARNING），子行程沿用")
+    parser.add_argument("--metrics-dir", type=str, help="計數器輸出目錄（Prometheus textfile），子行程沿用")
+    args = parser.parse_args()
+
+    if args.log_level:
+        runlog.set_level(args.log_level)
+    if args.metrics_dir:
+        os.environ["RUN_METRICS_DIR"] = args.metrics_dir
+    runlog.setup("nightly")
+
+    skip = {s.strip() for s in args.skip.split(",") if s.strip()}
+    ok = asyncio.run(nightly(skip, args.queue_size))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+功能：將 stock_data.db 匯出為依市場/年度分割的 Parquet（zstd 壓縮），
+      並提供讀回函式，讓 eps_report 以一次欄式讀取取代逐檔 SQL 查詢
+      （讀回後依 stock_no 分組，直接交給 data_access.StockDataCache）。
+
+資料集：
+    yearly_price/     YearlyData (market=twse) + OTCYearlyData (market=otc)
+    monthly_revenue/  monthly_revenue
+    stock_quarterly/  stock_quarterly
+    yearly_per/       YearlyPER
+每個資料集皆以 market=.../year=... 分割；非上市櫃清單內的代號歸到 market=other。
+
+使用方法：
+    python parquet_store.py export --out parquet_snapshot
+    python parquet_store.py export --out parquet_20240930 --as-of 2024-09-30
+    python eps_report.py --parquet-dir parquet_snapshot
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import argparse
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+import data_access
+import point_in_time
+import runlog
+
+log = runlog.get_logger("parquet_store")
+
+DB_NAME = "stock_data.db"
+MANIFEST_JSON = "_manifest.json"
+
+# 資料集名稱 -> [(來源資料表, 固定市場或 None, 年度欄位來源)]
+DATASETS = {
+    "yearly_price": [("YearlyData", "twse", "year"), ("OTCYearlyData", "otc", "year")],
+    "monthly_revenue": [("monthly_revenue", None, "revenue_month")],
+    "stock_quarterly": [("stock_quarterly", None, "quarter")],
+    "yearly_per": [("YearlyPER", None, "year")],
+}
+
+def _require_pyarrow():
+    if pq is None:
+        raise RuntimeError("需要安裝 pyarrow 才能讀寫 Parquet（pip install pyarrow）")
+
+# 依 twse.cfg / otc.cfg 決定每個代號所屬市場
+def load_market_map(twse_cfg="twse.cfg", otc_cfg="otc.cfg"):
+    from eps_report import load_stock_codes_and_names
+    market_map = {code: "otc" for code in load_stock_codes_and_names(otc_cfg)}
+    market_map.update({code: "twse" for code in load_stock_codes_and_names(twse_cfg)})
+    return market_map
+
+def _table_frame(conn, table, market, year_source, market_map):
+    if not point_in_time.table_exists(conn, table):
+        return None
+    df = pd.read_sql(f"SELECT * FROM {table}", conn)
+    df["stock_no"] = df["stock_no"].astype(str)
+    if market:
+        df["market"] = market
+    else:
+        df["market"] = df["stock_no"].map(market_map).fillna("other")
+    if year_source != "year":
+        df["year"] = df[year_source].astype(str).str[:4].astype(int)
+    return df
+
+# 匯出所有資料集，每次覆寫整個資料集目錄
+def export_parquet(conn, out_dir, compression="zstd"):
+    _require_pyarrow()
+    market_map = load_market_map()
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {"exported_at": datetime.now().isoformat(timespec="seconds"), "datasets": {}}
+
+    for name, sources in DATASETS.items():
+        frames = [_table_frame(conn, table, market, year_source, market_map)
+                  for table, market, year_source in sources]
+        frames = [df for df in frames if df is not None]
+        if not frames:
+            log.info("資料集無來源資料表，略過", dataset=name)
+            continue
+        df = pd.concat(frames, ignore_index=True)
+
+        path = os.path.join(out_dir, name)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_to_dataset(table, root_path=path, partition_cols=["market", "year"],
+                            compression=compression)
+        manifest["datasets"][name] = {"rows": len(df), "columns": list(df.columns)}
+        runlog.incr("rows_exported", len(df), dataset=name)
+        log.info("資料集匯出完成", dataset=name, rows=len(df))
+
+    with open(os.path.join(out_dir, MANIFEST_JSON), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+def _read_dataset(root, name, columns=None):
+    path = os.path.join(root, name)
+    if not os.path.exists(path):
+        return None
+    df = pq.read_table(path, columns=columns).to_pandas()
+    for col in ("market", "year"):
+        if col in df.columns:
+            df[col] = df[col].astype(str if col == "market" else int)
+    return df
+
+# 讀回各資料表，欄位與 stock_data.db 相同
+def load_tables(root):
+    _require_pyarrow()
+    tables = {}
+    for name, sources in DATASETS.items():
+        df = _read_dataset(root, name)
+        if df is None:
+            continue
+        for table, market, year_source in sources:
+            part = df[df["market"] == market] if market else df
+            drop_cols = ["market"] if year_source == "year" else ["market", "year"]
+            tables[table] = part.drop(columns=drop_cols).reset_index(drop=True)
+    return tables
+
+# 讀回並依 stock_no 分組，回傳 {切片種類: {代號: DataFrame}}，可直接傳給 StockDataCache(frames=...)
+def load_stock_frames(root):
+    return data_access.group_slices(load_tables(root))
+
+def manifest_path(root):
+    return os.path.join(root, MANIFEST_JSON)
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+    exp = sub.add_parser("export")
+    exp.add_argument("--out", type=str, default="parquet_snapshot")
+    exp.add_argument("--as-of", type=str, help="匯出指定時間點當下的資料")
+    exp.add_argument("--compression", type=str, default="zstd")
+    args = parser.parse_args()
+
+    if args.command != "export":
+        parser.print_help()
+        return
+    runlog.setup("parquet_store")
+    if not os.path.exists(DB_NAME):
+        log.error("找不到資料庫", db=DB_NAME)
+        return
+
+    conn = sqlite3.connect(DB_NAME)
+    if args.as_of:
+        point_in_time.attach_as_of(conn, args.as_of)
+    export_parquet(conn, args.out, args.compression)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+功能：以相依關係 (DAG) 執行每日各階段，並追蹤每個 股票/期間 分割是否變動，
+      只對受影響的股票重跑下游估值。
+
+- 各階段仍是原本的腳本（以子行程執行），沒有相依關係的階段同時執行。
+- 產出資料的階段執行後，逐列計算資料表的指紋並與 partition_log 比對，
+  記下哪些 (資料表, 股票, 期間) 在本次執行中變動。
+- 追蹤用資料表放在獨立的 pipeline_state.db，不會改動 stock_data.db 的修改時間
+  （eps_report 的估值快取以該時間為鍵）。
+- 估值報表每次都會產生（收盤價每天變動）；只有上次執行後有變動的股票重新估值
+  （eps_report.py --stocks），其餘沿用估值快取。第一次執行或 --full 時全部重新估值。
+
+使用方法：
+    python pipeline.py                      # 執行全部階段
+    python pipeline.py --only eps_report    # 只執行指定階段（其相依視為已完成）
+    python pipeline.py --full --dry-run     # 列出將執行的指令
+"""
+
+import sys
+import zlib
+import sqlite3
+import argparse
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import point_in_time
+import runlog
+
+log = runlog.get_logger("pipeline")
+
+DB_NAME = "stock_data.db"
+STATE_DB = "pipeline_state.db"
+PYTHON = sys.executable
+
+# 各階段：指令、相依階段、產出的資料表、讀取的資料表、是否可只跑部分股票
+STAGES = {
+    "yearly_twse": {
+        "cmd": [PYTHON, "getTWSE.py"],
+        "deps": [],
+        "produces": ["YearlyData"],
+    },
+    "yearly_otc": {
+        "cmd": [PYTHON, "getOTC.py"],
+        "deps": [],
+        "produces": ["OTCYearlyData"],
+    },
+    "monthly_revenue": {
+        "cmd": [PYTHON, "get_monthly_revenue.py"],
+        "deps": [],
+        "produces": ["monthly_revenue"],
+    },
+    "quarterly": {
+        "cmd": [PYTHON, "get_quarterly.py"],
+        "deps": ["yearly_twse", "yearly_otc"],
+        "produces": ["stock_quarterly", "YearlyPER"],
+    },
+    "validate": {
+        "cmd": [PYTHON, "validation.py"],
+        "deps": ["yearly_twse", "yearly_otc", "monthly_revenue", "quarterly"],
+        "produces": ["YearlyData", "OTCYearlyData", "monthly_revenue", "stock_quarterly", "YearlyPER"],
+    },
+    "eps_report": {
+        "cmd": [PYTHON, "eps_report.py"],
+        "deps": ["monthly_revenue", "quarterly", "validate"],
+        "consumes": ["monthly_revenue", "stock_quarterly", "YearlyPER"],
+        "partial": True,
+    },
+    "earnings_call": {
+        "cmd": [PYTHON, "earnings_call.py", "portfolio.cfg"],
+        "deps": [],
+    },
+}
+
+# 初始化追蹤用資料表
+def init_db(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pipeline_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+    # 每個 (資料表, 股票, 期間) 分割目前的指紋與最後變動的 run_id
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS partition_log (
+            tbl TEXT,
+            stock_no TEXT,
+            period TEXT,
+            fingerprint INTEGER,
+            updated_run INTEGER,
+            PRIMARY KEY (tbl, stock_no, period)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_partition_log_run ON partition_log (tbl, updated_run)")
+    # 各階段最後一次成功執行時讀到的 run_id
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stage_state (
+            stage TEXT PRIMARY KEY,
+            last_run_id INTEGER,
+            finished_at TEXT
+        )
+    ''')
+    conn.commit()
+
+def start_run(conn):
+    cur = conn.execute("INSERT INTO pipeline_runs (started_at) VALUES (?)",
+                       (datetime.now().isoformat(timespec="seconds"),))
+    conn.commit()
+    return cur.lastrowid
+
+# 讀取 data_conn 的資料表逐列計算指紋，記錄到 conn（追蹤資料庫），回傳本次有變動的 (股票, 期間)
+def record_partitions(conn, data_conn, table, run_id):
+    if not point_in_time.table_exists(data_conn, table):
+        return set()
+    stock_col, period_col = point_in_time.VERSIONED_TABLES[table]
+    known = {
+        (s, p): fp for s, p, fp in
+        conn.execute("SELECT stock_no, period, fingerprint FROM partition_log WHERE tbl = ?", (table,))
+    }
+    cursor = data_conn.execute(f"SELECT * FROM {table}")
+    names = [d[0] for d in cursor.description]
+    s_idx, p_idx = names.index(stock_col), names.index(period_col)
+
+    changed = []
+    seen = set()
+    for row in cursor:
+        key = (str(row[s_idx]), str(row[p_idx]))
+        seen.add(key)
+        fp = zlib.crc32(repr(row).encode("utf-8"))
+        if known.get(key) != fp:
+            changed.append((table, key[0], key[1], fp, run_id))
+    # 被刪除（例如遭隔離）的分割也視為變動
+    for key, fp in known.items():
+        if key not in seen and fp is not None:
+            changed.append((table, key[0], key[1], None, run_id))
+    conn.executemany('''
+        INSERT OR REPLACE INTO partition_log (tbl, stock_no, period, fingerprint, updated_run)
+        VALUES (?, ?, ?, ?, ?)
+    ''', changed)
+    conn.commit()
+    return {(s, p) for _, s, p, _, _ in changed}
+
+def last_consumed_run(conn, stage):
+    row = conn.execute("SELECT last_run_id FROM stage_state WHERE stage = ?", (stage,)).fetchone()
+    return row[0] if row else None
+
+def mark_stage_done(conn, stage, run_id):
+    conn.execute('''
+        INSERT OR REPLACE INTO stage_state (stage, last_run_id, finished_at) VALUES (?, ?, ?)
+    ''', (stage, run_id, datetime.now().isoformat(timespec="seconds")))
+    conn.commit()
+
+# 上次執行後，所讀取的資料表中有變動的股票
+def affected_stocks(conn, stage):
+    since = last_consumed_run(conn, stage)
+    if since is None:
+        return None
+    tables = STAGES[stage].get("consumes", [])
+    placeholders = ",".join("?" * len(tables))
+    rows = conn.execute(f'''
+        SELECT DISTINCT stock_no FROM partition_log
+        WHERE tbl IN ({placeholders}) AND updated_run > ?
+    ''', (*tables, since)).fetchall()
+    return sorted(r[0] for r in rows)
+
+# 依受影響股票決定實際指令：只重新估值有變動的股票（可能為空），報表照常產生
+def build_command(conn, stage, full):
+    spec = STAGES[stage]
+    cmd = list(spec["cmd"])
+    if not spec.get("partial") or full:
+        return cmd
+    stocks = affected_stocks(conn, stage)
+    if stocks is None:
+        return cmd
+    return cmd + ["--stocks", ",".join(stocks)]
+
+def run_stage(stage, cmd):
+    log.info("開始", stage=stage, command=" ".join(cmd[1:])[:200])
+    result = subprocess.run(cmd)
+    log.info("結束", stage=stage, code=result.returncode)
+    return result.returncode
+
+# 依相依關係排程，沒有相依的階段同時執行
+def run_pipeline(selected, full=False, dry_run=False, workers=4):
+    conn = sqlite3.connect(STATE_DB, timeout=60)
+    init_db(conn)
+    run_id = start_run(conn)
+    pending = {s: [d for d in STAGES[s]["deps"] if d in selected] for s in selected}
+    done, failed = set(), set()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for stage in [s for s, deps in pending.items() if all(d in done for d in deps)]:
+                del pending[stage]
+                cmd = build_command(conn, stage, full)
+                if dry_run:
+                    log.info("將執行", stage=stage, command=" ".join(cmd[1:])[:200])
+                    done.add(stage)
+                    continue
+                running[pool.submit(run_stage, stage, cmd)] = stage
+
+            # 相依失敗的階段不執行
+            for stage in [s for s, deps in pending.items() if any(d in failed for d in deps)]:
+                log.warning("相依階段失敗，略過", stage=stage)
+                del pending[stage]
+                failed.add(stage)
+
+            if not running:
+                continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                if future.result() != 0:
+                    failed.add(stage)
+                    continue
+                data_conn = sqlite3.connect(DB_NAME, timeout=60)
+                for table in STAGES[stage].get("produces", []):
+                    changed = record_partitions(conn, data_conn, table, run_id)
+                    log.info("變動分割數", stage=stage, table=table, partitions=len(changed))
+                data_conn.close()
+                mark_stage_done(conn, stage, run_id)
+                done.add(stage)
+
+    conn.execute("UPDATE pipeline_runs SET finished_at = ? WHERE run_id = ?",
+                 (datetime.now().isoformat(timespec="seconds"), run_id))
+    conn.commit()
+    conn.close()
+    return not failed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", type=str, help="只執行指定階段（逗號分隔）")
+    parser.add_argument("--full", action="store_true", help="忽略變動追蹤，估值全部重新計算")
+    parser.add_argument("--dry-run", action="store_true", help="只列出將執行的指令")
+    parser.add_argument("--workers", type=int, default=4, help="同時執行的階段數")
+    args = parser.parse_args()
+
+    runlog.setup("pipeline")
+    selected = list(STAGES)
+    if args.only:
+        selected = [s.strip() for s in args.only.split(",") if s.strip() in STAGES]
+    ok = run_pipeline(selected, full=args.full, dry_run=args.dry_run, workers=args.workers)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+功能：stock_data.db 的時間點快照（point-in-time）。
+
+- install：為各資料表建立 <table>_history 歷史表與觸發器，
+  之後各爬蟲的 INSERT OR REPLACE / UPDATE / DELETE 都會自動附上寫入時間 (ingested_at) 留存一版，
+  爬蟲程式本身不需修改。既有資料以安裝時間作為第一版。
+- attach_as_of：在連線上建立同名的 TEMP VIEW，遮蔽 main 中的資料表，
+  讓既有查詢不需修改就能讀到指定時間點當下的資料。
+  歷史表以 (主鍵, ingested_at) 建立索引，as-of 查詢不需全表掃描。
+
+使用方法：
+    python point_in_time.py install
+    python eps_report.py --as-of 2024-09-30
+"""
+
+import sys
+import sqlite3
+from datetime import datetime
+
+import runlog
+import storage_v2
+
+log = runlog.get_logger("point_in_time")
+
+DB_NAME = "stock_data.db"
+
+# 需要版本化的資料表與其主鍵欄位
+VERSIONED_TABLES = {
+    "YearlyData": ("stock_no", "year"),
+    "OTCYearlyData": ("stock_no", "year"),
+    "monthly_revenue": ("stock_no", "revenue_month"),
+    "stock_quarterly": ("stock_no", "quarter"),
+    "YearlyPER": ("stock_no", "year"),
+}
+
+NOW_EXPR = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+
+def history_table(table):
+    return f"{table}_history"
+
+# 資料表或儲存格式 v2 的同名 VIEW 皆視為存在
+def table_exists(conn, table):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+
+# 在實體資料表上建立寫入歷史的觸發器
+def install_triggers(conn, table, cols):
+    hist = history_table(table)
+    col_list = ", ".join(cols)
+    new_list = ", ".join(f"NEW.{c}" for c in cols)
+    old_list = ", ".join(f"OLD.{c}" for c in cols)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{hist}_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {hist} ({col_list}, ingested_at, is_deleted)
+            VALUES ({new_list}, {NOW_EXPR}, 0);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{hist}_update AFTER UPDATE ON {table}
+        BEGIN
+            INSERT INTO {hist} ({col_list}, ingested_at, is_deleted)
+            VALUES ({new_list}, {NOW_EXPR}, 0);
+        END
+    """)
+    # INSERT OR REPLACE 刪除舊列時不會觸發（recursive_triggers 預設關閉），只記錄真正的刪除
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{hist}_delete AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {hist} ({col_list}, ingested_at, is_deleted)
+            VALUES ({old_list}, {NOW_EXPR}, 1);
+        END
+    """)
+
+# 為單一資料表建立歷史表、索引與觸發器，並把既有資料寫成第一版
+def install_table(conn, table, key_cols, baseline_time):
+    cols = table_columns(conn, table)
+    hist = history_table(table)
+    col_list = ", ".join(cols)
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {hist} AS
+        SELECT *, '' AS ingested_at, 0 AS is_deleted FROM {table} WHERE 0
+    """)
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{hist}_key_time
+        ON {hist} ({", ".join(key_cols)}, ingested_at)
+    """)
+    if storage_v2.is_view(conn, table):
+        # v2 的 VIEW 不能掛 AFTER 觸發器，改由 INSTEAD OF 觸發器一併寫入歷史
+        storage_v2.install_triggers(conn, table)
+    else:
+        install_triggers(conn, table, cols)
+
+    has_history = conn.execute(f"SELECT 1 FROM {hist} LIMIT 1").fetchone()
+    if not has_history:
+        conn.execute(f"""
+            INSERT INTO {hist} ({col_list}, ingested_at, is_deleted)
+            SELECT {col_list}, ?, 0 FROM {table}
+        """, (baseline_time,))
+
+def install(conn):
+    baseline_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.000")
+    for table, key_cols in VERSIONED_TABLES.items():
+        if not table_exists(conn, table):
+            log.info("資料表不存在，略過", table=table)
+            continue
+        install_table(conn, table, key_cols, baseline_time)
+        log.info("資料表已啟用版本紀錄", table=table)
+    conn.commit()
+
+# 將 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS 轉成可比較的 ingested_at 上限
+def normalize_as_of(as_of):
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            dt = datetime.strptime(as_of, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError(f"無法解析時間點: {as_of}")
+    if len(as_of) == 10:
+        return dt.strftime("%Y-%m-%d 23:59:59.999")
+    return dt.strftime("%Y-%m-%d %H:%M:%S.999")
+
+# 在連線上以 TEMP VIEW 遮蔽各資料表，呈現 as_of 當下的資料
+def attach_as_of(conn, as_of):
+    upper = normalize_as_of(as_of)
+    for table, key_cols in VERSIONED_TABLES.items():
+        hist = history_table(table)
+        if not table_exists(conn, hist):
+            log.warning("資料表尚未啟用版本紀錄，as-of 將讀取目前資料", table=table)
+            continue
+        cols = table_columns(conn, table)
+        # 每個主鍵只取 upper 以前最新的一個版本；ingested_at 相同時以較晚寫入的 rowid 為準
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}")
+        conn.execute(f"""
+            CREATE TEMP VIEW {table} AS
+            SELECT {", ".join(cols)} FROM (
+                SELECT h.*, ROW_NUMBER() OVER (
+                    PARTITION BY {", ".join(key_cols)}
+                    ORDER BY ingested_at DESC, rowid DESC
+                ) AS version_rank
+                FROM main.{hist} h
+                WHERE ingested_at <= '{upper}'
+            )
+            WHERE version_rank = 1 AND is_deleted = 0
+        """)
+    return upper
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("install",):
+        log.error("用法: python point_in_time.py install")
+        sys.exit(1)
+    runlog.setup("point_in_time")
+    conn = sqlite3.connect(DB_NAME)
+    install(conn)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+功能：保存上市/上櫃最新收盤價快照（含交易日期），供 eps_report 重複使用。
+
+- 快照中記錄交易日期與 HTTP 驗證標頭（ETag / Last-Modified），
+  若快照已是今日資料，或交易所回應 304，則略過整包 JSON 下載。
+- 下載到新資料時經由 fast_decode 解析，只取出代號、收盤價與日期欄位並一次轉成 NumPy 陣列，
+  不再逐筆 try/except 轉換。
+- 回傳是否有價格變動，呼叫端可據此只重跑分類。
+- 每個交易日的快照另存一份於 price_history/<市場>/<交易日期>.json（含取得時間），
+  get_prices_as_of 可取回指定時間點當下使用的收盤價，供 eps_report --as-of 重現當時的報表。
+"""
+
+import os
+import json
+from datetime import datetime
+
+import numpy as np
+import requests
+
+import fast_decode
+import runlog
+
+log = runlog.get_logger("price_snapshot")
+
+SNAPSHOT_JSON = "price_snapshot.json"
+HISTORY_DIR = "price_history"
+
+# 各市場最新收盤價來源與欄位名稱
+MARKET_SOURCES = {
+    "twse": {
+        "url": "https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_AVG_ALL",
+        "date_field": "Date",
+        "code_field": "Code",
+        "price_field": "ClosingPrice",
+    },
+    "otc": {
+        "url": "https://www.tpex.org.tw/openapi/v1/tpex_mainboard_quotes",
+        "date_field": "Date",
+        "code_field": "SecuritiesCompanyCode",
+        "price_field": "Close",
+    },
+}
+
+# 讀取快照檔，格式錯誤時視為沒有快照
+def load_snapshots(json_path=SNAPSHOT_JSON):
+    if not os.path.exists(json_path):
+        return {}
+    try:
+        with open(json_path, 'rb') as f:
+            data = fast_decode.loads(f.read())
+        if isinstance(data, dict):
+            return data
+        return {}
+    except Exception:
+        return {}
+
+# 以暫存檔再取代的方式寫入，避免中斷時留下半個檔案
+def save_snapshots(snapshots, json_path=SNAPSHOT_JSON):
+    tmp_path = json_path + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshots, f, ensure_ascii=False)
+        os.replace(tmp_path, json_path)
+    except Exception as e:
+        log.error("寫入股價快照失敗", path=json_path, error=e)
+
+def history_path(market, trade_date, history_dir=HISTORY_DIR):
+    return os.path.join(history_dir, market, f"{trade_date}.json")
+
+# 保存單一市場某交易日的快照（已保存過就不覆寫，保留最早取得的時間）
+def archive_snapshot(market, snap, history_dir=HISTORY_DIR):
+    if not snap or not snap.get("date"):
+        return
+    path = history_path(market, snap["date"], history_dir)
+    if os.path.exists(path):
+        return
+    entry = {
+        "date": snap["date"],
+        "fetched_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "codes": snap.get("codes", []),
+        "prices": snap.get("prices", []),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_snapshots(entry, path)
+
+# 取得 upper（YYYY-MM-DD HH:MM:SS）當下最新的快照，回傳 ({代號: 收盤價}, 交易日期)；沒有保存的快照時回傳 ({}, None)
+def get_prices_as_of(market, upper, history_dir=HISTORY_DIR):
+    market_dir = os.path.join(history_dir, market)
+    if not os.path.isdir(market_dir):
+        return {}, None
+    for name in sorted(os.listdir(market_dir), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        entry = load_snapshots(os.path.join(market_dir, name))
+        # 損毀或缺少取得時間的檔案無法判斷先後，略過
+        if not entry.get("fetched_at"):
+            continue
+        if entry["fetched_at"] <= upper:
+            return dict(zip(entry.get("codes", []), entry.get("prices", []))), entry.get("date")
+    return {}, None
+
+# 民國日期字串 (例如 1131018) 轉為 YYYY-MM-DD
+def roc_to_iso(roc_str):
+    roc_str = str(roc_str or "").strip().replace("/", "")
+    if len(roc_str) < 7 or not roc_str.isdigit():
+        return None
+    year = int(roc_str[:-4]) + 1911
+    return f"{year}-{roc_str[-4:-2]}-{roc_str[-2:]}"
+
+# 將交易所回傳的 JSON 陣列轉成 (交易日期, 代號陣列, 收盤價陣列)
+def parse_price_payload(raw, source):
+    items = fast_decode.loads(raw)
+    if not items:
+        return None, np.array([], dtype=str), np.array([], dtype=float)
+
+    columns = fast_decode.record_columns(
+        items, [source["date_field"], source["code_field"], source["price_field"]])
+    prices = fast_decode.to_numbers(columns[source["price_field"]])
+    codes = fast_decode.to_codes(columns[source["code_field"]])
+    valid = (codes != "") & ~np.isnan(prices)
+
+    dates = [d for d in columns[source["date_field"]] if d]
+    trade_date = roc_to_iso(dates[0]) if dates else None
+    return trade_date, codes[valid], prices[valid]
+
+# 取得單一市場最新收盤價，回傳 ({代號: 收盤價}, 是否有價格變動)
+def get_latest_prices(market, snapshots=None, json_path=SNAPSHOT_JSON):
+    source = MARKET_SOURCES[market]
+    own_snapshots = snapshots is None
+    if own_snapshots:
+        snapshots = load_snapshots(json_path)
+    snap = snapshots.get(market) or {}
+    cached = dict(zip(snap.get("codes", []), snap.get("prices", [])))
+
+    # 快照已是今日收盤資料，今天不會再有更新
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    if cached and snap.get("date") == today_str:
+        log.info("股價快照已是今日資料，略過下載", market=market, date=today_str)
+        return cached, False
+
+    headers = {}
+    if cached and snap.get("etag"):
+        headers["If-None-Match"] = snap["etag"]
+    if cached and snap.get("last_modified"):
+        headers["If-Modified-Since"] = snap["last_modified"]
+
+    try:
+        resp = requests.get(source["url"], headers=headers)
+        if resp.status_code == 304:
+            log.info("股價資料未更新，沿用快照", market=market, date=snap.get("date"))
+            return cached, False
+        resp.raise_for_status()
+        trade_date, codes, prices = parse_price_payload(resp.content, source)
+    except Exception as e:
+        log.warning("抓取最新股價失敗，沿用快照", market=market, error=e)
+        return cached, False
+
+    if cached and trade_date and trade_date == snap.get("date"):
+        log.info("交易日期未變，沿用快照", market=market, date=trade_date)
+        return cached, False
+
+    new_prices = dict(zip(codes.tolist(), prices.tolist()))
+    # 換了交易日但收盤價全部相同時，仍要保存新日期的快照
+    changed = new_prices != cached or trade_date != snap.get("date")
+    snapshots[market] = {
+        "date": trade_date,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "codes": codes.tolist(),
+        "prices": prices.tolist(),
+    }
+    if own_snapshots:
+        save_snapshots(snapshots, json_path)
+        archive_snapshot(market, snapshots[market])
+    return new_prices, changed
+
+# 一次取得上市與上櫃價格，並只寫一次快照檔
+def get_all_latest_prices(json_path=SNAPSHOT_JSON):
+    snapshots = load_snapshots(json_path)
+    twse_prices, twse_changed = get_latest_prices("twse", snapshots, json_path)
+    otc_prices, otc_changed = get_latest_prices("otc", snapshots, json_path)
+    if twse_changed or otc_changed:
+        save_snapshots(snapshots, json_path)
+    for market in MARKET_SOURCES:
+        archive_snapshot(market, snapshots.get(market))
+    return twse_prices, otc_prices, (twse_changed or otc_changed)
@@ -0,0 +1,202 @@
+"""
+功能：月營收歷史回補（例如建立十年的年增率趨勢）。
+
+- 依 --start / --end 月份範圍，下載上市、上櫃的 t21sc03_{民國年}_{月}.csv：
+  沿用 fetch_common.HostClient 的共用連線池，限制同時下載數（--concurrency）與請求間隔（--interval）。
+- 下載完成的 CSV 交給行程池（--processes）以 get_monthly_revenue.parse_csv / process_data 解析，
+  下載與解析同時進行。
+- 全部月份解析完成後，在同一個交易中寫入 monthly_revenue。
+- 解析成功的 CSV 保存在 --cache-dir，中斷後重新執行不必重新下載；
+  資料庫中已有資料的 (市場, 月份) 直接略過，--force 可全部重新寫入。
+
+使用方法：
+    python revenue_backfill.py --start 2015-01 --end 2024-12
+    python revenue_backfill.py --start 2015-01 --markets otc --concurrency 3 --processes 4
+
+本機測試：
+    python workqueue.py stub --port 8765 &
+    python revenue_backfill.py --start 2020-01 --interval 0 --base-url http://127.0.0.1:8765
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import fetch_common
+import get_monthly_revenue
+import runlog
+import universe
+
+DB_NAME = "stock_data.db"
+TABLE = "monthly_revenue"
+CACHE_DIR = "revenue_csv"
+COLUMNS = ["stock_no", "monthly_revenue", "yoy_growth", "revenue_month"]
+
+# 各市場的股票清單與公開資訊觀測站檔案路徑
+MARKETS = {
+    "twse": ("twse.cfg", "/t21/sii/"),
+    "otc": ("otc.cfg", "/t21/otc/"),
+}
+
+log = runlog.get_logger("revenue_backfill")
+
+def _parse_month(text):
+    year, month = text.split("-")
+    return int(year), int(month)
+
+# 起訖月份（含）之間每個月的第一天
+def month_range(start, end):
+    year, month = start
+    while (year, month) <= end:
+        yield datetime(year, month, 1)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+# 資料庫中各市場已有資料的月份 {市場: {YYYY-MM}}
+def existing_months(db_name, market_codes):
+    conn = sqlite3.connect(db_name)
+    rows = conn.execute(f"SELECT DISTINCT stock_no, revenue_month FROM {TABLE}").fetchall()
+    conn.close()
+    present = {market: set() for market in market_codes}
+    for stock_no, revenue_month in rows:
+        for market, codes in market_codes.items():
+            if stock_no in codes:
+                present[market].add(revenue_month)
+    return present
+
+# 在行程池中執行：解析 CSV 並只保留指定股票，回傳資料列（無法解析時為 None）
+def parse_records(csv_text, codes, report_month):
+    df = get_monthly_revenue.parse_csv(csv_text)
+    if df is None:
+        return None
+    df = get_monthly_revenue.process_data(df, codes, report_month)
+    if df is None:
+        return None
+    return list(df[COLUMNS].itertuples(index=False, name=None))
+
+def cache_path(cache_dir, market, file_name):
+    return os.path.join(cache_dir, market, file_name)
+
+# 以暫存檔再取代的方式保存，避免中斷時留下半個檔案
+def save_cache(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# 下載（或讀取快取）並解析所有月份，回傳 {(市場, 月份): 資料列}
+async def download_and_parse(jobs, cache_dir, concurrency, interval, processes, base_url=None):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pool = ProcessPoolExecutor(max_workers=processes)
+    client = fetch_common.HostClient("mops", loop, executor, limit=concurrency, interval=interval)
+    mops_url = fetch_common.with_base(get_monthly_revenue.MOPS_URL, base_url)
+    results = {}
+
+    async def one(market, codes, report_date):
+        file_name, data, report_month = get_monthly_revenue.build_request(MARKETS[market][1], report_date)
+        path = cache_path(cache_dir, market, file_name)
+        cached = os.path.exists(path)
+        if cached:
+            with open(path, "r", encoding="utf-8") as f:
+                csv_text = f.read()
+            runlog.incr("files_cached", market=market)
+        else:
+            try:
+                csv_text = await client.request("POST", mops_url, data=data, encoding="utf-8")
+            except Exception as e:
+                runlog.incr("files_failed", market=market)
+                log.warning("下載失敗", market=market, file=file_name, error=e)
+                return
+            runlog.incr("files_fetched", market=market)
+
+        records = await loop.run_in_executor(pool, parse_records, csv_text, codes, report_month)
+        if records is None:
+            runlog.incr("files_invalid", market=market)
+            log.warning("CSV 無法解析，略過", market=market, file=file_name)
+            return
+        if not cached:
+            save_cache(path, csv_text)
+        results[(market, report_month)] = records
+        log.info("已解析", market=market, month=report_month, rows=len(records))
+
+    try:
+        await asyncio.gather(*(one(*job) for job in jobs))
+    finally:
+        await client.close()
+        pool.shutdown()
+        executor.shutdown()
+    return results
+
+# 所有月份在同一個交易中寫入
+def load(db_name, results):
+    conn = sqlite3.connect(db_name, timeout=60)
+    rows = 0
+    with conn:
+        for key in sorted(results):
+            conn.executemany(fetch_common.INSERT_SQL[TABLE], results[key])
+            rows += len(results[key])
+    conn.close()
+    runlog.incr("rows_upserted", rows, table=TABLE)
+    return rows
+
+def main():
+    last_month = datetime.now().replace(day=1) - timedelta(days=1)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start", type=str, default=f"{last_month.year - 10}-{last_month.month:02d}",
+                        help="起始月份 YYYY-MM（預設為十年前）")
+    parser.add_argument("--end", type=str, default=last_month.strftime("%Y-%m"), help="結束月份 YYYY-MM（預設為上個月）")
+    parser.add_argument("--markets", type=str, default="twse,otc", help="市場（逗號分隔）：twse, otc")
+    parser.add_argument("--concurrency", type=int, default=3, help="同時下載數")
+    parser.add_argument("--interval", type=float, default=1.0, help="兩次請求的最小間隔秒數")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="解析 CSV 的行程數")
+    parser.add_argument("--cache-dir", type=str, default=CACHE_DIR, help="已下載 CSV 的保存目錄")
+    parser.add_argument("--force", action="store_true", help="資料庫已有的月份也重新寫入")
+    parser.add_argument("--base-url", type=str, help="以此取代公開資訊觀測站主機（例如 workqueue.py stub）")
+    args = parser.parse_args()
+
+    runlog.setup("revenue_backfill")
+    markets = [m.strip() for m in args.markets.split(",") if m.strip()]
+    unknown = [m for m in markets if m not in MARKETS]
+    if unknown:
+        parser.error(f"未知的市場: {', '.join(unknown)}")
+
+    get_monthly_revenue.init_db(DB_NAME, TABLE)
+    market_codes = {
+        market: frozenset(code for code, _ in universe.filter_listed(universe.read_cfg(MARKETS[market][0])))
+        for market in markets
+    }
+    present = {market: set() for market in markets}
+    if not args.force:
+        present = existing_months(DB_NAME, market_codes)
+
+    jobs = []
+    for market in markets:
+        if not market_codes[market]:
+            log.warning("股票清單為空，略過", market=market)
+            continue
+        months = list(month_range(_parse_month(args.start), _parse_month(args.end)))
+        todo = [d for d in months if f"{d.year}-{d.month:02d}" not in present[market]]
+        runlog.incr("months_skipped", len(months) - len(todo), market=market)
+        log.info("回補月份", market=market, total=len(months), todo=len(todo))
+        jobs.extend((market, market_codes[market], d) for d in todo)
+    if not jobs:
+        log.info("所有月份皆已有資料")
+        return
+
+    results = asyncio.run(download_and_parse(
+        jobs, args.cache_dir, args.concurrency, args.interval, args.processes, args.base_url))
+
+    rows = load(DB_NAME, results)
+    missing = len(jobs) - len(results)
+    log.info("回補完成", months=len(results), rows=rows, missing=missing)
+    if missing:
+        log.warning("部分月份未完成，重新執行即可續傳（已下載的 CSV 不會重抓）", missing=missing)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+功能：結構化執行紀錄與本次執行的計數器。
+
+- get_logger(name)：每筆紀錄一行，訊息後接 key=value 欄位（RUN_LOG_FORMAT=json 時改為一行一個 JSON），
+  層級由 RUN_LOG_LEVEL 設定（預設 INFO，DEBUG 才會輸出逐筆明細）。
+- 同一訊息在 RATE_WINDOW 秒內最多輸出 RATE_LIMIT 筆，其餘只計數，
+  下一筆輸出時附上 suppressed=略過筆數，執行結束時列出仍未輸出的略過筆數。
+- incr：本次執行的計數器，可附 market / table 等標籤，例如
+  stocks_fetched、stocks_skipped、stocks_failed、rows_upserted、http_retries、cache_hits。
+- 設定 RUN_METRICS_DIR 時，執行結束寫出 <目錄>/<run>.prom（Prometheus textfile collector 格式），
+  RUN_METRICS_FORMAT=json 時改寫 <run>.json。
+
+使用方法：
+    import runlog
+    log = runlog.get_logger("getTWSE")
+    runlog.setup("getTWSE")
+    log.info("已儲存年度資料", stock_no="2330", rows=3)
+    runlog.incr("rows_upserted", 3, table="YearlyData")
+
+    RUN_LOG_LEVEL=DEBUG RUN_METRICS_DIR=/var/lib/node_exporter python getTWSE.py
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+METRIC_PREFIX = "stock_data_"
+RATE_LIMIT = 20     # 每個視窗內同一訊息最多輸出筆數
+RATE_WINDOW = 60.0  # 秒
+
+_COUNTERS = {}
+_LOCK = threading.Lock()
+_RUN = {"name": None, "started": None}
+_HANDLER = {}
+_LOGGERS = {}
+
+# 同一 (logger, 層級, 訊息) 在視窗內超過上限的紀錄只計數不輸出
+class RateLimitFilter(logging.Filter):
+    def __init__(self, limit=RATE_LIMIT, window=RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.windows = {}
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with _LOCK:
+            win = self.windows.get(key)
+            if win is None or now - win[0] >= self.window:
+                suppressed = max(win[1] - self.limit, 0) if win else 0
+                self.windows[key] = [now, 1]
+                if suppressed:
+                    record.fields = dict(getattr(record, "fields", {}), suppressed=suppressed)
+                return True
+            win[1] += 1
+            if win[1] <= self.limit:
+                return True
+        incr("log_suppressed", logger=record.name)
+        return False
+
+    # 回傳 {(logger, 訊息): 尚未回報的略過筆數}
+    def pending(self):
+        with _LOCK:
+            return {(name, msg): count - self.limit
+                    for (name, _, msg), (_, count) in self.windows.items() if count > self.limit}
+
+def _format_value(value):
+    text = str(value)
+    if not text or any(c in text for c in ' ="'):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        line = f"{datetime.fromtimestamp(record.created):%Y-%m-%d %H:%M:%S} {record.levelname} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={_format_value(v)}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="seconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RunLogger:
+    """logging.Logger 的薄包裝：log.info(訊息, key=value, ...)。"""
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(os.getenv("RUN_LOG_LEVEL", "INFO").upper())
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, exc_info=False, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info)
+
+def get_logger(name):
+    _configure()
+    if name not in _LOGGERS:
+        _LOGGERS[name] = RunLogger(name)
+    return _LOGGERS[name]
+
+# 執行中調整層級，同時寫入環境變數讓子行程沿用
+def set_level(level):
+    level = level.upper()
+    os.environ["RUN_LOG_LEVEL"] = level
+    for run_logger in _LOGGERS.values():
+        run_logger.logger.setLevel(level)
+
+# 在 stdout 上設定唯一的 handler（重複呼叫不會重複輸出）
+def _configure():
+    if _HANDLER:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    if os.getenv("RUN_LOG_FORMAT", "text").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter())
+    limiter = RateLimitFilter()
+    handler.addFilter(limiter)
+    # 層級設定在各 RunLogger 上，第三方套件的紀錄維持 root 預設的 WARNING
+    logging.getLogger().addHandler(handler)
+    _HANDLER["handler"] = handler
+    _HANDLER["limiter"] = limiter
+
+# 開始一次執行：記錄名稱與開始時間，結束時輸出略過筆數與計數器檔案
+def setup(run_name):
+    _configure()
+    if _RUN["name"] is None:
+        atexit.register(finish)
+    _RUN["name"] = run_name
+    _RUN["started"] = time.time()
+
+def incr(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+# 依名稱加總（忽略標籤），供結尾摘要使用
+def total(name):
+    with _LOCK:
+        return sum(v for (n, _), v in _COUNTERS.items() if n == name)
+
+def counters():
+    with _LOCK:
+        return dict(_COUNTERS)
+
+def reset():
+    with _LOCK:
+        _COUNTERS.clear()
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def to_prometheus(run_name, counter_items, started, finished):
+    lines = []
+    by_name = {}
+    for (name, labels), value in sorted(counter_items.items()):
+        by_name.setdefault(name, []).append((labels, value))
+    for name, series in by_name.items():
+        metric = METRIC_PREFIX + name + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        for labels, value in series:
+            label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in (("run", run_name),) + labels)
+            lines.append(f"{metric}{{{label_text}}} {value}")
+    for name, value in (("run_start_timestamp_seconds", started), ("run_duration_seconds", finished - started),
+                        ("run_end_timestamp_seconds", finished)):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+        lines.append(f'{METRIC_PREFIX}{name}{{run="{_escape_label(run_name)}"}} {value:.3f}')
+    return "\n".join(lines) + "\n"
+
+def to_json(run_name, counter_items, started, finished):
+    return json.dumps({
+        "run": run_name,
+        "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+        "duration_seconds": round(finished - started, 3),
+        "counters": [{"name": name, "labels": dict(labels), "value": value}
+                     for (name, labels), value in sorted(counter_items.items())],
+    }, ensure_ascii=False, indent=2)
+
+# 寫出計數器檔案（先寫暫存檔再取代，textfile collector 不會讀到半個檔案）
+def export(directory, run_name=None, fmt=None):
+    run_name = run_name or _RUN["name"] or "run"
+    fmt = (fmt or os.getenv("RUN_METRICS_FORMAT", "prom")).lower()
+    started = _RUN["started"] or time.time()
+    finished = time.time()
+    items = counters()
+    if fmt == "json":
+        path, body = os.path.join(directory, f"{run_name}.json"), to_json(run_name, items, started, finished)
+    else:
+        path, body = os.path.join(directory, f"{run_name}.prom"), to_prometheus(run_name, items, started, finished)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    return path
+
+def finish():
+    log = get_logger("runlog")
+    limiter = _HANDLER.get("limiter")
+    if limiter is not None:
+        for (name, msg), count in sorted(limiter.pending().items()):
+            log.info("重複訊息已略過", logger=name, message=msg, suppressed=count)
+    directory = os.getenv("RUN_METRICS_DIR")
+    if directory and _RUN["name"]:
+        try:
+            log.info("已寫出計數器", path=export(directory))
+        except Exception as e:
+            log.error("寫出計數器失敗", error=e)
@@ -0,0 +1,244 @@
+"""
+功能：估值參數敏感度分析。
+
+一次讀入 stock_quarterly、monthly_revenue、YearlyPER，先算好可共用的中間結果
+（各股歷年 EPS、近四季利潤率、營收年增率視窗、各回溯年數的 PER 四分位數），
+再對參數網格的每一點以向量化方式重新分類整個股票池，並統計相對於預設參數
+（回溯 5 年、IQR 1.5 倍、近兩月年增率 > 5%、至少 4 年資料、min(六個月平均, 上月) 成長率）
+有多少股票在顏色間移動。網格點以多核心平行計算。
+
+使用方法：
+    python sensitivity.py --report-year 2024 --lookback 3,5,7 --iqr 1.0,1.5,2.0 \
+        --yoy 0,5,10 --min-years 3,4,5 --growth-rule min,avg,last
+"""
+
+import os
+import argparse
+import itertools
+import sqlite3
+from collections import Counter
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pandas as pd
+
+import price_snapshot
+import universe
+from eps_report import load_stock_codes_and_names, classify_color
+
+PER_COLS = ["lowest_per", "average_per", "highest_per"]
+GROWTH_RULES = ("min", "avg", "last")
+DEFAULT_PARAMS = {
+    "lookback_years": 5,
+    "iqr_factor": 1.5,
+    "yoy_threshold": 5.0,
+    "min_years": 4,
+    "growth_rule": "min",
+}
+CLASSES = ["red", "orange", "green", "none", "excluded"]
+
+# 子行程共用的中間結果（由 Pool initializer 設定）
+_SHARED = {}
+
+# 一次讀入估值需要的三張表
+def load_inputs(conn):
+    quarterly = pd.read_sql(
+        "SELECT stock_no, quarter, eps, net_income_after_tax, quarter_revenue, capital FROM stock_quarterly",
+        conn)
+    revenue = pd.read_sql("SELECT stock_no, revenue_month, yoy_growth FROM monthly_revenue", conn)
+    per = pd.read_sql("SELECT stock_no, year, highest_per, average_per, lowest_per FROM YearlyPER", conn)
+    for df in (quarterly, revenue, per):
+        df["stock_no"] = df["stock_no"].astype(str)
+    return quarterly, revenue, per
+
+# 與參數無關的每股中間結果，對齊 codes 順序
+def stock_components(codes, quarterly, revenue, report_year):
+    q = quarterly.sort_values(["stock_no", "quarter"], ascending=[True, False])
+    q_year = q["quarter"].astype(str).str[:4]
+    grouped = q.groupby("stock_no")
+
+    year_count = q.assign(y=q_year).groupby("stock_no")["y"].nunique()
+
+    in_window = q_year.astype(int).between(report_year - 4, report_year)
+    yearly_eps = (q[in_window].assign(y=q_year[in_window])
+                  .groupby(["stock_no", "y"])["eps"].sum(min_count=1))
+    profitable = (yearly_eps > 0).groupby(level=0).all()
+
+    last4 = grouped.head(4).groupby("stock_no")[["net_income_after_tax", "quarter_revenue"]].sum()
+    margin = (last4["net_income_after_tax"] / last4["quarter_revenue"]).where(last4["quarter_revenue"] != 0, 0)
+    last_year_revenue = q[q_year == str(report_year - 1)].groupby("stock_no")["quarter_revenue"].sum()
+    # 與 eps_report 相同取最新一季的股本，該季為 NULL 時視為無股本（不往前找非空值）
+    capital = grouped.head(1).set_index("stock_no")["capital"]
+
+    r = revenue.sort_values(["stock_no", "revenue_month"], ascending=[True, False]).copy()
+    r["rn"] = r.groupby("stock_no").cumcount()
+    avg6 = r[r["rn"] < 6].groupby("stock_no")["yoy_growth"].mean()
+    yoy_1m = r[r["rn"] == 0].set_index("stock_no")["yoy_growth"]
+    yoy_2m = r[r["rn"] == 1].set_index("stock_no")["yoy_growth"]
+
+    def align(series, fill=0.0):
+        return series.reindex(codes).fillna(fill).to_numpy(dtype=float)
+
+    return {
+        "year_count": align(year_count),
+        "profitable": profitable.reindex(codes).fillna(False).to_numpy(dtype=bool),
+        "margin": align(margin),
+        "last_year_revenue": align(last_year_revenue),
+        "capital": align(capital),
+        "avg6": align(avg6),
+        "yoy_1m": align(yoy_1m),
+        "yoy_2m": align(yoy_2m),
+    }
+
+# 同一個回溯年數只算一次分組四分位數，再套用各個 IQR 倍數得到平均 PER
+def per_multipliers(codes, per, report_year, lookback_years, iqr_factors):
+    start_year = report_year - lookback_years + 1
+    w = per[(per["year"] >= start_year) & (per["year"] <= report_year)].dropna(subset=PER_COLS)
+    g = w.groupby("stock_no")[PER_COLS]
+    q1 = g.quantile(0.25).reindex(w["stock_no"]).to_numpy()
+    q3 = g.quantile(0.75).reindex(w["stock_no"]).to_numpy()
+    iqr = q3 - q1
+    values = w[PER_COLS].to_numpy(dtype=float)
+
+    result = {}
+    for factor in iqr_factors:
+        outlier = ((values < q1 - factor * iqr) | (values > q3 + factor * iqr)).any(axis=1)
+        means = w[~outlier].groupby("stock_no")[PER_COLS].mean().reindex(codes)
+        result[factor] = means.to_numpy(dtype=float)
+    return result
+
+def growth_rate(comp, rule):
+    if rule == "avg":
+        return comp["avg6"]
+    if rule == "last":
+        return comp["yoy_1m"]
+    return np.minimum(comp["avg6"], comp["yoy_1m"])
+
+# 以共用中間結果計算單一參數組合的顏色
+def classify_point(shared, params):
+    comp = shared["components"]
+    capital = comp["capital"]
+    growth = growth_rate(comp, params["growth_rule"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        eps = np.where(capital > 0,
+                       comp["last_year_revenue"] * (1 + growth / 100) * comp["margin"] / (capital / 10),
+                       0.0)
+
+    per = shared["per"][(params["lookback_years"], params["iqr_factor"])]
+    cheap = np.round(eps * per[:, 0], 2)
+    expensive = np.round(eps * per[:, 2], 2)
+
+    eligible = ((comp["year_count"] >= params["min_years"])
+                & comp["profitable"]
+                & (eps > 0)
+                & ~np.isnan(per[:, 0])
+                & ~np.isnan(shared["price"]))
+
+    colors = classify_color(shared["price"], cheap, expensive,
+                            comp["yoy_1m"], comp["yoy_2m"], params["yoy_threshold"])
+    return np.where(eligible, colors, "excluded")
+
+def _init_worker(shared):
+    _SHARED.update(shared)
+
+def _evaluate(params):
+    colors = classify_point(_SHARED, params)
+    baseline = _SHARED["baseline"]
+    counts = Counter(colors.tolist())
+    moved = baseline != colors
+    transitions = Counter(zip(baseline[moved].tolist(), colors[moved].tolist()))
+    return params, counts, int(moved.sum()), transitions
+
+# 執行整個網格，回傳每個參數組合的各顏色數量與相對預設參數的移動
+def run_sweep(conn, all_stocks, prices, report_year, grid, workers=None):
+    codes = pd.Index(sorted(all_stocks.keys()))
+    quarterly, revenue, per = load_inputs(conn)
+
+    lookbacks = sorted(set(grid["lookback_years"]) | {DEFAULT_PARAMS["lookback_years"]})
+    factors = sorted(set(grid["iqr_factor"]) | {DEFAULT_PARAMS["iqr_factor"]})
+    per_cache = {}
+    for lookback in lookbacks:
+        for factor, arr in per_multipliers(codes, per, report_year, lookback, factors).items():
+            per_cache[(lookback, factor)] = arr
+
+    shared = {
+        "components": stock_components(codes, quarterly, revenue, report_year),
+        "per": per_cache,
+        "price": pd.Series(codes, index=codes).map(prices).to_numpy(dtype=float),
+    }
+    shared["baseline"] = classify_point(shared, DEFAULT_PARAMS)
+
+    keys = list(DEFAULT_PARAMS.keys())
+    points = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    workers = workers or cpu_count()
+    if workers <= 1:
+        _init_worker(shared)
+        return [_evaluate(p) for p in points]
+    with Pool(processes=workers, initializer=_init_worker, initargs=(shared,)) as pool:
+        return pool.map(_evaluate, points, chunksize=max(1, len(points) // (workers * 4)))
+
+def results_to_frame(results):
+    records = []
+    for params, counts, moved, transitions in results:
+        record = dict(params)
+        for c in CLASSES:
+            record[c] = counts.get(c, 0)
+        record["moved"] = moved
+        record["transitions"] = ", ".join(
+            f"{src}->{dst}:{n}" for (src, dst), n in sorted(transitions.items()))
+        records.append(record)
+    return pd.DataFrame.from_records(records)
+
+def _parse_list(text, cast):
+    return [cast(x.strip()) for x in text.split(",") if x.strip()]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--report-year", type=int)
+    parser.add_argument("--portfolio-cfg", type=str)
+    parser.add_argument("--lookback", type=str, default="3,5,7")
+    parser.add_argument("--iqr", type=str, default="1.0,1.5,2.0")
+    parser.add_argument("--yoy", type=str, default="0,5,10")
+    parser.add_argument("--min-years", type=str, default="3,4,5")
+    parser.add_argument("--growth-rule", type=str, default="min,avg,last")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--output", type=str, help="輸出 CSV 檔名")
+    args = parser.parse_args()
+
+    report_year = args.report_year if args.report_year else datetime.now().year
+    db_name = "stock_data.db"
+    if not os.path.exists(db_name):
+        return
+
+    if args.portfolio_cfg and os.path.exists(args.portfolio_cfg):
+        all_stocks = load_stock_codes_and_names(args.portfolio_cfg)
+    else:
+        all_stocks = {**load_stock_codes_and_names("twse.cfg"), **load_stock_codes_and_names("otc.cfg")}
+    all_stocks = universe.filter_listed(all_stocks)
+
+    grid = {
+        "lookback_years": _parse_list(args.lookback, int),
+        "iqr_factor": _parse_list(args.iqr, float),
+        "yoy_threshold": _parse_list(args.yoy, float),
+        "min_years": _parse_list(args.min_years, int),
+        "growth_rule": [r for r in _parse_list(args.growth_rule, str) if r in GROWTH_RULES],
+    }
+
+    twse_prices, otc_prices, _ = price_snapshot.get_all_latest_prices()
+    prices = {**otc_prices, **twse_prices}
+
+    conn = sqlite3.connect(db_name)
+    results = run_sweep(conn, all_stocks, prices, report_year, grid, args.workers)
+    conn.close()
+
+    df = results_to_frame(results).sort_values("moved", ascending=False)
+    if args.output:
+        df.to_csv(args.output, index=False, encoding="utf-8-sig")
+        print(f"已輸出 {len(df)} 個參數組合至 {args.output}")
+    else:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(df.drop(columns=["transitions"]).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
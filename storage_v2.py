@@ -0,0 +1,369 @@
+"""
+功能：stock_data.db 儲存格式 v2（PRAGMA user_version = 2）。
+
+- stock_ids：股票代號字典，各資料表改以整數 stock_id 儲存。
+- 日期以整數序號儲存：年度價格的最高/最低價日期（交易所回傳的月/日，年度在 year 欄）
+  與同一列的 year 組成日序號（與 Python date.toordinal() 相同），讀出時還原為上市的 M/DD、
+  上櫃的 MM/DD 寫法；營收月份為 年*12+月-1，季別為 年*4+季-1。
+- 價格以 0.01 元為單位的整數儲存；金額欄位使用 INTEGER 親和性（整數值以整數儲存）。
+- 資料表皆為 WITHOUT ROWID，以 (stock_id, 期間) 叢集，單一股票的區間查詢只讀相鄰的頁面。
+- 原資料表名稱改為同名 VIEW 並附 INSTEAD OF 觸發器，既有的查詢與
+  INSERT OR REPLACE / DELETE 不需修改；已啟用 point_in_time 的資料表會繼續寫入歷史表。
+
+使用方法：
+    python storage_v2.py migrate              # 先備份為 stock_data.db.v1.bak，轉換後 VACUUM
+    python storage_v2.py info                 # 顯示目前版本與各資料表筆數
+    python storage_v2.py downgrade            # 轉回原本的資料表格式
+"""
+
+import os
+import shutil
+import sqlite3
+import argparse
+import point_in_time
+
+DB_NAME = "stock_data.db"
+SCHEMA_VERSION = 2
+ORDINAL_OFFSET = 1721424.5  # julianday 與 date.toordinal() 的差
+PRICE_SCALE = 100
+
+# 月/日 'M/DD' 或 'MM/DD' 加上同一列的 year ({p}.year) 轉日序號；格式不符或日期無效時為 NULL，由 verify 擋下
+DAY_ENCODE = (
+    "CASE WHEN {v} IS NULL OR instr({v}, '/') = 0 THEN NULL ELSE CAST(julianday(printf('%04d-%02d-%02d', "
+    "{p}.year, CAST({v} AS INTEGER), CAST(substr({v}, instr({v}, '/') + 1) AS INTEGER)"
+    f")) - {ORDINAL_OFFSET} AS INTEGER) END"
+)
+# 上市 (FMNPTK) 為 'M/DD'，上櫃 (yearlyStock) 為 'MM/DD'
+MD_DECODE = (
+    "CASE WHEN d.{c} IS NULL THEN NULL ELSE printf('%d/%s', "
+    f"CAST(strftime('%m', d.{{c}} + {ORDINAL_OFFSET}) AS INTEGER), strftime('%d', d.{{c}} + {ORDINAL_OFFSET})) END"
+)
+MMDD_DECODE = f"CASE WHEN d.{{c}} IS NULL THEN NULL ELSE strftime('%m/%d', d.{{c}} + {ORDINAL_OFFSET}) END"
+
+# 欄位編碼：(v2 欄位型態, 寫入運算式 {v}（{p} 為同一列的來源前綴）, 讀出運算式 {c})
+CODECS = {
+    "stock": ("INTEGER", "(SELECT stock_id FROM stock_ids WHERE stock_no = {v})", "s.stock_no"),
+    "int": ("INTEGER", "{v}", "d.{c}"),
+    "real": ("REAL", "{v}", "d.{c}"),
+    "amount": ("INTEGER", "{v}", "d.{c}"),
+    "price": ("INTEGER", f"CAST(ROUND({{v}} * {PRICE_SCALE}) AS INTEGER)", f"d.{{c}} / {PRICE_SCALE}.0"),
+    "md_date": ("INTEGER", DAY_ENCODE, MD_DECODE),
+    "mmdd_date": ("INTEGER", DAY_ENCODE, MMDD_DECODE),
+    "month": ("INTEGER",
+              "CAST(substr({v}, 1, 4) AS INTEGER) * 12 + CAST(substr({v}, 6) AS INTEGER) - 1",
+              "printf('%04d-%02d', d.{c} / 12, d.{c} % 12 + 1)"),
+    "quarter": ("INTEGER",
+                "CAST(substr({v}, 1, 4) AS INTEGER) * 4 + CAST(substr({v}, 6) AS INTEGER) - 1",
+                "printf('%dQ%d', d.{c} / 4, d.{c} % 4 + 1)"),
+}
+
+def _yearly_price(date_kind):
+    return [
+        ("stock_no", "stock"), ("year", "int"),
+        ("highest_price", "price"), ("highest_date", date_kind),
+        ("lowest_price", "price"), ("lowest_date", date_kind),
+        ("average_close_price", "price"),
+    ]
+
+# 各資料表的欄位（依原資料表欄位順序）與編碼方式；主鍵沿用 point_in_time 的設定
+V2_TABLES = {
+    "YearlyData": _yearly_price("md_date"),
+    "OTCYearlyData": _yearly_price("mmdd_date"),
+    "monthly_revenue": [
+        ("stock_no", "stock"), ("monthly_revenue", "amount"),
+        ("yoy_growth", "real"), ("revenue_month", "month"),
+    ],
+    "stock_quarterly": [
+        ("stock_no", "stock"), ("quarter", "quarter"), ("eps", "real"),
+        ("net_income_after_tax", "amount"), ("quarter_revenue", "amount"), ("capital", "amount"),
+    ],
+    "YearlyPER": [
+        ("stock_no", "stock"), ("year", "int"),
+        ("highest_per", "real"), ("average_per", "real"), ("lowest_per", "real"),
+    ],
+}
+
+def storage_table(table):
+    return f"{table}_v2"
+
+def _v2_column(col, kind):
+    return "stock_id" if kind == "stock" else col
+
+def _encode(kind, prefix, col):
+    return CODECS[kind][1].format(v=f"{prefix}.{col}", p=prefix)
+
+def _decode(kind, col):
+    return CODECS[kind][2].format(c=col)
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def is_view(conn, name):
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row is not None and row[0] == "view"
+
+def create_storage(conn, table):
+    spec = V2_TABLES[table]
+    key_cols = point_in_time.VERSIONED_TABLES[table]
+    col_defs = ",\n            ".join(f"{_v2_column(c, k)} {CODECS[k][0]}" for c, k in spec)
+    pk = ", ".join(_v2_column(c, dict(spec)[c]) for c in key_cols)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {storage_table(table)} (
+            {col_defs},
+            PRIMARY KEY ({pk})
+        ) WITHOUT ROWID
+    """)
+
+def create_view(conn, table):
+    spec = V2_TABLES[table]
+    select = ", ".join(f"{_decode(k, _v2_column(c, k))} AS {c}" for c, k in spec)
+    conn.execute(f"""
+        CREATE VIEW {table} AS
+        SELECT {select}
+        FROM {storage_table(table)} d JOIN stock_ids s ON s.stock_id = d.stock_id
+    """)
+
+# 建立（或重建）VIEW 的 INSTEAD OF 觸發器；已有歷史表時一併寫入歷史。
+# 外層的 INSERT OR REPLACE 會覆蓋觸發器內的衝突處理，新增代號時以 NOT EXISTS 避免取代既有的 stock_id
+def install_triggers(conn, table):
+    spec = V2_TABLES[table]
+    kinds = dict(spec)
+    key_cols = point_in_time.VERSIONED_TABLES[table]
+    target = storage_table(table)
+    hist = point_in_time.history_table(table)
+    with_history = point_in_time.table_exists(conn, hist)
+    cols = [c for c, _ in spec]
+
+    v2_cols = ", ".join(_v2_column(c, k) for c, k in spec)
+    new_values = ", ".join(_encode(k, "NEW", c) for c, k in spec)
+    old_key = " AND ".join(f"{_v2_column(c, kinds[c])} = {_encode(kinds[c], 'OLD', c)}" for c in key_cols)
+
+    def history(prefix, deleted):
+        if not with_history:
+            return ""
+        values = ", ".join(f"{prefix}.{c}" for c in cols)
+        return (f"INSERT INTO {hist} ({', '.join(cols)}, ingested_at, is_deleted) "
+                f"VALUES ({values}, {point_in_time.NOW_EXPR}, {deleted});")
+
+    for action in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_{target}_{action}")
+    conn.execute(f"""
+        CREATE TRIGGER trg_{target}_insert INSTEAD OF INSERT ON {table}
+        BEGIN
+            INSERT INTO stock_ids (stock_no)
+            SELECT NEW.stock_no WHERE NOT EXISTS (SELECT 1 FROM stock_ids WHERE stock_no = NEW.stock_no);
+            INSERT OR REPLACE INTO {target} ({v2_cols}) VALUES ({new_values});
+            {history("NEW", 0)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER trg_{target}_update INSTEAD OF UPDATE ON {table}
+        BEGIN
+            INSERT INTO stock_ids (stock_no)
+            SELECT NEW.stock_no WHERE NOT EXISTS (SELECT 1 FROM stock_ids WHERE stock_no = NEW.stock_no);
+            DELETE FROM {target} WHERE {old_key};
+            INSERT OR REPLACE INTO {target} ({v2_cols}) VALUES ({new_values});
+            {history("NEW", 0)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER trg_{target}_delete INSTEAD OF DELETE ON {table}
+        BEGIN
+            DELETE FROM {target} WHERE {old_key};
+            {history("OLD", 1)}
+        END
+    """)
+
+# 比對轉換前後的欄位值：日期須還原為相同的字串，價格須在 0.01 元的精度內完全相同
+def _same(kind, old, new):
+    if old is None or new is None:
+        return old is None and new is None
+    if kind in ("md_date", "mmdd_date"):
+        return str(old) == str(new)
+    if kind in ("price", "amount", "real", "int"):
+        return abs(float(old) - float(new)) < 1e-9
+    return old == new
+
+# 以編碼後的主鍵對齊原資料表與 v2 的每一列，回傳不一致的列
+def verify(conn, source, table):
+    spec = V2_TABLES[table]
+    kinds = dict(spec)
+    key_cols = point_in_time.VERSIONED_TABLES[table]
+    value_cols = [(c, k) for c, k in spec if c not in key_cols]
+
+    old_keys = ", ".join(_encode(kinds[c], "src", c) for c in key_cols)
+    old_rows = conn.execute(
+        f"SELECT {old_keys}, {', '.join(f'src.{c}' for c, _ in value_cols)} FROM {source} src").fetchall()
+    new_keys = ", ".join(f"d.{_v2_column(c, kinds[c])}" for c in key_cols)
+    new_values = ", ".join(_decode(k, c) for c, k in value_cols)
+    new_rows = {
+        row[:len(key_cols)]: row[len(key_cols):]
+        for row in conn.execute(f"""
+            SELECT {new_keys}, {new_values}
+            FROM {storage_table(table)} d JOIN stock_ids s ON s.stock_id = d.stock_id
+        """)
+    }
+
+    mismatches = []
+    if len(old_rows) != len(new_rows):
+        mismatches.append((f"{len(old_rows)} 列", f"{len(new_rows)} 列"))
+    for row in old_rows:
+        key, values = row[:len(key_cols)], row[len(key_cols):]
+        new = new_rows.get(key)
+        if new is None or not all(_same(k, a, b) for (_, k), a, b in zip(value_cols, values, new)):
+            mismatches.append((row, new))
+    return mismatches
+
+def _file_size(path):
+    total = 0
+    for suffix in ("", "-wal"):
+        if os.path.exists(path + suffix):
+            total += os.path.getsize(path + suffix)
+    return total
+
+# 單一資料表：建立 v2 儲存表並複製、原表改名後以 VIEW 取代，驗證一致才刪除原表
+def migrate_table(conn, table):
+    spec = V2_TABLES[table]
+    columns = point_in_time.table_columns(conn, table)
+    if columns != [c for c, _ in spec]:
+        raise Exception(f"{table} 欄位與預期不同: {columns}")
+
+    legacy = f"{table}_v1"
+    conn.execute("INSERT OR REPLACE INTO storage_schema (tbl, create_sql) "
+                 "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    conn.execute(f"INSERT OR IGNORE INTO stock_ids (stock_no) SELECT DISTINCT stock_no FROM {table}")
+    create_storage(conn, table)
+    values = ", ".join(_encode(k, "src", c) for c, k in spec)
+    conn.execute(f"""
+        INSERT INTO {storage_table(table)} ({", ".join(_v2_column(c, k) for c, k in spec)})
+        SELECT {values} FROM {table} src
+    """)
+    conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    create_view(conn, table)
+
+    mismatches = verify(conn, legacy, table)
+    if mismatches:
+        for old, new in mismatches[:10]:
+            print(f"    {table}: 原 {old} / 新 {new}")
+        raise Exception(f"{table} 有 {len(mismatches)} 列轉換後不一致，已取消轉換")
+    # 原表上的歷史觸發器隨原表一併刪除，改由 VIEW 的觸發器寫入歷史
+    conn.execute(f"DROP TABLE {legacy}")
+    install_triggers(conn, table)
+    return conn.execute(f"SELECT COUNT(*) FROM {storage_table(table)}").fetchone()[0]
+
+def migrate(db_name=DB_NAME, backup=True):
+    if not os.path.exists(db_name):
+        print(f"找不到資料庫 {db_name}")
+        return False
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    if schema_version(conn) >= SCHEMA_VERSION:
+        print(f"{db_name} 已是 v{schema_version(conn)}，不需轉換")
+        conn.close()
+        return True
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    before = _file_size(db_name)
+    if backup:
+        shutil.copy2(db_name, db_name + ".v1.bak")
+        print(f"已備份至 {db_name}.v1.bak")
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS stock_ids (
+                stock_id INTEGER PRIMARY KEY,
+                stock_no TEXT NOT NULL UNIQUE
+            )
+        ''')
+        # 保留原資料表定義與版本，供 downgrade 使用
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS storage_schema (
+                tbl TEXT PRIMARY KEY,
+                create_sql TEXT
+            )
+        ''')
+        conn.execute("INSERT OR REPLACE INTO storage_schema (tbl, create_sql) VALUES ('user_version', ?)",
+                     (str(schema_version(conn)),))
+        for table in V2_TABLES:
+            if not point_in_time.table_exists(conn, table) or is_view(conn, table):
+                continue
+            rows = migrate_table(conn, table)
+            print(f"{table}: 已轉換 {rows} 列")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        conn.close()
+        print(f"轉換失敗: {e}")
+        return False
+
+    conn.execute("VACUUM")
+    conn.close()
+    after = _file_size(db_name)
+    print(f"檔案大小: {before / 1048576:.1f} MB -> {after / 1048576:.1f} MB")
+    return True
+
+# 轉回原本的資料表格式（依轉換時保留的原資料表定義重建）
+def downgrade(db_name=DB_NAME):
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    if schema_version(conn) < SCHEMA_VERSION:
+        print(f"{db_name} 不是 v{SCHEMA_VERSION}，不需轉回")
+        conn.close()
+        return True
+    schemas = dict(conn.execute("SELECT tbl, create_sql FROM storage_schema"))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in V2_TABLES:
+            if not is_view(conn, table):
+                continue
+            cols = ", ".join(c for c, _ in V2_TABLES[table])
+            conn.execute(f"CREATE TEMP TABLE v1_rows AS SELECT {cols} FROM {table}")
+            conn.execute(f"DROP VIEW {table}")
+            conn.execute(schemas[table])
+            conn.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM temp.v1_rows")
+            conn.execute("DROP TABLE temp.v1_rows")
+            conn.execute(f"DROP TABLE {storage_table(table)}")
+            if point_in_time.table_exists(conn, point_in_time.history_table(table)):
+                point_in_time.install_table(conn, table, point_in_time.VERSIONED_TABLES[table], None)
+            print(f"{table}: 已轉回原格式")
+        conn.execute("DROP TABLE stock_ids")
+        conn.execute(f"PRAGMA user_version = {int(schemas.get('user_version') or 0)}")
+        conn.execute("DROP TABLE storage_schema")
+        conn.execute("COMMIT")
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        conn.close()
+        print(f"轉回失敗: {e}")
+        return False
+    conn.execute("VACUUM")
+    conn.close()
+    return True
+
+def info(db_name=DB_NAME):
+    conn = sqlite3.connect(db_name)
+    print(f"{db_name}: 版本 v{schema_version(conn)}，大小 {_file_size(db_name) / 1048576:.1f} MB")
+    for table in V2_TABLES:
+        if not point_in_time.table_exists(conn, table):
+            continue
+        kind = "VIEW（v2）" if is_view(conn, table) else "資料表"
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        print(f"    {table}: {kind}，{count} 列")
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["migrate", "downgrade", "info"])
+    parser.add_argument("--db", type=str, default=DB_NAME)
+    parser.add_argument("--no-backup", action="store_true", help="轉換前不備份資料庫")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        ok = migrate(args.db, backup=not args.no_backup)
+    elif args.command == "downgrade":
+        ok = downgrade(args.db)
+    else:
+        info(args.db)
+        ok = True
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
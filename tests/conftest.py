@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 各工具都是專案根目錄下的獨立腳本，測試時直接匯入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
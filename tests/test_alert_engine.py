@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+import alert_engine
+
+def _alert(code, from_color, to_color, price=100.0):
+    return {"code": code, "name": code, "from": from_color, "to": to_color,
+            "price": price, "cheap": 90.0, "expensive": 120.0}
+
+@pytest.fixture
+def sent():
+    return []
+
+@pytest.fixture
+def alerts(sent):
+    queue = alert_engine.AlertQueue(sent.append, debounce=60, min_interval=30)
+    yield queue
+    queue.close()
+
+def test_alert_waits_for_debounce(alerts, sent):
+    alerts.push(1000, _alert("2330", "none", "green"))
+
+    assert alerts.flush(1059) == 0
+    assert alerts.flush(1060) == 1
+    alerts.close()
+    assert len(sent) == 1 and "`2330`" in sent[0]
+
+def test_reverting_before_debounce_cancels(alerts, sent):
+    alerts.push(1000, _alert("2330", "none", "green"))
+    alerts.push(1030, _alert("2330", "green", "none"))
+
+    assert alerts.flush(2000) == 0
+    alerts.close()
+    assert sent == []
+
+def test_new_color_restarts_debounce(alerts):
+    alerts.push(1000, _alert("2330", "none", "green"))
+    alerts.push(1050, _alert("2330", "green", "red", price=80.0))
+
+    assert alerts.flush(1100) == 0
+    assert alerts.flush(1110) == 1
+
+def test_messages_are_batched_and_rate_limited(alerts, sent):
+    alerts.push(1000, _alert("2330", "none", "green"))
+    alerts.push(1000, _alert("2317", "none", "red"))
+    assert alerts.flush(1060) == 2
+
+    alerts.push(1000, _alert("6488", "none", "orange"))
+    assert alerts.flush(1070) == 0
+    assert alerts.flush(1090) == 1
+    alerts.close()
+    assert len(sent) == 2
+
+def test_close_skips_rate_limit_but_keeps_debounce(alerts, sent):
+    now = time.time()
+    alerts.last_sent = now
+    alerts.push(now - 61, _alert("2330", "none", "green"))
+    alerts.push(now - 40, _alert("2317", "none", "red"))
+
+    alerts.close()
+
+    assert len(sent) == 1
+    assert "`2330`" in sent[0] and "`2317`" not in sent[0]
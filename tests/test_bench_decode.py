@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import bench_decode
+
+def _fixture(name):
+    with open(bench_decode.fixture_path(name), "rb") as f:
+        return f.read()
+
+@pytest.mark.parametrize("name", sorted(bench_decode.ENDPOINTS))
+def test_fixture_is_committed(name):
+    raw = _fixture(name)
+    assert bench_decode.ENDPOINTS[name]["count"](raw) > 0
+
+@pytest.mark.parametrize("market", ["twse", "otc"])
+def test_fast_prices_match_legacy(market):
+    source = bench_decode.price_snapshot.MARKET_SOURCES[market]
+    raw = _fixture(f"{market}_prices")
+
+    codes, prices = bench_decode.fast_prices(raw, source)
+
+    assert dict(zip(codes.tolist(), prices.tolist())) == bench_decode.legacy_prices(raw, source)
+
+@pytest.mark.parametrize("market, module", [("twse", bench_decode.getTWSE), ("otc", bench_decode.getOTC)])
+def test_fast_yearly_matches_legacy(market, module):
+    raw = _fixture(f"{market}_yearly")
+
+    columns = bench_decode.fast_yearly(raw, module)
+    legacy = bench_decode.legacy_yearly(raw, module.YEARLY_LAYOUT)
+
+    assert sorted(legacy) == sorted(columns["year"].tolist())
+    for name in module.PRICE_FIELDS:
+        by_year = dict(zip(columns["year"].tolist(), columns[name].tolist()))
+        assert np.allclose([by_year[y] for y in legacy], [legacy[y][module.PRICE_FIELDS.index(name)] for y in legacy])
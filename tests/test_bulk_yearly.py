@@ -0,0 +1,64 @@
+import json
+from datetime import date
+
+import pytest
+
+import bulk_yearly
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode("utf-8")
+
+class FakeSession:
+    def __init__(self, payload):
+        self.payload = payload
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        return FakeResponse(self.payload)
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_yearly, "CACHE_DIR", str(tmp_path / "bulk_cache"))
+
+def test_fetch_trading_days_parses_roc_dates():
+    session = FakeSession({"stat": "OK", "fields": ["日期", "成交股數"],
+                           "data": [["113/01/02", "1"], ["113/01/03", "2"]]})
+
+    days = bulk_yearly.fetch_trading_days(2024, 1, session)
+
+    assert days == [date(2024, 1, 2), date(2024, 1, 3)]
+    assert "FMTQIK?date=20240101" in session.urls[0]
+
+def test_calendar_queries_each_month_once_and_caches(monkeypatch):
+    calls = []
+
+    def fake_fetch(year, month, session):
+        calls.append(month)
+        return [date(year, month, 2)]
+
+    monkeypatch.setattr(bulk_yearly, "fetch_trading_days", fake_fetch)
+
+    days = bulk_yearly.TradingCalendar(0).days(2020)
+    bulk_yearly.TradingCalendar(0).days(2020)
+
+    assert calls == list(range(1, 13))
+    assert days == [date(2020, m, 2) for m in range(1, 13)]
+
+def test_year_frame_only_downloads_trading_days(monkeypatch):
+    fetched = []
+
+    def fake_quotes(market, day, session):
+        fetched.append(day)
+        return {"code": ["2330"], "high": ["10"], "low": ["8"], "close": ["9"]}
+
+    monkeypatch.setattr(bulk_yearly, "fetch_daily_quotes", fake_quotes)
+    days = [date(2020, 1, 2), date(2020, 1, 3)]
+
+    df = bulk_yearly.build_year_frame("twse", days, None, 0)
+
+    assert fetched == days
+    assert list(df["stock_no"]) == ["2330", "2330"]
@@ -0,0 +1,30 @@
+import sqlite3
+
+import pandas as pd
+
+import data_access
+
+def test_frames_lookups_are_not_counted_as_hits():
+    frames = {kind: {} for kind in data_access.SLICE_LAYOUT}
+    frames["quarterly"]["2330"] = pd.DataFrame({"quarter": ["2024Q1"]})
+    cache = data_access.StockDataCache(frames=frames)
+
+    cache.quarterly("2330")
+    missing = cache.quarterly("9999")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["frame_lookups"]) == (0, 1, 2)
+    assert missing.empty
+    assert list(missing.columns) == list(data_access.SLICE_LAYOUT["quarterly"][1])
+
+def test_sql_slices_count_hits_and_misses():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE monthly_revenue (stock_no TEXT, monthly_revenue REAL, yoy_growth REAL, revenue_month TEXT)")
+    cache = data_access.StockDataCache(conn)
+
+    cache.revenue("2330")
+    cache.revenue("2330")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["frame_lookups"]) == (1, 1, 0)
+    conn.close()
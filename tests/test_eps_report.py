@@ -0,0 +1,24 @@
+import pandas as pd
+
+import eps_report
+
+class FakeData:
+    def __init__(self, quarterly):
+        self._quarterly = pd.DataFrame(quarterly, columns=["quarter", "eps"])
+
+    def quarterly(self, stock_no):
+        return self._quarterly
+
+def test_profitable_ignores_rows_without_quarter():
+    rows = [(f"{year}Q{q}", 1.0) for year in range(2020, 2025) for q in range(1, 5)]
+    data = FakeData(rows + [(None, -5.0)])
+
+    assert eps_report.is_profitable_in_5_years(data, "2330", 2024)
+
+def test_not_profitable_when_a_year_loses_money():
+    rows = [(f"{year}Q{q}", -1.0 if year == 2022 else 1.0) for year in range(2020, 2025) for q in range(1, 5)]
+
+    assert not eps_report.is_profitable_in_5_years(FakeData(rows), "2330", 2024)
+
+def test_no_quarters_in_window_is_not_profitable():
+    assert not eps_report.is_profitable_in_5_years(FakeData([(None, 1.0)]), "2330", 2024)
@@ -0,0 +1,69 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import nightly
+
+DOWNSTREAM = {"quarterly", "validate", "eps_report", "earnings_call"}
+
+@pytest.fixture
+def db_dir(tmp_path, monkeypatch):
+    # getTWSE / getOTC 的 init_db 在工作目錄建立 stock_data.db
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def _record(stock_no):
+    return [stock_no, 2024, 100.0, "7/05", 80.0, "1/03", 90.0]
+
+# 以假的抓取階段取代網路請求：每個階段送出 count 筆資料到指定資料表
+def _fake_stages(monkeypatch, table_for, count):
+    async def yearly_stage(stage, client, queue, db_name):
+        for i in range(count):
+            await queue.put(("rows", stage, (table_for[stage], [_record(f"{i:04d}")])))
+        return True
+
+    async def revenue_stage(client, queue, loop, executor, db_name):
+        for i in range(count):
+            await queue.put(("rows", "monthly_revenue", (table_for["monthly_revenue"], [[f"{i:04d}", 1.0, 5.0, "2024-01"]])))
+        return True
+
+    monkeypatch.setattr(nightly, "yearly_stage", yearly_stage)
+    monkeypatch.setattr(nightly, "revenue_stage", revenue_stage)
+
+def test_writer_commits_all_producers(db_dir, monkeypatch):
+    tables = {"yearly_twse": "YearlyData", "yearly_otc": "OTCYearlyData", "monthly_revenue": "monthly_revenue"}
+    _fake_stages(monkeypatch, tables, 20)
+
+    ok = asyncio.run(asyncio.wait_for(nightly.nightly(DOWNSTREAM, queue_size=2), timeout=30))
+
+    assert ok
+    conn = sqlite3.connect("stock_data.db")
+    for table in tables.values():
+        assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 20
+    conn.close()
+
+def test_writer_failure_cancels_blocked_producers(db_dir, monkeypatch):
+    # 寫入失敗後佇列不再被取出，抓取端若未取消會永遠卡在 queue.put
+    tables = {"yearly_twse": "NoSuchTable", "yearly_otc": "OTCYearlyData", "monthly_revenue": "monthly_revenue"}
+    _fake_stages(monkeypatch, tables, 200)
+
+    ok = asyncio.run(asyncio.wait_for(nightly.nightly(DOWNSTREAM, queue_size=2), timeout=30))
+
+    assert not ok
+
+def test_writer_sets_events_even_when_failing(db_dir):
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        events = {"yearly_twse": asyncio.Event(), "monthly_revenue": asyncio.Event()}
+        writer = nightly.DbWriter(loop, "stock_data.db")
+        await queue.put(("rows", "yearly_twse", ("NoSuchTable", [_record("2330")])))
+        with pytest.raises(KeyError):
+            await writer.run(queue, events)
+        return writer, events
+
+    writer, events = asyncio.run(scenario())
+
+    assert isinstance(writer.error, KeyError)
+    assert all(event.is_set() for event in events.values())
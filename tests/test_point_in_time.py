@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+import point_in_time
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE monthly_revenue (stock_no TEXT, monthly_revenue REAL, yoy_growth REAL, "
+                 "revenue_month TEXT, PRIMARY KEY (stock_no, revenue_month))")
+    point_in_time.install(conn)
+    yield conn
+    conn.close()
+
+def _add_version(conn, revenue, ingested_at, is_deleted=0):
+    conn.execute("INSERT INTO monthly_revenue_history VALUES ('2330', ?, 5.0, '2024-01', ?, ?)",
+                 (revenue, ingested_at, is_deleted))
+
+def _as_of(conn, as_of):
+    point_in_time.attach_as_of(conn, as_of)
+    return conn.execute("SELECT stock_no, monthly_revenue FROM monthly_revenue").fetchall()
+
+def test_as_of_returns_latest_version_before_upper(conn):
+    _add_version(conn, 100.0, "2024-02-10 08:00:00.000")
+    _add_version(conn, 120.0, "2024-03-10 08:00:00.000")
+
+    assert _as_of(conn, "2024-02-28") == [("2330", 100.0)]
+    assert _as_of(conn, "2024-03-10") == [("2330", 120.0)]
+
+def test_versions_with_same_timestamp_yield_one_row(conn):
+    _add_version(conn, 100.0, "2024-02-10 08:00:00.000")
+    _add_version(conn, 110.0, "2024-02-10 08:00:00.000")
+
+    assert _as_of(conn, "2024-02-28") == [("2330", 110.0)]
+
+def test_deleted_key_is_hidden(conn):
+    _add_version(conn, 100.0, "2024-02-10 08:00:00.000")
+    _add_version(conn, 100.0, "2024-03-01 08:00:00.000", is_deleted=1)
+
+    assert _as_of(conn, "2024-02-28") == [("2330", 100.0)]
+    assert _as_of(conn, "2024-03-02") == []
@@ -0,0 +1,40 @@
+import json
+
+import price_snapshot
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, items):
+        self.content = json.dumps(items).encode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+def _write_history(history_dir, trade_date, entry):
+    path = history_dir / "twse" / f"{trade_date}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(entry), encoding="utf-8")
+
+def test_new_trade_date_with_same_prices_is_saved(tmp_path, monkeypatch):
+    json_path = str(tmp_path / "price_snapshot.json")
+    price_snapshot.save_snapshots({"twse": {"date": "2024-10-17", "codes": ["2330"], "prices": [1000.0]}}, json_path)
+    items = [{"Date": "1131018", "Code": "2330", "ClosingPrice": "1000.00"}]
+    monkeypatch.setattr(price_snapshot.requests, "get", lambda url, headers=None: FakeResponse(items))
+    monkeypatch.setattr(price_snapshot, "archive_snapshot", lambda market, snap: None)
+
+    prices, changed = price_snapshot.get_latest_prices("twse", json_path=json_path)
+
+    assert prices == {"2330": 1000.0}
+    assert changed
+    assert price_snapshot.load_snapshots(json_path)["twse"]["date"] == "2024-10-18"
+
+def test_prices_as_of_skips_entries_without_fetched_at(tmp_path):
+    _write_history(tmp_path, "2024-10-17", {"date": "2024-10-17", "fetched_at": "2024-10-17 14:00:00",
+                                            "codes": ["2330"], "prices": [990.0]})
+    _write_history(tmp_path, "2024-10-18", {})
+
+    prices, trade_date = price_snapshot.get_prices_as_of("twse", "2024-10-19 23:59:59.999", str(tmp_path))
+
+    assert (prices, trade_date) == ({"2330": 990.0}, "2024-10-17")
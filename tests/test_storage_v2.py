@@ -0,0 +1,83 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+import getOTC
+import getTWSE
+import point_in_time
+import storage_v2
+
+# 與交易所回傳相同的寫法：上市 M/DD、上櫃 MM/DD，年度在 year 欄
+TWSE_ROWS = [
+    ("2330", 2023, 593.0, "7/14", 449.5, "1/03", 520.12),
+    ("2330", 2024, 1100.0, "12/05", 580.0, "1/02", 865.4),
+    ("2317", 2024, 234.5, "6/11", 100.5, "2/29", 160.0),
+    ("2317", 2023, 110.0, "9/01", None, None, 101.5),
+]
+OTC_ROWS = [
+    ("6488", 2024, 520.0, "03/08", 330.5, "08/05", 420.75),
+    ("6488", 2023, 580.0, "12/29", 400.0, "10/26", 480.0),
+]
+
+@pytest.fixture
+def db_name(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    getTWSE.init_db()
+    getOTC.init_db()
+    conn = sqlite3.connect("stock_data.db")
+    conn.executemany("INSERT INTO YearlyData VALUES (?, ?, ?, ?, ?, ?, ?)", TWSE_ROWS)
+    conn.executemany("INSERT INTO OTCYearlyData VALUES (?, ?, ?, ?, ?, ?, ?)", OTC_ROWS)
+    conn.commit()
+    conn.close()
+    return "stock_data.db"
+
+def _rows(db_name, table):
+    conn = sqlite3.connect(db_name)
+    rows = sorted(conn.execute(f"SELECT * FROM {table}").fetchall())
+    conn.close()
+    return rows
+
+def test_dates_round_trip(db_name):
+    assert storage_v2.migrate(db_name, backup=False)
+
+    assert _rows(db_name, "YearlyData") == sorted(TWSE_ROWS)
+    assert _rows(db_name, "OTCYearlyData") == sorted(OTC_ROWS)
+
+    assert storage_v2.downgrade(db_name)
+    assert _rows(db_name, "YearlyData") == sorted(TWSE_ROWS)
+    assert _rows(db_name, "OTCYearlyData") == sorted(OTC_ROWS)
+
+def test_dates_are_stored_as_day_ordinals(db_name):
+    storage_v2.migrate(db_name, backup=False)
+    conn = sqlite3.connect(db_name)
+    stored = conn.execute("""
+        SELECT d.highest_date FROM YearlyData_v2 d JOIN stock_ids s ON s.stock_id = d.stock_id
+        WHERE s.stock_no = '2330' AND d.year = 2024
+    """).fetchone()[0]
+    conn.close()
+
+    assert stored == date(2024, 12, 5).toordinal()
+
+def test_writes_through_view_keep_format(db_name):
+    storage_v2.migrate(db_name, backup=False)
+    conn = sqlite3.connect(db_name)
+    conn.execute("INSERT OR REPLACE INTO YearlyData VALUES ('2330', 2024, 1111.0, '7/11', 580.0, '1/02', 870.0)")
+    conn.execute("INSERT OR REPLACE INTO OTCYearlyData VALUES ('6488', 2022, 700.0, '01/04', 300.0, '10/25', 450.0)")
+    conn.commit()
+
+    assert conn.execute("SELECT highest_date FROM YearlyData WHERE stock_no = '2330' AND year = 2024").fetchone() == ("7/11",)
+    assert conn.execute("SELECT highest_date FROM OTCYearlyData WHERE year = 2022").fetchone() == ("01/04",)
+    conn.close()
+
+def test_unexpected_date_format_aborts_migration(db_name):
+    conn = sqlite3.connect(db_name)
+    conn.execute("UPDATE YearlyData SET lowest_date = '113/01/03' WHERE stock_no = '2330' AND year = 2023")
+    conn.commit()
+    conn.close()
+
+    assert not storage_v2.migrate(db_name, backup=False)
+    conn = sqlite3.connect(db_name)
+    assert storage_v2.schema_version(conn) == 0
+    assert point_in_time.table_exists(conn, "YearlyData") and not storage_v2.is_view(conn, "YearlyData")
+    conn.close()
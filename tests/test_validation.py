@@ -0,0 +1,101 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import get_monthly_revenue
+import get_quarterly
+import validation
+
+@pytest.fixture
+def conn(tmp_path):
+    db_name = str(tmp_path / "stock_data.db")
+    get_monthly_revenue.init_db(db_name, "monthly_revenue")
+    conn = sqlite3.connect(db_name)
+    get_quarterly.init_db(conn)
+    yield conn
+    conn.close()
+
+def _insert_revenue(conn, stock_no, yoys, revenue=100.0):
+    conn.executemany(
+        "INSERT INTO monthly_revenue (stock_no, monthly_revenue, yoy_growth, revenue_month) VALUES (?, ?, ?, ?)",
+        [(stock_no, revenue, yoy, f"2024-{i + 1:02d}") for i, yoy in enumerate(yoys)])
+    conn.commit()
+
+def _insert_quarterly(conn, stock_no, eps_values, capital=1000.0):
+    conn.executemany(
+        "INSERT INTO stock_quarterly (stock_no, quarter, eps, net_income_after_tax, quarter_revenue, capital) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(stock_no, f"{2020 + i // 4}Q{i % 4 + 1}", eps, 10.0, 100.0, capital) for i, eps in enumerate(eps_values)])
+    conn.commit()
+
+def _quarantined(conn, table):
+    return set(conn.execute("SELECT stock_no, period, rule FROM quarantine WHERE tbl = ?", (table,)))
+
+def test_hard_rule_rows_are_deleted(conn):
+    _insert_revenue(conn, "2330", [5, 6, 7])
+    conn.execute("UPDATE monthly_revenue SET monthly_revenue = -1 WHERE revenue_month = '2024-02'")
+    conn.commit()
+
+    validation.run(conn)
+
+    assert _quarantined(conn, "monthly_revenue") == {("2330", "2024-02", "negative_revenue")}
+    months = [r[0] for r in conn.execute("SELECT revenue_month FROM monthly_revenue ORDER BY revenue_month")]
+    assert months == ["2024-01", "2024-03"]
+
+def test_statistical_outlier_is_recorded_but_kept(conn):
+    _insert_revenue(conn, "2330", [5, 6, 5, 7, 6, 5, 6, 900])
+
+    validation.run(conn)
+
+    assert ("2330", "2024-08", "yoy_outlier") in _quarantined(conn, "monthly_revenue")
+    assert conn.execute("SELECT COUNT(*) FROM monthly_revenue").fetchone()[0] == 8
+
+def test_outliers_are_scored_within_each_stock(conn):
+    # 大型股的 EPS 一直遠高於其他股票，只要在自己的歷史中穩定就不是離群值
+    _insert_quarterly(conn, "2330", [30, 31, 32, 30, 33, 31, 32, 30])
+    for stock_no in ("1101", "1102", "1103"):
+        _insert_quarterly(conn, stock_no, [1.0, 1.1, 0.9, 1.0, 1.2, 1.0, 0.9, 1.1])
+
+    flagged = validation.check_table(conn, "stock_quarterly")
+
+    assert "eps_outlier" not in set(flagged["rule"])
+
+def test_stocks_with_short_history_are_not_scored(conn):
+    _insert_revenue(conn, "6488", [5, 6, 900])
+
+    flagged = validation.check_table(conn, "monthly_revenue")
+
+    assert "yoy_outlier" not in set(flagged["rule"])
+
+def test_rerun_does_not_rewrite_unchanged_records(conn):
+    _insert_revenue(conn, "2330", [5, 6, 5, 7, 6, 5, 6, 900])
+    validation.run(conn)
+    before = conn.total_changes
+
+    validation.run(conn)
+
+    assert conn.total_changes == before
+
+def test_missing_values_are_recorded_but_kept(conn):
+    _insert_quarterly(conn, "2330", [1.0, 1.1], capital=None)
+    _insert_quarterly(conn, "2317", [1.0], capital=0.0)
+
+    validation.run(conn)
+
+    rules = {(stock_no, rule) for stock_no, _, rule in _quarantined(conn, "stock_quarterly")}
+    assert rules == {("2330", "missing_capital"), ("2317", "non_positive_capital")}
+    kept = conn.execute("SELECT stock_no, COUNT(*) FROM stock_quarterly GROUP BY stock_no").fetchall()
+    assert kept == [("2330", 2)]
+
+def test_stock_robust_z_matches_per_stock_median_and_mad():
+    df = pd.DataFrame({"stock_no": ["A"] * 6 + ["B"] * 3})
+    values = [1.0, 2.0, 3.0, 4.0, 100.0, np.nan, 5.0, 6.0, 900.0]
+
+    z = validation.stock_robust_z(df, values)
+
+    # A：中位數 3、MAD 1；B 期數不足不判斷
+    assert z[:5] == pytest.approx([-1.349, -0.6745, 0.0, 0.6745, 65.4265])
+    assert np.isnan(z[5])
+    assert list(z[6:]) == [0.0, 0.0, 0.0]
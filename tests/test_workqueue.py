@@ -0,0 +1,106 @@
+import json
+import threading
+
+import pytest
+
+import workqueue
+
+def _tasks(*codes):
+    return [("yearly_twse", code, {"stock_no": code, "first_year": 2020}) for code in codes]
+
+@pytest.fixture
+def queue_db(tmp_path):
+    return str(tmp_path / "work_queue.db")
+
+@pytest.fixture
+def conn(queue_db):
+    conn = workqueue.connect_queue(queue_db)
+    yield conn
+    conn.close()
+
+def _status(conn):
+    return dict(conn.execute("SELECT task_key, status FROM work_queue"))
+
+def test_enqueue_ignores_duplicates(conn):
+    assert workqueue.enqueue(conn, _tasks("2330", "2317")) == 2
+    assert workqueue.enqueue(conn, _tasks("2330", "6488")) == 1
+
+def test_claimed_task_is_not_handed_out_twice(conn):
+    workqueue.enqueue(conn, _tasks("2330"))
+
+    first = workqueue.claim(conn, "w1")
+    second = workqueue.claim(conn, "w2")
+
+    assert [payload["stock_no"] for _, _, payload in first] == ["2330"]
+    assert second == []
+    assert workqueue.outstanding(conn) == (0, 1)
+
+def test_ack_marks_done_for_lease_owner_only(conn):
+    workqueue.enqueue(conn, _tasks("2330"))
+    task_id, _, _ = workqueue.claim(conn, "w1")[0]
+
+    assert not workqueue.ack(conn, task_id, "w2", [])
+    assert workqueue.ack(conn, task_id, "w1", [["2330", 2024]])
+    assert _status(conn) == {"2330": "done"}
+
+def test_expired_lease_is_reclaimed(conn):
+    workqueue.enqueue(conn, _tasks("2330"))
+    task_id, _, _ = workqueue.claim(conn, "dead-worker", lease_seconds=-1)[0]
+
+    reclaimed = workqueue.claim(conn, "w2")
+
+    assert [t[0] for t in reclaimed] == [task_id]
+    # 原本的 worker 租約已被取走，晚到的結果不能覆寫
+    assert not workqueue.ack(conn, task_id, "dead-worker", [])
+    assert workqueue.ack(conn, task_id, "w2", [])
+
+def test_nack_requeues_until_max_attempts(conn):
+    workqueue.enqueue(conn, _tasks("2330"))
+    for attempt in range(3):
+        task_id, _, _ = workqueue.claim(conn, "w1")[0]
+        retry = workqueue.nack(conn, task_id, "w1", "HTTP 503", max_attempts=3)
+        assert retry == (attempt < 2)
+    assert _status(conn) == {"2330": "failed"}
+    assert workqueue.claim(conn, "w1") == []
+
+def test_worker_waits_for_other_leases_and_reclaims_expired(conn, queue_db, monkeypatch):
+    workqueue.enqueue(conn, _tasks("2330", "2317"))
+    # 另一個 worker 領走 2330 後中斷，租約 1 秒後過期
+    workqueue.claim(conn, "dead-worker", lease_seconds=1)
+    monkeypatch.setattr(workqueue, "execute", lambda session, kind, payload, base_url=None: [])
+
+    workqueue.run_worker(queue_db, "w1", sleep_seconds=0, poll_seconds=0.2)
+
+    assert _status(conn) == {"2330": "done", "2317": "done"}
+    assert workqueue.outstanding(conn) == (0, 0)
+
+def test_expired_leases_count_towards_max_attempts(conn):
+    # worker 每次都在執行中當掉、來不及 nack，不能無限重新領取
+    workqueue.enqueue(conn, _tasks("2330"))
+    for _ in range(3):
+        assert workqueue.claim(conn, "crashing-worker", lease_seconds=-1, max_attempts=3)
+
+    assert workqueue.claim(conn, "w2", max_attempts=3) == []
+    assert _status(conn) == {"2330": "failed"}
+    assert conn.execute("SELECT attempts FROM work_queue").fetchone()[0] == 3
+
+def test_worker_through_coordinator(conn, queue_db, monkeypatch):
+    workqueue.enqueue(conn, _tasks("2330", "2317"))
+    monkeypatch.setattr(workqueue, "execute", lambda session, kind, payload, base_url=None: [[payload["stock_no"]]])
+    server = workqueue.make_coordinator(queue_db, "127.0.0.1", 0, token="secret")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with pytest.raises(Exception, match="403"):
+            workqueue.RemoteQueue(url).outstanding()
+
+        workqueue.run_worker(None, "remote", sleep_seconds=0, poll_seconds=0.2, coordinator=url, token="secret")
+    finally:
+        server.shutdown()
+        server.server_close()
+        workqueue.CoordinatorHandler.conn.close()
+
+    assert _status(conn) == {"2330": "done", "2317": "done"}
+    results = conn.execute("SELECT result FROM work_queue ORDER BY task_key").fetchall()
+    assert [json.loads(r[0]) for r in results] == [[["2317"]], [["2330"]]]
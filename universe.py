@@ -0,0 +1,208 @@
+"""
+功能：上市/上櫃股票池登錄表（universe registry）。
+
+- read_cfg：twse.cfg / otc.cfg / portfolio.cfg 的唯一讀取函式（略過空行、# 註解行與缺少名稱的行）。
+- stock_universe 資料表：記錄各代號的市場、名稱、首次/最後出現日期與下市日期，
+  refresh 時由交易所上市（櫃）公司基本資料比對出新增與下市的代號。
+- 執行期間以 frozenset 保存，所有工具以 O(1) 判斷代號是否已下市，爬蟲自動略過下市代號。
+
+使用方法：
+    python universe.py refresh              # 更新登錄表並列出新增/下市代號
+    python universe.py refresh --write-cfg  # 同時改寫 twse.cfg / otc.cfg
+"""
+
+import os
+import sqlite3
+import argparse
+from datetime import datetime
+
+import requests
+
+import runlog
+
+log = runlog.get_logger("universe")
+
+DB_NAME = "stock_data.db"
+
+# 各市場上市（櫃）公司基本資料來源與欄位
+LISTING_SOURCES = {
+    "twse": {
+        "url": "https://openapi.twse.com.tw/v1/opendata/t187ap03_L",
+        "code_field": "公司代號",
+        "name_field": "公司簡稱",
+        "cfg": "twse.cfg",
+    },
+    "otc": {
+        "url": "https://www.tpex.org.tw/openapi/v1/mopsfe_t187ap03_O",
+        "code_field": "SecuritiesCompanyCode",
+        "name_field": "CompanyAbbreviation",
+        "cfg": "otc.cfg",
+    },
+}
+
+# 執行期間的唯讀快取
+_CACHE = {}
+
+# 讀取股票清單檔，回傳 [(股票代號, 股票名稱)]
+def read_cfg(cfg_path):
+    stock_list = []
+    if not os.path.exists(cfg_path):
+        return stock_list
+    with open(cfg_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue  # 跳過空行與註解行
+            parts = line.split()
+            if len(parts) >= 2:
+                stock_list.append((parts[0], parts[1]))  # (股票代號, 股票名稱)
+    return stock_list
+
+# 初始化資料表
+def init_db(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_universe (
+            stock_no TEXT PRIMARY KEY,
+            name TEXT,
+            market TEXT,
+            listed INTEGER,
+            first_seen TEXT,
+            last_seen TEXT,
+            delisted_at TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_universe_market ON stock_universe (market, listed)")
+    conn.commit()
+
+# 下載交易所目前的上市（櫃）公司清單，回傳 {代號: 簡稱}
+def fetch_listing(market):
+    source = LISTING_SOURCES[market]
+    resp = requests.get(source["url"], timeout=30)
+    resp.raise_for_status()
+    listing = {}
+    for item in resp.json():
+        code = str(item.get(source["code_field"]) or "").strip()
+        if code:
+            listing[code] = str(item.get(source["name_field"]) or "").strip()
+    return listing
+
+# 以最新清單更新登錄表，回傳 (新增代號, 下市代號)
+def apply_listing(conn, market, listing):
+    today = datetime.now().strftime("%Y-%m-%d")
+    rows = conn.execute(
+        "SELECT stock_no, listed FROM stock_universe WHERE market = ?", (market,)).fetchall()
+    known = {code: listed for code, listed in rows}
+
+    added = sorted(code for code in listing if not known.get(code))
+    delisted = sorted(code for code, listed in known.items() if listed and code not in listing)
+
+    with conn:
+        conn.executemany('''
+            INSERT OR IGNORE INTO stock_universe (stock_no, name, market, listed, first_seen, last_seen)
+            VALUES (?, ?, ?, 1, ?, ?)
+        ''', [(code, name, market, today, today) for code, name in listing.items()])
+        conn.executemany('''
+            UPDATE stock_universe
+            SET name = ?, market = ?, listed = 1, last_seen = ?, delisted_at = NULL
+            WHERE stock_no = ?
+        ''', [(name, market, today, code) for code, name in listing.items()])
+        conn.executemany('''
+            UPDATE stock_universe SET listed = 0, delisted_at = ? WHERE stock_no = ?
+        ''', [(today, code) for code in delisted])
+    _CACHE.clear()
+    return added, delisted
+
+# 初次建立登錄表時以既有 cfg 當作起點
+def seed_from_cfg(conn):
+    if conn.execute("SELECT 1 FROM stock_universe LIMIT 1").fetchone():
+        return
+    today = datetime.now().strftime("%Y-%m-%d")
+    with conn:
+        for market, source in LISTING_SOURCES.items():
+            conn.executemany('''
+                INSERT OR IGNORE INTO stock_universe (stock_no, name, market, listed, first_seen, last_seen)
+                VALUES (?, ?, ?, 1, ?, ?)
+            ''', [(code, name, market, today, today) for code, name in read_cfg(source["cfg"])])
+
+def write_cfg(conn, market, cfg_path):
+    rows = conn.execute('''
+        SELECT stock_no, name FROM stock_universe
+        WHERE market = ? AND listed = 1 ORDER BY stock_no
+    ''', (market,)).fetchall()
+    with open(cfg_path, "w", encoding="utf-8") as f:
+        for code, name in rows:
+            f.write(f"{code} {name}\n")
+
+def _registry_exists(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_universe'"
+    ).fetchone() is not None
+
+# 載入登錄表為唯讀集合：{"twse": frozenset, "otc": frozenset, "delisted": frozenset}
+def load_registry(db_name=DB_NAME):
+    if db_name in _CACHE:
+        return _CACHE[db_name]
+    registry = {"twse": frozenset(), "otc": frozenset(), "delisted": frozenset()}
+    if os.path.exists(db_name):
+        conn = sqlite3.connect(db_name)
+        if _registry_exists(conn):
+            rows = conn.execute("SELECT stock_no, market, listed FROM stock_universe").fetchall()
+            for market in ("twse", "otc"):
+                registry[market] = frozenset(c for c, m, listed in rows if m == market and listed)
+            registry["delisted"] = frozenset(c for c, _, listed in rows if not listed)
+        conn.close()
+    _CACHE[db_name] = registry
+    return registry
+
+def delisted_codes(db_name=DB_NAME):
+    return load_registry(db_name)["delisted"]
+
+def is_delisted(stock_no, db_name=DB_NAME):
+    return stock_no in load_registry(db_name)["delisted"]
+
+# 過濾掉已下市的代號（登錄表未建立時原樣回傳）
+def filter_listed(stock_list, db_name=DB_NAME):
+    delisted = delisted_codes(db_name)
+    if not delisted:
+        return stock_list
+    if isinstance(stock_list, dict):
+        return {code: name for code, name in stock_list.items() if code not in delisted}
+    return [item for item in stock_list
+            if (item[0] if isinstance(item, tuple) else item) not in delisted]
+
+def refresh(db_name=DB_NAME, write_cfgs=False):
+    conn = sqlite3.connect(db_name)
+    init_db(conn)
+    seed_from_cfg(conn)
+    for market, source in LISTING_SOURCES.items():
+        try:
+            listing = fetch_listing(market)
+        except Exception as e:
+            log.error("下載上市（櫃）清單失敗", market=market, error=e)
+            continue
+        if not listing:
+            log.warning("上市（櫃）清單為空，略過以免誤判全部下市", market=market)
+            continue
+        added, delisted = apply_listing(conn, market, listing)
+        runlog.incr("stocks_added", len(added), market=market)
+        runlog.incr("stocks_delisted", len(delisted), market=market)
+        log.info("清單更新", market=market, added=len(added), delisted=len(delisted),
+                 added_codes=",".join(added), delisted_codes=",".join(delisted))
+        if write_cfgs:
+            write_cfg(conn, market, source["cfg"])
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+    ref = sub.add_parser("refresh")
+    ref.add_argument("--write-cfg", action="store_true", help="依登錄表改寫 twse.cfg / otc.cfg")
+    args = parser.parse_args()
+    if args.command != "refresh":
+        parser.print_help()
+        return
+    runlog.setup("universe")
+    refresh(write_cfgs=args.write_cfg)
+
+if __name__ == "__main__":
+    main()
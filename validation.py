@@ -0,0 +1,202 @@
+"""
+功能：資料寫入後的驗證與異常偵測。
+
+對整張資料表一次讀入，以向量化規則檢查（零或負價、最高價低於最低價、
+均價落在高低價之外、極端年增率、股本為 0 等），並在每檔股票自己的歷史中
+以中位數/MAD 的穩健 z 分數找出離群值（期數不足 MIN_PERIODS 的股票不判斷）。
+
+所有可疑資料列都記錄到 quarantine 資料表（保留完整內容），但只有明確無效的
+規則（HARD_RULES：零或負值、最高價低於最低價）會自原資料表刪除；
+統計上的離群值可能是真實的大虧損或高本益比，缺值（NULL）可能只是尚未公布，
+都只記錄不刪除。
+
+使用方法：
+    python validation.py                 # 檢查並隔離可疑資料
+    python validation.py --report-only   # 只列出報告，不異動資料
+"""
+
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import point_in_time
+import runlog
+
+log = runlog.get_logger("validation")
+
+DB_NAME = "stock_data.db"
+ROBUST_Z_THRESHOLD = 10.0
+MAX_ABS_YOY = 1000.0
+MIN_PERIODS = 5  # 每檔股票至少要有的期數，才以其歷史判斷離群值
+
+# 明確無效、會自原資料表刪除的規則（只針對有值且無效者，比較運算遇到 NULL 為 False）；
+# 其餘規則（含 missing_* 缺值）只記錄到 quarantine
+HARD_RULES = frozenset([
+    "non_positive_price",
+    "high_below_low",
+    "negative_revenue",
+    "non_positive_capital",
+    "non_positive_per",
+])
+
+# 初始化隔離資料表
+def init_db(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quarantine (
+            tbl TEXT,
+            stock_no TEXT,
+            period TEXT,
+            rule TEXT,
+            detail TEXT,
+            row_json TEXT,
+            detected_at TEXT,
+            PRIMARY KEY (tbl, stock_no, period, rule)
+        )
+    ''')
+    conn.commit()
+
+# 在每檔股票自己的歷史中以中位數與 MAD 計算穩健 z 分數（以 groupby transform 向量化），
+# 期數不足 min_periods 或 MAD 為 0 的股票視為無離群值
+def stock_robust_z(df, values, min_periods=MIN_PERIODS):
+    values = pd.Series(np.asarray(values, dtype=float), index=df.index)
+    stock_no = df["stock_no"]
+    groups = values.groupby(stock_no)
+    median = groups.transform("median")
+    mad = (values - median).abs().groupby(stock_no).transform("median")
+    z = 0.6745 * (values - median) / mad
+    scored = (groups.transform("count") >= min_periods) & (mad > 0)
+    return z.where(scored, 0.0).to_numpy()
+
+def _price_rules(df, z_threshold):
+    high, low, avg = df["highest_price"], df["lowest_price"], df["average_close_price"]
+    return {
+        "non_positive_price": (high <= 0) | (low <= 0) | (avg <= 0),
+        "missing_price": high.isna() | low.isna() | avg.isna(),
+        "high_below_low": high < low,
+        "average_outside_range": (avg < low * 0.999) | (avg > high * 1.001),
+        "price_range_outlier": np.abs(stock_robust_z(df, np.log(high / low))) > z_threshold,
+    }
+
+def _revenue_rules(df, z_threshold):
+    yoy = df["yoy_growth"]
+    return {
+        "negative_revenue": df["monthly_revenue"] < 0,
+        "extreme_yoy": yoy.abs() > MAX_ABS_YOY,
+        "yoy_outlier": np.abs(stock_robust_z(df, yoy)) > z_threshold,
+    }
+
+def _quarterly_rules(df, z_threshold):
+    return {
+        "non_positive_capital": df["capital"] <= 0,
+        "missing_capital": df["capital"].isna(),
+        "negative_revenue": df["quarter_revenue"] < 0,
+        "eps_outlier": np.abs(stock_robust_z(df, df["eps"])) > z_threshold,
+    }
+
+def _per_rules(df, z_threshold):
+    high, avg, low = df["highest_per"], df["average_per"], df["lowest_per"]
+    return {
+        "non_positive_per": (high <= 0) | (avg <= 0) | (low <= 0),
+        "missing_per": high.isna() | avg.isna() | low.isna(),
+        "high_below_low": high < low,
+        "per_outlier": np.abs(stock_robust_z(df, np.log(avg.where(avg > 0)))) > z_threshold,
+    }
+
+# 各資料表的檢查規則；主鍵欄位沿用 point_in_time 的設定
+RULES = {
+    "YearlyData": _price_rules,
+    "OTCYearlyData": _price_rules,
+    "monthly_revenue": _revenue_rules,
+    "stock_quarterly": _quarterly_rules,
+    "YearlyPER": _per_rules,
+}
+
+# 對單一資料表一次套用所有規則，回傳可疑列 (含觸發的規則)
+def check_table(conn, table, z_threshold=ROBUST_Z_THRESHOLD):
+    df = pd.read_sql(f"SELECT * FROM {table}", conn)
+    if df.empty:
+        return df.assign(rule=[])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        masks = RULES[table](df, z_threshold)
+    flagged = []
+    for rule, mask in masks.items():
+        mask = np.asarray(mask, dtype=bool)
+        if mask.any():
+            flagged.append(df[mask].assign(rule=rule))
+    if not flagged:
+        return df.iloc[0:0].assign(rule=[])
+    return pd.concat(flagged, ignore_index=True)
+
+# 將可疑列寫入 quarantine，只有觸發 HARD_RULES 的列自原資料表刪除，回傳刪除筆數
+def quarantine_rows(conn, table, flagged):
+    stock_col, period_col = point_in_time.VERSIONED_TABLES[table]
+    data_cols = [c for c in flagged.columns if c != "rule"]
+    now = datetime.now().isoformat(timespec="seconds")
+    records = []
+    for row in flagged.to_dict("records"):
+        payload = {c: (None if pd.isna(row[c]) else row[c]) for c in data_cols}
+        detail = ", ".join(f"{c}={payload[c]}" for c in data_cols if c not in (stock_col, period_col))
+        records.append((table, str(row[stock_col]), str(row[period_col]), row["rule"], detail,
+                        json.dumps(payload, ensure_ascii=False, default=str), now))
+    keys = sorted({(r[1], r[2]) for r in records if r[3] in HARD_RULES})
+    # 只寫入新的或內容有變的紀錄：留在原表的離群值每次都會再被標出，
+    # 重複寫入會改動資料庫修改時間，使 eps_report 的估值快取失效
+    recorded = {
+        (s, p, r): j for s, p, r, j in
+        conn.execute("SELECT stock_no, period, rule, row_json FROM quarantine WHERE tbl = ?", (table,))
+    }
+    records = [r for r in records if recorded.get((r[1], r[2], r[3])) != r[5]]
+    with conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO quarantine (tbl, stock_no, period, rule, detail, row_json, detected_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', records)
+        conn.executemany(f"DELETE FROM {table} WHERE {stock_col} = ? AND {period_col} = ?", keys)
+    return len(keys)
+
+def run(conn, report_only=False, z_threshold=ROBUST_Z_THRESHOLD):
+    init_db(conn)
+    summary = {}
+    for table in RULES:
+        if not point_in_time.table_exists(conn, table):
+            continue
+        flagged = check_table(conn, table, z_threshold)
+        if flagged.empty:
+            log.info("無可疑資料", table=table)
+            continue
+        counts = {rule: int(n) for rule, n in flagged["rule"].value_counts().items()}
+        summary[table] = counts
+        for rule, n in counts.items():
+            runlog.incr("rows_flagged", n, table=table, rule=rule)
+        log.info("可疑資料", table=table, **counts)
+        stock_col, period_col = point_in_time.VERSIONED_TABLES[table]
+        for row in flagged.head(20).itertuples(index=False):
+            log.debug("可疑資料列", table=table, stock_no=getattr(row, stock_col),
+                      period=getattr(row, period_col), rule=row.rule)
+        if not report_only:
+            moved = quarantine_rows(conn, table, flagged)
+            runlog.incr("rows_quarantined", moved, table=table)
+            log.info("已記錄隔離資料", table=table, recorded=len(flagged), deleted=moved)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--report-only", action="store_true", help="只列出報告，不移動資料")
+    parser.add_argument("--z-threshold", type=float, default=ROBUST_Z_THRESHOLD)
+    parser.add_argument("--json", type=str, help="將各表各規則筆數輸出為 JSON 檔")
+    args = parser.parse_args()
+
+    runlog.setup("validation")
+    conn = sqlite3.connect(DB_NAME)
+    summary = run(conn, args.report_only, args.z_threshold)
+    conn.close()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,583 @@
+"""
+功能：以 SQLite 工作佇列分散大量歷史回補的抓取工作。
+
+- enqueue：把 getTWSE / getOTC 的個股年度資料、get_monthly_revenue 的月營收 CSV
+  拆成一筆筆工作寫入 work_queue 資料表（重複加入會被忽略）。
+- serve：協調者行程，唯一開啟佇列檔，以 HTTP 提供 claim / ack / nack，
+  讓其他主機（不同 IP，各自分攤交易所的流量限制）的 worker 領取工作。
+- worker：以租約 (lease) 方式領取工作，完成後回報結果；逾時未回報的租約會被重新領取
+  並計入嘗試次數，失敗（含逾時）達上限則標記 failed。
+  加上 --coordinator 時經由協調者存取佇列，否則直接開啟本機的佇列檔。
+  佇列檔使用 WAL 模式，只能放在協調者所在主機的本機磁碟（WAL 依賴共享記憶體，
+  放在 NFS / SMB 等網路磁碟上可能損毀），其他主機一律透過 serve 存取。
+- merge：把已完成工作的結果以 INSERT OR REPLACE 併入 stock_data.db，可重複執行。
+- stub：本機假資料伺服器，搭配 --base-url 在本機以多個 worker 測試整個流程。
+
+使用方法：
+    python workqueue.py enqueue --kind yearly_twse --start-year 2013
+    python workqueue.py enqueue --kind monthly_revenue --start 2013-01 --end 2024-12
+    python workqueue.py serve --port 8780                                 # 在佇列檔所在的主機執行
+    python workqueue.py worker --processes 4 --coordinator http://hostA:8780   # 在各台主機執行
+    python workqueue.py merge
+    python workqueue.py status
+
+本機測試：
+    python workqueue.py stub --port 8765 &
+    python workqueue.py worker --processes 4 --sleep 0 --base-url http://127.0.0.1:8765
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from multiprocessing import Process
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import fast_decode
+import getTWSE
+import getOTC
+import get_monthly_revenue
+import runlog
+import universe
+from fetch_common import INSERT_SQL, with_base
+
+log = runlog.get_logger("workqueue")
+
+DB_NAME = "stock_data.db"
+QUEUE_DB = "work_queue.db"
+LEASE_SECONDS = 300
+POLL_SECONDS = 5    # 沒有可領取的工作但仍有租約未結束時，重新檢查的間隔
+COORDINATOR_PORT = 8780
+MAX_ATTEMPTS = 5
+
+# 各種工作對應的市場設定與寫入的資料表
+TASK_KINDS = {
+    "yearly_twse": {"table": "YearlyData", "cfg": "twse.cfg"},
+    "yearly_otc": {"table": "OTCYearlyData", "cfg": "otc.cfg"},
+    "monthly_revenue": {"table": "monthly_revenue"},
+}
+REVENUE_MARKETS = {"twse": ("twse.cfg", "/t21/sii/"), "otc": ("otc.cfg", "/t21/otc/")}
+
+# 初始化佇列資料表
+def init_queue(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS work_queue (
+            task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            task_key TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires REAL,
+            result TEXT,
+            error TEXT,
+            merged INTEGER DEFAULT 0,
+            updated_at TEXT,
+            UNIQUE (kind, task_key)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_work_queue_status ON work_queue (status, lease_expires)")
+    conn.commit()
+
+# 佇列檔只供協調者所在的主機開啟（WAL 不支援網路磁碟），其他主機經由 serve 存取
+def connect_queue(queue_db, check_same_thread=True):
+    conn = sqlite3.connect(queue_db, timeout=60, isolation_level=None, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    init_queue(conn)
+    return conn
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+# 個股年度資料的工作：每檔股票一筆
+def yearly_tasks(kind, first_year):
+    stocks = universe.filter_listed(universe.read_cfg(TASK_KINDS[kind]["cfg"]))
+    return [(kind, code, {"stock_no": code, "first_year": first_year}) for code, _ in stocks]
+
+# 月營收的工作：每個市場每個月份一筆
+def revenue_tasks(start, end):
+    tasks = []
+    year, month = start
+    while (year, month) <= end:
+        for market in REVENUE_MARKETS:
+            key = f"{market}:{year}-{month:02d}"
+            tasks.append(("monthly_revenue", key, {"market": market, "year": year, "month": month}))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return tasks
+
+def enqueue(conn, tasks):
+    before = conn.total_changes
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany('''
+        INSERT OR IGNORE INTO work_queue (kind, task_key, payload, updated_at) VALUES (?, ?, ?, ?)
+    ''', [(kind, key, json.dumps(payload), _now()) for kind, key, payload in tasks])
+    conn.execute("COMMIT")
+    return conn.total_changes - before
+
+# 領取工作，於同一個寫入交易中標記租約。
+# 租約逾時視為一次失敗（worker 可能每次都在執行中當掉而來不及 nack），達上限則標記 failed
+def claim(conn, worker_id, limit=1, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute('''
+            UPDATE work_queue
+            SET attempts = attempts + 1,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                lease_owner = NULL, lease_expires = NULL, error = ?, updated_at = ?
+            WHERE status = 'leased' AND lease_expires < ?
+        ''', (max_attempts, "租約逾時未回報", _now(), now))
+        rows = conn.execute('''
+            SELECT task_id, kind, payload FROM work_queue
+            WHERE status = 'pending'
+            ORDER BY task_id LIMIT ?
+        ''', (limit,)).fetchall()
+        conn.executemany('''
+            UPDATE work_queue SET status = 'leased', lease_owner = ?, lease_expires = ?, updated_at = ?
+            WHERE task_id = ?
+        ''', [(worker_id, now + lease_seconds, _now(), task_id) for task_id, _, _ in rows])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return [(task_id, kind, json.loads(payload)) for task_id, kind, payload in rows]
+
+# 回報完成；租約已被他人取走時不覆寫，回傳是否成功
+def ack(conn, task_id, worker_id, records):
+    cur = conn.execute('''
+        UPDATE work_queue SET status = 'done', result = ?, error = NULL, merged = 0, updated_at = ?
+        WHERE task_id = ? AND status = 'leased' AND lease_owner = ?
+    ''', (json.dumps(records, ensure_ascii=False), _now(), task_id, worker_id))
+    return cur.rowcount == 1
+
+# 回報失敗：未達上限則放回佇列，回傳是否會再重試
+def nack(conn, task_id, worker_id, error, max_attempts=MAX_ATTEMPTS):
+    conn.execute('''
+        UPDATE work_queue
+        SET attempts = attempts + 1,
+            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+            lease_owner = NULL, lease_expires = NULL, error = ?, updated_at = ?
+        WHERE task_id = ? AND status = 'leased' AND lease_owner = ?
+    ''', (max_attempts, str(error)[:500], _now(), task_id, worker_id))
+    row = conn.execute("SELECT status FROM work_queue WHERE task_id = ?", (task_id,)).fetchone()
+    return row is not None and row[0] == "pending"
+
+def _yearly_records(module, stock_no, data, first_year):
+    result = module.parse_yearly_rows(stock_no, data, exists=lambda s, y: False, first_year=first_year)
+    return [
+        [stock_no, year, s["highest_price"], s["highest_date"],
+         s["lowest_price"], s["lowest_date"], s["average_close_price"]]
+        for year, s in sorted(result.items())
+    ]
+
+# 執行單一工作，回傳要寫入的資料列
+def execute(session, kind, payload, base_url=None):
+    if kind == "yearly_twse":
+        stock_no = payload["stock_no"]
+        url = with_base(getTWSE.FMNPTK_URL.format(stock_no), base_url)
+        response = session.get(url, headers=getTWSE.HEADERS, timeout=60)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+        data = getTWSE.extract_annual_table(fast_decode.loads(response.content), stock_no)
+        return _yearly_records(getTWSE, stock_no, data, payload.get("first_year"))
+
+    if kind == "yearly_otc":
+        stock_no = payload["stock_no"]
+        url = with_base(getOTC.YEARLY_STOCK_URL, base_url)
+        form = {"code": stock_no, "id": "", "response": "json"}
+        response = session.post(url, headers=getOTC.HEADERS, data=form, timeout=60)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+        data = getOTC.extract_annual_table(fast_decode.loads(response.content), stock_no)
+        return _yearly_records(getOTC, stock_no, data, payload.get("first_year"))
+
+    if kind == "monthly_revenue":
+        _, filepath = REVENUE_MARKETS[payload["market"]]
+        report_date = datetime(payload["year"], payload["month"], 1)
+        _, form, report_month = get_monthly_revenue.build_request(filepath, report_date)
+        response = session.post(with_base(get_monthly_revenue.MOPS_URL, base_url), data=form, timeout=60)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+        response.encoding = "utf-8"
+        df = get_monthly_revenue.parse_csv(response.text)
+        if df is None:
+            raise Exception("CSV 解析失敗")
+        # 保留全部公司，合併時才依本機股票清單過濾
+        codes = df["公司代號"].astype(str) if "公司代號" in df.columns else []
+        df = get_monthly_revenue.process_data(df, codes, report_month)
+        if df is None:
+            raise Exception("CSV 缺少必要欄位")
+        columns = ["stock_no", "monthly_revenue", "yoy_growth", "revenue_month"]
+        return json.loads(df[columns].to_json(orient="values", force_ascii=False))
+
+    raise ValueError(f"未知的工作類型: {kind}")
+
+# 尚未結束的工作數：(pending, leased)
+def outstanding(conn):
+    rows = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM work_queue WHERE status IN ('pending', 'leased') GROUP BY status").fetchall())
+    return rows.get("pending", 0), rows.get("leased", 0)
+
+class LocalQueue:
+    """直接開啟本機佇列檔（與協調者同一台主機時使用）。"""
+
+    def __init__(self, queue_db):
+        self.conn = connect_queue(queue_db)
+
+    def claim(self, worker_id, limit, lease_seconds):
+        return claim(self.conn, worker_id, limit, lease_seconds)
+
+    def ack(self, task_id, worker_id, records):
+        return ack(self.conn, task_id, worker_id, records)
+
+    def nack(self, task_id, worker_id, error):
+        return nack(self.conn, task_id, worker_id, error)
+
+    def outstanding(self):
+        return outstanding(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+class RemoteQueue:
+    """經由協調者 (workqueue.py serve) 的 HTTP 介面存取佇列，連線錯誤時自動重試。"""
+
+    def __init__(self, coordinator, token=None):
+        self.url = coordinator.rstrip("/")
+        self.session = requests.Session()
+        retry = Retry(total=5, connect=5, read=2, backoff_factor=1, allowed_methods=None,
+                      status_forcelist=[502, 503, 504])
+        self.session.mount("http://", HTTPAdapter(max_retries=retry))
+        self.session.mount("https://", HTTPAdapter(max_retries=retry))
+        if token:
+            self.session.headers["X-Queue-Token"] = token
+
+    def _call(self, action, **body):
+        response = self.session.post(f"{self.url}/{action}", json=body, timeout=60)
+        if response.status_code != 200:
+            raise Exception(f"協調者回應 HTTP {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def claim(self, worker_id, limit, lease_seconds):
+        reply = self._call("claim", worker_id=worker_id, limit=limit, lease_seconds=lease_seconds)
+        return [tuple(task) for task in reply["tasks"]]
+
+    def ack(self, task_id, worker_id, records):
+        return self._call("ack", task_id=task_id, worker_id=worker_id, records=records)["ok"]
+
+    def nack(self, task_id, worker_id, error):
+        return self._call("nack", task_id=task_id, worker_id=worker_id, error=str(error))["retry"]
+
+    def outstanding(self):
+        reply = self._call("outstanding")
+        return reply["pending"], reply["leased"]
+
+    def close(self):
+        self.session.close()
+
+# worker 主迴圈：領取、執行、回報，所有工作結束（沒有 pending 也沒有 leased）才離開；
+# coordinator 指定時經由協調者存取佇列，run_name 為計數器檔案名稱
+def run_worker(queue_db, worker_id, base_url=None, sleep_seconds=3, lease_seconds=LEASE_SECONDS, max_tasks=None,
+               run_name=None, poll_seconds=POLL_SECONDS, coordinator=None, token=None):
+    if run_name:
+        runlog.setup(run_name)
+    queue = RemoteQueue(coordinator, token) if coordinator else LocalQueue(queue_db)
+    session = requests.Session()
+    done = failed = 0
+    while max_tasks is None or done + failed < max_tasks:
+        tasks = queue.claim(worker_id, 1, lease_seconds)
+        if not tasks:
+            # 其他 worker 仍持有租約時繼續等待，若其行程中斷，租約逾時後由這裡重新領取
+            pending, leased = queue.outstanding()
+            if not pending and not leased:
+                break
+            time.sleep(min(poll_seconds, lease_seconds))
+            continue
+        task_id, kind, payload = tasks[0]
+        try:
+            records = execute(session, kind, payload, base_url)
+            if queue.ack(task_id, worker_id, records):
+                done += 1
+                runlog.incr("tasks_done", kind=kind)
+                runlog.incr("rows_fetched", len(records), kind=kind)
+            else:
+                log.warning("租約已失效，結果捨棄", worker=worker_id, task_id=task_id)
+        except Exception as e:
+            if queue.nack(task_id, worker_id, e):
+                runlog.incr("http_retries", kind=kind)
+            else:
+                runlog.incr("tasks_failed", kind=kind)
+            log.warning("工作失敗", worker=worker_id, task_id=task_id, kind=kind, payload=payload, error=e)
+            failed += 1
+        if sleep_seconds:
+            time.sleep(sleep_seconds)
+    queue.close()
+    log.info("worker 結束", worker=worker_id, done=done, failed=failed)
+    # multiprocessing 子行程不會執行 atexit，直接輸出計數器
+    if run_name:
+        runlog.finish()
+
+def _stock_filter():
+    codes = set()
+    for cfg, _ in REVENUE_MARKETS.values():
+        codes.update(code for code, _ in universe.filter_listed(universe.read_cfg(cfg)))
+    return codes
+
+# 將已完成但尚未併入的結果寫入 stock_data.db；以主鍵 INSERT OR REPLACE，可重複執行
+def merge(queue_db, db_name=DB_NAME):
+    qconn = connect_queue(queue_db)
+    getTWSE.init_db()
+    getOTC.init_db()
+    get_monthly_revenue.init_db(db_name, "monthly_revenue")
+    revenue_codes = _stock_filter()
+
+    conn = sqlite3.connect(db_name, timeout=60)
+    rows = qconn.execute('''
+        SELECT task_id, kind, result FROM work_queue WHERE status = 'done' AND merged = 0
+    ''').fetchall()
+    counts = {}
+    with conn:
+        for task_id, kind, result in rows:
+            records = json.loads(result)
+            if kind == "monthly_revenue" and revenue_codes:
+                records = [r for r in records if r[0] in revenue_codes]
+            table = TASK_KINDS[kind]["table"]
+            conn.executemany(INSERT_SQL[table], records)
+            counts[table] = counts.get(table, 0) + len(records)
+            runlog.incr("rows_upserted", len(records), table=table)
+    conn.close()
+    qconn.executemany("UPDATE work_queue SET merged = 1 WHERE task_id = ?", [(r[0],) for r in rows])
+    qconn.close()
+    print(f"併入 {len(rows)} 筆工作: " + ", ".join(f"{t} {n} 列" for t, n in sorted(counts.items())))
+    return counts
+
+def status(queue_db):
+    conn = connect_queue(queue_db)
+    rows = conn.execute('''
+        SELECT kind, status, COUNT(*), SUM(merged) FROM work_queue GROUP BY kind, status ORDER BY kind, status
+    ''').fetchall()
+    for kind, state, n, merged in rows:
+        print(f"{kind:16s} {state:8s} {n:6d}  已併入 {merged or 0}")
+    for task_id, kind, task_key, error in conn.execute('''
+        SELECT task_id, kind, task_key, error FROM work_queue WHERE status = 'failed' ORDER BY task_id LIMIT 20
+    '''):
+        print(f"    failed {task_id} {kind} {task_key}: {error}")
+    conn.close()
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+# 協調者：唯一開啟佇列檔的行程，所有請求共用一個連線並依序處理
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    conn = None
+    token = None
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self, action, body):
+        if action == "claim":
+            tasks = claim(self.conn, body["worker_id"], int(body.get("limit", 1)),
+                          float(body.get("lease_seconds", LEASE_SECONDS)))
+            runlog.incr("tasks_leased", len(tasks))
+            return {"tasks": tasks}
+        if action == "ack":
+            return {"ok": ack(self.conn, body["task_id"], body["worker_id"], body["records"])}
+        if action == "nack":
+            return {"retry": nack(self.conn, body["task_id"], body["worker_id"], body.get("error", ""))}
+        if action == "outstanding":
+            pending, leased = outstanding(self.conn)
+            return {"pending": pending, "leased": leased}
+        return None
+
+    def do_POST(self):
+        if self.token and self.headers.get("X-Queue-Token") != self.token:
+            return self._reply(403, {"error": "token 不符"})
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            with self.lock:
+                reply = self._dispatch(self.path.strip("/"), body)
+        except Exception as e:
+            log.error("協調者處理失敗", path=self.path, error=e)
+            return self._reply(500, {"error": str(e)})
+        if reply is None:
+            return self._reply(404, {"error": f"未知的動作: {self.path}"})
+        self._reply(200, reply)
+
+def make_coordinator(queue_db, host="0.0.0.0", port=COORDINATOR_PORT, token=None):
+    # 連線由各請求執行緒共用，存取一律以 lock 串行化
+    CoordinatorHandler.conn = connect_queue(queue_db, check_same_thread=False)
+    CoordinatorHandler.token = token
+    return _ThreadingServer((host, port), CoordinatorHandler)
+
+def serve_coordinator(queue_db, host, port, token=None):
+    server = make_coordinator(queue_db, host, port, token)
+    log.info("協調者已啟動", queue_db=queue_db, url=f"http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    finally:
+        CoordinatorHandler.conn.close()
+
+# 本機假資料伺服器：依代號產生固定的年度資料與營收 CSV
+class StubHandler(BaseHTTPRequestHandler):
+    fail_every = 0
+    counter = [0]
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _should_fail(self):
+        with self.lock:
+            self.counter[0] += 1
+            return self.fail_every and self.counter[0] % self.fail_every == 0
+
+    @staticmethod
+    def _yearly_rows(stock_no, otc):
+        base = 10 + int(stock_no[:4]) % 500 if stock_no[:4].isdigit() else 50
+        rows = []
+        for year in range(2010, datetime.now().year):
+            high, low = base * 1.3 + year % 7, base * 0.8
+            roc = str(year - 1911)
+            row = [roc, "1,000", "2,000", "300"]
+            if otc:
+                row.append("0")
+            # 日期欄位格式與交易所一致：上市 M/DD、上櫃 MM/DD
+            high_date, low_date = ("03/01", "09/01") if otc else ("3/01", "9/01")
+            row += [f"{high:,.2f}", high_date, f"{low:,.2f}", low_date, f"{(high + low) / 2:,.2f}"]
+            rows.append(row)
+        return rows
+
+    def do_GET(self):
+        if self._should_fail():
+            return self._send(503, "busy", "text/plain")
+        query = parse_qs(urlsplit(self.path).query)
+        stock_no = query.get("stockNo", ["0000"])[0]
+        body = {"tables": [{"fields": ["年度"], "data": self._yearly_rows(stock_no, otc=False)}]}
+        self._send(200, json.dumps(body, ensure_ascii=False), "application/json")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if self._should_fail():
+            return self._send(503, "busy", "text/plain")
+        if "fileName" in form:
+            codes = sorted(_stock_filter()) or ["1101", "2330"]
+            lines = ["公司代號,營業收入-當月營收,營業收入-去年同月增減(%)"]
+            lines += [f"{code},{1000 + i},{(i % 21) - 10}" for i, code in enumerate(codes)]
+            return self._send(200, "﻿" + "\n".join(lines) + "\n", "text/csv")
+        stock_no = form.get("code", ["0000"])[0]
+        body = {"tables": [{"fields": ["年度"], "data": self._yearly_rows(stock_no, otc=True)}]}
+        self._send(200, json.dumps(body, ensure_ascii=False), "application/json")
+
+def serve_stub(port, fail_every=0):
+    StubHandler.fail_every = fail_every
+    server = _ThreadingServer(("127.0.0.1", port), StubHandler)
+    print(f"假資料伺服器: http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
+
+def _parse_month(text):
+    year, month = text.split("-")
+    return int(year), int(month)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queue-db", type=str, default=QUEUE_DB,
+                        help="佇列檔案（需放在協調者主機的本機磁碟，不可放在網路磁碟）")
+    sub = parser.add_subparsers(dest="command")
+
+    enq = sub.add_parser("enqueue")
+    enq.add_argument("--kind", choices=list(TASK_KINDS), required=True)
+    enq.add_argument("--start-year", type=int, default=datetime.now().year - 10, help="年度資料回補起始年")
+    enq.add_argument("--start", type=str, default="2013-01", help="月營收起始月份 YYYY-MM")
+    enq.add_argument("--end", type=str, default=datetime.now().strftime("%Y-%m"), help="月營收結束月份 YYYY-MM")
+
+    wrk = sub.add_parser("worker")
+    wrk.add_argument("--worker-id", type=str, default=socket.gethostname())
+    wrk.add_argument("--processes", type=int, default=1, help="本機啟動的 worker 行程數")
+    wrk.add_argument("--base-url", type=str, help="以此取代各交易所網址的主機（例如本機假資料伺服器）")
+    wrk.add_argument("--sleep", type=float, default=3, help="每筆工作後暫停秒數")
+    wrk.add_argument("--lease", type=int, default=LEASE_SECONDS, help="租約秒數")
+    wrk.add_argument("--max-tasks", type=int, help="每個行程最多處理的工作數")
+    wrk.add_argument("--poll", type=float, default=POLL_SECONDS, help="等待其他租約結束時的檢查間隔秒數")
+    wrk.add_argument("--coordinator", type=str, help="協調者網址（例如 http://hostA:8780），未指定時直接開啟 --queue-db")
+    wrk.add_argument("--token", type=str, default=os.getenv("WORKQUEUE_TOKEN"), help="協調者的共用密鑰")
+
+    srv = sub.add_parser("serve")
+    srv.add_argument("--host", type=str, default="0.0.0.0")
+    srv.add_argument("--port", type=int, default=COORDINATOR_PORT)
+    srv.add_argument("--token", type=str, default=os.getenv("WORKQUEUE_TOKEN"),
+                     help="要求 worker 帶上相同的密鑰（X-Queue-Token）")
+
+    sub.add_parser("merge")
+    sub.add_parser("status")
+
+    stub = sub.add_parser("stub")
+    stub.add_argument("--port", type=int, default=8765)
+    stub.add_argument("--fail-every", type=int, default=0, help="每 N 個請求回傳一次 503，用來測試重試")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        if args.kind == "monthly_revenue":
+            tasks = revenue_tasks(_parse_month(args.start), _parse_month(args.end))
+        else:
+            tasks = yearly_tasks(args.kind, args.start_year)
+        conn = connect_queue(args.queue_db)
+        added = enqueue(conn, tasks)
+        conn.close()
+        print(f"加入 {added} 筆工作（共 {len(tasks)} 筆，其餘已在佇列中）")
+    elif args.command == "worker":
+        procs = [
+            Process(target=run_worker, args=(args.queue_db, f"{args.worker_id}-{os.getpid()}-{i}",
+                                             args.base_url, args.sleep, args.lease, args.max_tasks,
+                                             f"workqueue_worker_{i}", args.poll, args.coordinator, args.token))
+            for i in range(args.processes)
+        ]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+    elif args.command == "serve":
+        runlog.setup("workqueue_coordinator")
+        serve_coordinator(args.queue_db, args.host, args.port, args.token)
+    elif args.command == "merge":
+        runlog.setup("workqueue_merge")
+        merge(args.queue_db)
+    elif args.command == "status":
+        status(args.queue_db)
+    elif args.command == "stub":
+        serve_stub(args.port, args.fail_every)
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()